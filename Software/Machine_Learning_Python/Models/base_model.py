@@ -12,14 +12,19 @@ from abc import ABC, abstractmethod
 class BaseModel(ABC):
     """
     This is an abstract class that should be implemented by subclasses.
-    It lets a user to generate transcriber objects from .wav to .mid. After a 
+    It lets a user to generate transcriber objects from audio files to .mid. After a 
     setup, an object can perform an inference over an audio directory.
     Pipeline order:
         model = Model(args)  # Create a new transcriber.
         model.set_audio_dir(audio_dir_path)  # Set the audio source directory.
-        model.run()  # Resulted .mid files are saved in audio_dir_path.
+        model.run()  # Resulted .mid files are saved in audio_dir_path and/or returned.
+    Or, for several directories at once:
+        model.run_batch([audio_dir_path1, audio_dir_path2])
     """
 
+    # True if run_batch() batches several directories into the same model calls (see run_batch()):
+    supports_batching = False
+
 
     @abstractmethod
     def __init__(self, args: list[str]):
@@ -45,7 +50,50 @@ class BaseModel(ABC):
     @abstractmethod
     def run(self):
         """
-        Generate midi files for each of the .wav audio files located inside "audio_dir_path" directory.
-        The midi files are saved in the same directory with appropriate names and results may or may not be returned.
+        Generate midi files for each of the audio files located inside "audio_dir_path" directory.
+        The midi files are saved in the same directory with appropriate names, and/or their bytes are returned
+        in the result's "data" (see consts["midi_output"]).
+        """
+        pass
+
+
+    def run_batch(self, audio_dir_paths: list[str]) -> list:
+        """
+        Transcribe several audio directories and return their results (in the same order). Each directory's 
+        failure is its own result and doesn't fail the others.
+        The default implementation runs them one by one (set_audio_dir() then run()). A subclass that can 
+        batch several directories into shared model calls overrides it, and sets "supports_batching".
+        """
+        results = []
+        for audio_dir_path in audio_dir_paths:
+            try:
+                self.set_audio_dir(audio_dir_path)
+                results.append(self.run())
+            except Exception as exp:
+                results.append(exp)
+        return results
+
+
+    def midi_fname(self, audio_fname: str) -> str | None:
+        """
+        Return the name of the midi file that run() produces for the audio file "audio_fname" (a file name, 
+        not a path), e.g. for matching a result to its audio file. None if the name isn't known in advance.
+        The default implementation returns None.
+        """
+        return None
+
+
+    def warm_up(self) -> None:
+        """
+        Load whatever the model needs for an inference ahead of the first run() call (optional).
+        The default implementation does nothing.
+        """
+        pass
+
+
+    def release(self) -> None:
+        """
+        Free the resources that warm_up() or run() keep in memory between calls (optional). The next 
+        run() loads them again. The default implementation does nothing.
         """
         pass
@@ -8,11 +8,16 @@ basic-pitch <output-directory> <input-audio-path>
 """
 
 import os, sys, logging
+import io
 import json
 
 # Import project utilities:
 from utils_py.serialized_objects import TranscribedMidiData
 from utils_py.loggers import ENVS, log, error_log
+from utils_py.audio_decoding import decode_audio, list_audio_files
+from utils_py.tracing import span
+from utils_py.progress import report_progress, has_listener, midi_notes
+from utils_py.cancellation import get_cancellation
 
 # Load the consts.json as a json dict:
 solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -31,24 +36,43 @@ logging.getLogger("tensorflow").setLevel(logging.CRITICAL)
 logging.getLogger().setLevel(logging.CRITICAL)
 
 # Import AI model:
-from basic_pitch.inference import predict_and_save, Model, build_output_path, OutputExtensions
+import numpy as np
+from basic_pitch.inference import Model, unwrap_output
+from basic_pitch.constants import AUDIO_N_SAMPLES, AUDIO_SAMPLE_RATE, FFT_HOP
+from basic_pitch import note_creation as infer
 from basic_pitch import ICASSP_2022_MODEL_PATH
 from .base_model import BaseModel
 
 script_name = os.path.basename(__file__)  # Will be usefull for logging.
 
+# Inference parameters (the defaults of basic_pitch.inference.predict()):
+n_overlapping_frames = 30
+overlap_len = n_overlapping_frames * FFT_HOP
+hop_size = AUDIO_N_SAMPLES - overlap_len
+onset_threshold = 0.5
+frame_threshold = 0.3
+minimum_note_length_ms = 127.70
+midi_tempo = 120
+midi_postfix = '_basic_pitch.mid'  # The resulted midi file name is: <audio file name><midi_postfix>.
+max_batch_windows = consts["batching"]["max_batch_windows"]  # Max audio windows in a single model call.
+midi_output = consts["midi_output"]  # Save the midi files to the disk, return their bytes, or both.
+
 class BasicPitch(BaseModel):
     """
     The class implements the BaseModel abstract class. It uses spotify's basic-pitch AI 
-    model and lets a user to generate transcriber objects that transcribe librosa-supported 
-    audio formats (.mp3, .ogg, .wav, .flac, .m4a) to midi (.mid). After a setup, an 
+    model and lets a user to generate transcriber objects that transcribe the audio formats in 
+    consts["valid_audio_extensions"] (.mp3, .ogg, .wav, .flac, .m4a, ...) to midi (.mid). After a setup, an 
     object can perform an inference over an audio directory.
+    The model is called with batches of audio windows, which may come from several files 
+    and several directories (see run_batch()).
     Pipeline order:
         model = BasicPitch(args)  # Create a new transcriber.
         model.set_audio_dir(audio_dir_path)  # Set the audio source directory.
-        model.run()  # Resulted .mid files are saved in audio_dir_path.
+        model.run()  # Resulted .mid files are saved in audio_dir_path (and/or returned, see consts["midi_output"]).
     """
 
+    supports_batching = True
+
     def __init__(self, args: list[str] = []):
         """
         Creates a new transcriber.
@@ -64,7 +88,7 @@ class BasicPitch(BaseModel):
         The resulted midis shall be stored there.
         Return True if the setup succeeded, False if the directory is invalid.
 
-        audio_dir_path - The audio directory. should contain librosa supported sound files (.mp3, .wav, ...)."""
+        audio_dir_path - The audio directory. should contain supported sound files (.mp3, .wav, ...)."""
 
         # Check input validity:
         if not super().set_audio_dir(audio_dir_path):
@@ -76,7 +100,7 @@ class BasicPitch(BaseModel):
 
     def run(self) -> TranscribedMidiData:
         """
-        Generate midi files for each of the .wav audio files located inside "audio_dir_path" directory.
+        Generate midi files for each of the audio files located inside "audio_dir_path" directory.
         The midi files are saved in the same directory with appropriate names and a TranscribedMidiData object 
         is then returned.
         The process of converting audio into midi ("transcription") involves a basic_pitch AI model.
@@ -86,51 +110,224 @@ class BasicPitch(BaseModel):
         # Verify that the audio dir is set:
         if not self.audio_dir_path:
             return
-        # Audio files to transcribe:
-        audio_file_paths = self._get_audio_paths_list()
-        target_dir = self.audio_dir_path
-        # The transcription result file names:
-        midi_names = []
+        result = self.run_batch([self.audio_dir_path])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+    def midi_fname(self, audio_fname: str) -> str:
+        """Return the name of the midi file of the audio file "audio_fname": <name><midi_postfix>."""
+        return os.path.splitext(audio_fname)[0] + midi_postfix
+
+
+    def run_batch(self, audio_dir_paths: list[str]) -> list:
+        """
+        Generate midi files for the audio files of several directories, and return a TranscribedMidiData 
+        object per directory (in the same order), or the exception of a directory that can't be read. 
+        Each midi file is written in memory, and saved next to its audio file and/or returned in the 
+        TranscribedMidiData's "data" (see consts["midi_output"]).
+        The audio windows of all the files (of all the directories) are batched together into model calls of 
+        up to "max_batch_windows" windows, and the model outputs are then split back to each file.
+        A directory whose task is cancelled or timed-out (see utils_py/cancellation.py) is dropped out of the 
+        next model calls, and its result is the TaskCancelled exception. The other directories go on.
+        """
+
+        # The audio files to transcribe, and the directory (index) of each one:
+        audio_file_paths = []
+        dir_indices = []
+        dir_errors = {}  # {directory index: the exception of a directory that can't be read}.
+        for dir_i, audio_dir_path in enumerate(audio_dir_paths):
+            try:
+                dir_audio_paths = self._get_audio_paths_list(audio_dir_path)
+            except Exception as exp:
+                dir_errors[dir_i] = exp
+                continue
+            audio_file_paths.extend(dir_audio_paths)
+            dir_indices.extend([dir_i] * len(dir_audio_paths))
+
+        # Transcribe and save:
+        midis = self._transcribe_files(audio_file_paths)
+
+        # Wrap the results of each directory in a data object that can be serialized and sent via socket connection:
+        results = []
+        for dir_i in range(len(audio_dir_paths)):
+            if dir_i in dir_errors:
+                results.append(dir_errors[dir_i])
+                continue
+            source_names = [path for path, i in zip(audio_file_paths, dir_indices) if i == dir_i]
+            cancellation = get_cancellation(audio_dir_paths[dir_i])
+            if cancellation is not None and any(path not in midis for path in source_names):
+                results.append(cancellation)  # Stopped before all its files were transcribed.
+                continue
+            midi_names = [os.path.basename(midis[path][0]) for path in source_names if path in midis]
+            midi_data = [midis[path][1] for path in source_names if path in midis] if midi_output["return_bytes"] else None
+            code = self._calculate_code_result(source_names, midi_names)
+            results.append(TranscribedMidiData(code=code, fnames=midi_names, data=midi_data))
+        return results
+
+
+    def _transcribe_files(self, audio_file_paths: list[str]) -> dict[str, tuple[str, bytes]]:
+        """
+        Transcribe the given audio files with batched model calls, create a midi for each one (see _create_midi()) 
+        and return a {audio file path: (midi file path, midi bytes)} dictionary of the files that succeeded. 
+        A failure of a file is logged and doesn't stop the others. The files of a cancelled task are skipped.
+        """
+
+        midis = {}  # The results.
+        outputs = {}  # {audio file path: {output name: [model output arrays]}} of the files in progress.
+        remaining_windows = {}  # {audio file path: number of windows that weren't inferred yet}.
+        total_windows = {}  # {audio file path: number of windows}.
+        original_lengths = {}  # {audio file path: number of audio samples}.
+        batch = []  # [(audio file path, windows array)] waiting for the next model call.
+        batch_size = 0  # The number of windows in "batch".
+
+        def flush_batch():
+            """Run the model once over all the windows in "batch", distribute the outputs and finish the completed files."""
+            nonlocal batch, batch_size
+            # Drop the files of the tasks that were cancelled (or timed-out) meanwhile:
+            for audio_fname in set(path for path, _ in batch):
+                if audio_fname in outputs and get_cancellation(os.path.dirname(audio_fname)) is not None:
+                    outputs.pop(audio_fname)
+            batch = [(path, windows) for path, windows in batch if path in outputs]
+            batch_size = sum(len(windows) for _, windows in batch)
+            if batch_size == 0:
+                batch = []
+                return
+            try:
+                with span("inference"):
+                    model_output = self.basic_pitch_model.predict(np.concatenate([windows for _, windows in batch]))
+            except Exception as exp:
+                for audio_fname in set(path for path, _ in batch):
+                    error_log(ENVS.ALL, f'{script_name}: Couldn\'t transcribe the file "{audio_fname}". The error:\n{exp}')
+                    outputs.pop(audio_fname, None)
+                batch, batch_size = [], 0
+                return
+
+            offset = 0
+            for audio_fname, windows in batch:
+                if audio_fname in outputs:
+                    window_outputs = {k: v[offset: offset + len(windows)] for k, v in model_output.items()}
+                    for k, v in window_outputs.items():
+                        outputs[audio_fname].setdefault(k, []).append(v)
+                    first_window = total_windows[audio_fname] - remaining_windows[audio_fname]
+                    remaining_windows[audio_fname] -= len(windows)
+                    notes = self._window_notes(audio_fname, window_outputs, first_window, original_lengths[audio_fname])
+                    if remaining_windows[audio_fname] == 0:
+                        midi = self._create_midi(audio_fname, outputs.pop(audio_fname), original_lengths[audio_fname])
+                        if midi:
+                            midis[audio_fname] = midi
+                    report_progress(audio_fname, total_windows[audio_fname] - remaining_windows[audio_fname], 
+                                    total_windows[audio_fname], notes=notes)
+                offset += len(windows)
+            batch, batch_size = [], 0
 
-        # Get the paths of the resulted midi files:
         for audio_fname in audio_file_paths:
+            if get_cancellation(os.path.dirname(audio_fname)) is not None:
+                continue
             try:
-                # To silence basic_pitch spam outputs.
-                original_stdout = sys.stdout
-                original_stderr = sys.stderr
-                sys.stdout = open(os.devnull, 'w')
-                sys.stderr = open(os.devnull, 'w')
-
-                # Transcribe and save:
-                predict_and_save(audio_path_list=[audio_fname], output_directory=target_dir, save_midi=True, 
-                                    sonify_midi=False, save_model_outputs=False, save_notes=False, 
-                                    model_or_model_path=self.basic_pitch_model)
-                midi_fname = os.path.splitext(audio_fname)[0] + '_basic_pitch.mid'
-                if os.path.exists(midi_fname):
-                    midi_names.append(os.path.basename(midi_fname))
-
-                # Restore sys.stdio:
-                sys.stdout = original_stdout
-                sys.stderr = original_stderr
+                windows, original_length = self._get_audio_windows(audio_fname)
             except Exception as exp:
-                # Restore sys.stdio:
-                sys.stdout = original_stdout
-                sys.stderr = original_stderr
                 # Error occurred. log it and continue to the next file.
-                error_log(ENVS.ALL, f'{script_name}: Couldn\'t transcribe the file "{audio_fname}". The error:\n{exp}')
+                error_log(ENVS.ALL, f'{script_name}: Couldn\'t load the file "{audio_fname}". The error:\n{exp}')
                 continue
+            outputs[audio_fname] = {}
+            remaining_windows[audio_fname] = total_windows[audio_fname] = len(windows)
+            original_lengths[audio_fname] = original_length
+
+            # Split the file's windows between the batches:
+            start = 0
+            while start < len(windows):
+                n = min(len(windows) - start, max_batch_windows - batch_size)
+                batch.append((audio_fname, windows[start: start + n]))
+                batch_size += n
+                start += n
+                if batch_size >= max_batch_windows:
+                    flush_batch()
+        flush_batch()
+        return midis
+
+
+    def _get_audio_windows(self, audio_fname: str) -> tuple[np.ndarray, int]:
+        """
+        Decode the audio file in memory at the model's sample rate (see utils_py/audio_decoding.py) and split 
+        it into the model's overlapping input windows (like basic_pitch.inference.get_audio_input()).
+        Return the windows array (shape: [n windows, AUDIO_N_SAMPLES, 1]) and the audio length (samples)."""
 
-        # Wrap the results in a data ocject that can be serialized and sent via socket connection:
-        code = self._calculate_code_result(audio_file_paths, midi_names)
-        return TranscribedMidiData(code=code, fnames=midi_names)
+        audio = decode_audio(audio_fname, AUDIO_SAMPLE_RATE)
+        original_length = len(audio)
+        if original_length == 0:
+            raise ValueError('The audio file is empty.')
+        audio = np.concatenate([np.zeros(overlap_len // 2, dtype=np.float32), audio])
 
+        # A window starts every "hop_size" samples, and the last ones are padded with zeros:
+        n_windows = -(-len(audio) // hop_size)
+        audio = np.pad(audio, (0, (n_windows - 1) * hop_size + AUDIO_N_SAMPLES - len(audio)))
+        windows = np.lib.stride_tricks.sliding_window_view(audio, AUDIO_N_SAMPLES)[::hop_size][:n_windows]
+        return windows[..., np.newaxis].copy(), original_length
 
-    def _get_audio_paths_list(self) -> list[str]:
-        """Return a list of all the .wav audio files' paths within "audio_dir" directory."""
-        audio_dir = self.audio_dir_path
-        return [os.path.join(audio_dir, audio_fname) for audio_fname in os.listdir(audio_dir) \
-                if (os.path.isfile(os.path.join(audio_dir, audio_fname)) and \
-                os.path.splitext(audio_fname)[1] == '.wav')]
+
+    def _window_notes(self, audio_fname: str, window_outputs: dict, first_window: int, original_length: int) -> list[list]:
+        """
+        Return the notes (see utils_py/progress.py) of consecutive windows of a file, for its partial results, or an 
+        empty list if its progress isn't tracked. A note that crosses the edge of the windows may be cut or missed, 
+        so they're only a preview: the file's midi is created from all its windows at once (see _create_midi()).
+        window_outputs - The windows' model outputs, an array per output name.
+        first_window - The index of the first of the windows in the file.
+        original_length - The file's audio length (samples)."""
+
+        if not has_listener(audio_fname):
+            return []
+        start_sample = first_window * hop_size  # The windows' first sample in the (unpadded) audio.
+        windows_length = min(len(next(iter(window_outputs.values()))) * hop_size, original_length - start_sample)
+        if windows_length <= 0:
+            return []
+        try:
+            model_output = {k: unwrap_output(v, windows_length, n_overlapping_frames) for k, v in window_outputs.items()}
+            min_note_len = int(np.round(minimum_note_length_ms / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+            midi_data, _ = infer.model_output_to_notes(model_output, onset_thresh=onset_threshold, 
+                                                       frame_thresh=frame_threshold, min_note_len=min_note_len, 
+                                                       midi_tempo=midi_tempo)
+        except Exception as exp:
+            error_log(ENVS.ALL, f'{script_name}: Couldn\'t create the partial notes of "{audio_fname}". The error:\n{exp}')
+            return []
+        start_sec = start_sample / AUDIO_SAMPLE_RATE
+        return [[round(start + start_sec, 3), round(end + start_sec, 3), *note] for start, end, *note in midi_notes(midi_data)]
+
+
+    def _create_midi(self, audio_fname: str, file_outputs: dict, original_length: int) -> tuple[str, bytes] | None:
+        """
+        Convert a file's model outputs (a list of windows' outputs per output name) into notes, and write them as 
+        midi bytes in memory, which are saved as a midi file next to the audio file (if consts["midi_output"]
+        ["save_files"]). Return the midi file path and the bytes, or None upon failure (which is logged)."""
+
+        try:
+            with span("note_creation"):
+                model_output = {k: unwrap_output(np.concatenate(v), original_length, n_overlapping_frames) \
+                                for k, v in file_outputs.items()}
+                min_note_len = int(np.round(minimum_note_length_ms / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+                midi_data, _ = infer.model_output_to_notes(model_output, onset_thresh=onset_threshold, 
+                                                           frame_thresh=frame_threshold, min_note_len=min_note_len, 
+                                                           midi_tempo=midi_tempo)
+            midi_fname = os.path.join(os.path.dirname(audio_fname), self.midi_fname(os.path.basename(audio_fname)))
+            with span("midi_write"):
+                midi_buffer = io.BytesIO()
+                midi_data.write(midi_buffer)
+                midi_bytes = midi_buffer.getvalue()
+                if midi_output["save_files"]:
+                    with open(midi_fname, 'wb') as midi_file:
+                        midi_file.write(midi_bytes)
+        except Exception as exp:
+            error_log(ENVS.ALL, f'{script_name}: Couldn\'t transcribe the file "{audio_fname}". The error:\n{exp}')
+            return None
+        return midi_fname, midi_bytes
+
+
+    def _get_audio_paths_list(self, audio_dir: str = None) -> list[str]:
+        """
+        Return a list of all the audio files' paths (see consts["valid_audio_extensions"]) within "audio_dir" 
+        directory (default: "audio_dir_path")."""
+        return list_audio_files(audio_dir or self.audio_dir_path)
 
 
     def _calculate_code_result(self, source_names: list[str], target_names: list[str]) -> int:
@@ -0,0 +1,315 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A process-level registry of warm AI model wrappers (the classes in the "Models" directory).
+
+Constructing a wrapper is expensive (basic-pitch loads its TF/ONNX model, MR-MT3 composes its
+hydra configuration), so instead of building a new object per task, the registry builds (and warms up, see
+BaseModel.warm_up()) each model listed in consts["models_arguments"] once, keeps it alive and
+reuses it for every task.
+Usage:
+    registry = ModelRegistry(consts["models_arguments"])
+    registry.preload([ai_model])  # Optional: load before serving the first task.
+    transcribed_data = registry.transcribe(ai_model, audio_dir_path)
+
+With a "batching" configuration (see consts["batching"]), the concurrent tasks of a model that supports
+batching (BaseModel.supports_batching) are grouped by a MicroBatcher and served by a single run_batch() call.
+
+With a "result_cache" (see utils_py/result_cache.py), the midi of every transcribed audio file is cached by
+the audio's content hash, the model (name and arguments, e.g. its checkpoint) and the instruments mode. A
+directory whose audio files are all cached is served by copying the cached midi files, without inference.
+"""
+
+import importlib, os
+import json
+import threading
+import time
+
+from utils_py.serialized_objects import TranscribedMidiData
+from utils_py.loggers import ENVS, log, error_log
+from utils_py.micro_batcher import MicroBatcher
+from utils_py.result_cache import ResultCache
+from utils_py.tracing import span
+
+# Load the consts.json as a json dict:
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+midi_output = consts["midi_output"]
+cached_midi_name = 'midi'  # The name of the midi file in a result cache entry.
+models_dir = "Models"  # The directory of the models classes (this package).
+
+
+class ModelRegistry:
+    """
+    Load the AI model wrappers described in a "models_arguments" dictionary (see Consts.json)
+    on demand, once per process, and keep them warm for the next tasks.
+    A wrapper object is stateful (set_audio_dir() then run()), so every model has its own lock
+    and the registry serializes the tasks that use the same model.
+    """
+
+    def __init__(self, models_arguments: dict, log_postfix: str = '', batching: dict = None, 
+                 result_cache: ResultCache = None):
+        """
+        Create a new, empty registry.
+        models_arguments - A dictionary of {model name: {"module": str, "class": str, "args": list[str]}},
+            as in consts["models_arguments"].
+        log_postfix - A string to end every log message with (e.g. consts["STDIO_MSG_POSTFIX"], when
+            the logs share the STDOUT with the stdio protocol messages). Default: ''.
+        batching - (Optional) {"max_batch_tasks": int, "max_wait_ms": number}, as in consts["batching"].
+            If given, concurrent tasks of a model that supports batching are transcribed together.
+            Default: None (every task runs on its own).
+        result_cache - (Optional) A cache of transcribed midi files. Default: None (no caching)."""
+        self.models_arguments = models_arguments
+        self.log_postfix = log_postfix
+        self._models = {}  # {model name: a warm model wrapper object}.
+        self._model_locks = {}  # {model name: threading.Lock}. Guards the usage of a model object.
+        self._registry_lock = threading.Lock()  # Guards the two dictionaries above.
+        self.load_times_sec = {}  # {model name: the time (seconds) it took to load the model}.
+        self.batching = batching
+        self._batchers = {}  # {model name: MicroBatcher}. Guarded by "_registry_lock".
+        self.result_cache = result_cache
+
+    def import_model_class(self, ai_model: str):
+        """Import the AI model and return its wrapper class."""
+
+        module_name = self.models_arguments[ai_model]["module"]
+        class_name = self.models_arguments[ai_model]["class"]
+        module = importlib.import_module(f"{models_dir}.{module_name}")
+        return getattr(module, class_name)
+
+    def get(self, ai_model: str):
+        """
+        Return the warm wrapper object of "ai_model". Load it first if it isn't loaded yet.
+        Raise an exception upon failure (unknown model name or a failure in the model's constructor).
+
+        ai_model - A key in "models_arguments"."""
+
+        model_lock = self._get_model_lock(ai_model)
+        with model_lock:
+            model = self._models.get(ai_model)
+            if model is None:
+                model = self._load(ai_model)
+        return model
+
+    def preload(self, ai_models: list[str]) -> None:
+        """
+        Load the given models now, instead of on their first task.
+        Raise an exception upon failure.
+
+        ai_models - A list of keys in "models_arguments"."""
+        for ai_model in ai_models:
+            self.get(ai_model)
+
+    def is_loaded(self, ai_model: str) -> bool:
+        """Return True if "ai_model" is already loaded and warm."""
+        return ai_model in self._models
+
+    def evict(self, ai_model: str) -> bool:
+        """
+        Drop the warm object of "ai_model" and release its resources, so the next task loads it again.
+        Return True if a model was evicted, False if it wasn't loaded."""
+
+        model_lock = self._get_model_lock(ai_model)
+        with model_lock:
+            with self._registry_lock:
+                model = self._models.pop(ai_model, None)
+            if model is None:
+                return False
+            model.release()
+            return True
+
+    def close(self) -> None:
+        """Stop the batchers (their pending tasks are still transcribed). The models stay loaded."""
+        with self._registry_lock:
+            batchers = list(self._batchers.values())
+            self._batchers.clear()
+        for batcher in batchers:
+            batcher.close()
+
+    def transcribe(self, ai_model: str, audio_dir_path: str, instruments_mode: int = None) -> TranscribedMidiData:
+        """
+        Transcribe the audio files in "audio_dir_path" with the warm "ai_model" model and return
+        the "TranscribedMidiData" result of its run(). The inference time is logged.
+        If batching is enabled and the model supports it, the task may share a run_batch() call with
+        other concurrent tasks of the same model. A cached result is returned without inference.
+        Raise an exception upon failure.
+
+        ai_model - A key in "models_arguments".
+        audio_dir_path - The path to the directory with the source audio files. It's also
+            the target directory for saving the resulted midi files.
+        instruments_mode - (Optional) The instruments mode of the task (part of the cache key)."""
+
+        with span("cache_lookup"):
+            cached_data, cache_keys = self._get_cached_result(ai_model, audio_dir_path, instruments_mode)
+        if cached_data is not None:
+            return cached_data
+
+        model = self.get(ai_model)
+        start_time = time.perf_counter()
+        if self.batching and model.supports_batching:
+            transcribed_data = self._get_batcher(ai_model).submit(audio_dir_path).result()
+        else:
+            with self._get_model_lock(ai_model):
+                model.set_audio_dir(audio_dir_path)
+                transcribed_data = model.run()
+        inference_time = time.perf_counter() - start_time
+
+        log(ENVS.ALL, f'{script_name}: "{ai_model}" inference took {inference_time:.3f} sec ' + \
+            f'(model load took {self.load_times_sec.get(ai_model, 0):.3f} sec, once).' + self.log_postfix)
+        with span("cache_store"):
+            self._cache_result(ai_model, cache_keys, transcribed_data)
+        return transcribed_data
+
+    def _get_model_lock(self, ai_model: str) -> threading.Lock:
+        """Return the lock of "ai_model". Raise KeyError if the model isn't in "models_arguments"."""
+
+        if ai_model not in self.models_arguments:
+            raise KeyError(f'Unknown AI model "{ai_model}". Add it to "models_arguments" in Consts.json.')
+        with self._registry_lock:
+            return self._model_locks.setdefault(ai_model, threading.Lock())
+
+    def transcribe_batch(self, ai_model: str, audio_dir_paths: list[str], instruments_mode: int = None) -> list:
+        """
+        Transcribe several audio directories with a single run_batch() call of the warm "ai_model" (which 
+        runs them one by one if the model doesn't support batching), and return their results in the 
+        same order. A result is either a "TranscribedMidiData" or the exception of that directory.
+        Directories with a cached result are served from the cache and don't join the batch.
+        Raise an exception upon a failure of the whole batch (e.g. the model couldn't be loaded).
+        instruments_mode - (Optional) The instruments mode of the tasks (part of the cache key)."""
+
+        results = [None] * len(audio_dir_paths)
+        cache_keys = [None] * len(audio_dir_paths)
+        with span("cache_lookup"):
+            for i, audio_dir_path in enumerate(audio_dir_paths):
+                results[i], cache_keys[i] = self._get_cached_result(ai_model, audio_dir_path, instruments_mode)
+
+        missed = [i for i, result in enumerate(results) if result is None]
+        if missed:
+            batch_results = self._run_batch(ai_model, [audio_dir_paths[i] for i in missed])
+            with span("cache_store"):
+                for i, transcribed_data in zip(missed, batch_results):
+                    results[i] = transcribed_data
+                    self._cache_result(ai_model, cache_keys[i], transcribed_data)
+        return results
+
+    def _run_batch(self, ai_model: str, audio_dir_paths: list[str]) -> list:
+        """Transcribe a batch of audio directories with a single run_batch() call (see transcribe_batch())."""
+
+        model = self.get(ai_model)
+        with self._get_model_lock(ai_model):
+            start_time = time.perf_counter()
+            results = model.run_batch(audio_dir_paths)
+            batch_time = time.perf_counter() - start_time
+        log(ENVS.DEVELOPMENT, f'{script_name}: "{ai_model}" transcribed a batch of {len(audio_dir_paths)} ' + \
+            f'tasks in {batch_time:.3f} sec.' + self.log_postfix)
+        return results
+
+    def _get_batcher(self, ai_model: str) -> MicroBatcher:
+        """Return the batcher of "ai_model". Create it on the first call."""
+
+        with self._registry_lock:
+            batcher = self._batchers.get(ai_model)
+            if batcher is None:
+                batch_fn = lambda _, audio_dir_paths: self._run_batch(ai_model, audio_dir_paths)
+                batcher = MicroBatcher(batch_fn, max_batch_size=self.batching["max_batch_tasks"],
+                                       max_wait_sec=self.batching["max_wait_ms"] / 1000)
+                self._batchers[ai_model] = batcher
+            return batcher
+
+    def _get_cached_result(self, ai_model: str, audio_dir_path: str, 
+                           instruments_mode: int) -> tuple[TranscribedMidiData | None, dict | None]:
+        """
+        Look up the audio files of "audio_dir_path" in the result cache. If all of them are cached, copy 
+        their midi files into the directory and/or return their bytes (see consts["midi_output"]) in a 
+        "TranscribedMidiData" with "cache_hit" set.
+        Return a (result or None, {audio file path: cache key} or None) pair. The keys are for storing 
+        the result of a miss (see _cache_result()). Cache failures are logged and count as a miss."""
+
+        if self.result_cache is None:
+            return None, None
+        try:
+            # Key every audio file by its content, the model, its arguments (e.g. checkpoint) and the instruments mode:
+            model_args = json.dumps(self.models_arguments[ai_model]["args"])
+            cache_keys = {}
+            for fname in sorted(os.listdir(audio_dir_path)):
+                audio_path = os.path.join(audio_dir_path, fname)
+                if os.path.isfile(audio_path) and os.path.splitext(fname)[1].lower() in consts["valid_audio_extensions"]:
+                    cache_keys[audio_path] = ResultCache.make_key(ResultCache.hash_file(audio_path), ai_model, 
+                                                                  model_args, instruments_mode)
+            if not cache_keys:
+                return None, None
+
+            metas = {}
+            for audio_path, key in cache_keys.items():
+                metas[audio_path] = self.result_cache.get(key)
+                if metas[audio_path] is None:
+                    return None, cache_keys
+
+            # A hit. Copy the cached midi files next to their audio files, and/or return their bytes:
+            midi_names, midi_bytes = [], []
+            for audio_path, key in cache_keys.items():
+                midi_name = os.path.splitext(os.path.basename(audio_path))[0] + metas[audio_path]["midi_suffix"]
+                if midi_output["save_files"]:
+                    self.result_cache.copy_file(key, cached_midi_name, os.path.join(audio_dir_path, midi_name))
+                if midi_output["return_bytes"]:
+                    midi_bytes.append(self.result_cache.read_file(key, cached_midi_name))
+                midi_names.append(midi_name)
+        except Exception as exp:
+            error_log(ENVS.ALL, f'{script_name}: The result cache lookup of "{audio_dir_path}" failed. The error:\n{exp}')
+            return None, None
+
+        log(ENVS.ALL, f'{script_name}: "{ai_model}" result cache hit for "{audio_dir_path}".' + self.log_postfix)
+        return TranscribedMidiData(code=consts["convertion_success"], fnames=midi_names, data=midi_bytes or None,
+                                   cache_hit=True), None
+
+    def _cache_result(self, ai_model: str, cache_keys: dict | None, transcribed_data) -> None:
+        """
+        Store the midi file of each audio file of a transcribed directory in the result cache. An audio file's
+        midi is the one the model names after it (see BaseModel.midi_fname()), and only if it was produced: 
+        stored from the returned midi bytes if there are, or else from the saved midi file."""
+
+        if self.result_cache is None or not cache_keys or not isinstance(transcribed_data, TranscribedMidiData):
+            return
+        model = self._models.get(ai_model)
+        if model is None:
+            return
+        midi_bytes = transcribed_data.midi_bytes
+        for audio_path, key in cache_keys.items():
+            audio_fname = os.path.basename(audio_path)
+            midi_name = model.midi_fname(audio_fname)
+            if not midi_name or midi_name not in transcribed_data.fnames:
+                continue  # The file failed.
+            i = transcribed_data.fnames.index(midi_name)
+            if i < len(midi_bytes):
+                source = midi_bytes[i]
+            else:
+                source = os.path.join(os.path.dirname(audio_path), midi_name)
+                if not os.path.isfile(source):
+                    continue
+            midi_suffix = midi_name[len(os.path.splitext(audio_fname)[0]):]
+            self.result_cache.put(key, {cached_midi_name: source}, meta={"midi_suffix": midi_suffix})
+
+    def _load(self, ai_model: str):
+        """Construct, register and return the wrapper object of "ai_model". The caller holds its lock."""
+
+        start_time = time.perf_counter()
+        try:
+            Model = self.import_model_class(ai_model)
+            model = Model(self.models_arguments[ai_model]["args"])
+            model.warm_up()
+        except Exception as exp:
+            error_log(ENVS.ALL, f'{script_name}: Failed to load the AI model "{ai_model}".')
+            raise exp
+        load_time = time.perf_counter() - start_time
+
+        with self._registry_lock:
+            self._models[ai_model] = model
+            self.load_times_sec[ai_model] = load_time
+        log(ENVS.ALL, f'{script_name}: Loaded the AI model "{ai_model}" in {load_time:.3f} sec.' + self.log_postfix)
+        return model
+
+
+__all__ = ['ModelRegistry']
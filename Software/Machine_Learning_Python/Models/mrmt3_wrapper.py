@@ -2,7 +2,7 @@
 Author: Alon Haviv, Stellar Intelligence.
 
 A class that uses the MR-MT3 (Memory Retaining Multi-Track Music Transcription) model
-to transcribe an audio music file (.wav) into midi (.mid).
+to transcribe an audio music file (any format in consts["valid_audio_extensions"]) into midi (.mid).
 Pipeline order:
     model = Mrmt3_wrapper(args)  # Create a new transcriber.
     model.set_audio_dir(audio_dir_path)  # Set the audio source directory.
@@ -40,7 +40,11 @@ The model is based on the MT3 model, made by kunato. Paper: https://github.com/k
 #################################################
 
 import os, sys
+import io
+import math
 import json
+import tempfile
+import threading
 
 # Load the consts.json as a json dict:
 solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -55,18 +59,32 @@ if not sys_path_ai_dir in sys.path:
 # Import project utilities:
 from utils_py.serialized_objects import TranscribedMidiData
 from utils_py.loggers import ENVS, log, error_log
+from utils_py.audio_decoding import decode_audio, Resampler, list_audio_files
+from utils_py.tracing import span
+from utils_py.progress import report_progress, midi_notes
+from utils_py.cancellation import check_cancelled
+from utils_py.error_objects import TaskCancelled
 from .base_model import BaseModel
 # Imports for the AI model itself:
 import hydra
 from tqdm import tqdm
 from torch import load as torchLoad
 from inference import InferenceHandler
-import librosa
 import numpy as np
+import soundfile
+import pretty_midi
 
 # Important AI parameters:
 sampling_rate = 16000
 batch_size = 8
+segment_samples = 256 * 128  # The audio of one input segment (256 spectrogram frames, hop of 128 samples).
+
+# Streaming inference of long recordings (see _transcribe_streaming()):
+streaming_consts = consts["mrmt3_streaming"]
+midi_output = consts["midi_output"]  # Save the midi files to the disk, return their bytes, or both.
+chunk_samples = streaming_consts["chunk_segments"] * segment_samples  # Chunks are aligned to whole segments.
+context_samples = streaming_consts["context_segments"] * segment_samples  # The previous chunk's tail before a chunk.
+stitch_tolerance_sec = 0.02  # Two of the model's time steps: a note that ends this close to a boundary ends on it.
 
 # Other constants:
 script_name = os.path.basename(__file__)  # Will be usefull for logging.
@@ -74,13 +92,22 @@ script_name = os.path.basename(__file__)  # Will be usefull for logging.
 class Mrmt3_wrapper(BaseModel):
     """
     The class implements the BaseModel abstract class. It wraps the InferenceHandler of 
-    MR-MT3 and lets a user to generate transcriber objects from .wav to .mid. After a 
+    MR-MT3 and lets a user to generate transcriber objects from audio files to .mid. After a 
     setup, an object can perform an inference over an audio directory.
+    The loaded networks and their InferenceHandlers are cached in the class (keyed by the 
+    checkpoint path and the model's class), so only the first run() of a checkpoint loads it 
+    and the next set_audio_dir()/run() cycles are inference-only. See evict_cached_models().
+    When enabled, recordings longer than a chunk are decoded, resampled and transcribed chunk by 
+    chunk, with a flat peak memory (see consts["mrmt3_streaming"]).
     Pipeline order:
         model = Mrmt3_wrapper(args)  # Create a new transcriber.
         model.set_audio_dir(audio_dir_path)  # Set the audio source directory.
         model.run()  # Resulted .mid files are saved in audio_dir_path."""
 
+    # {(cfg.path, cfg.model._target_): [model, InferenceHandler, contiguous_inference]}. Shared by all the instances:
+    _handlers_cache = {}
+    _handlers_cache_lock = threading.Lock()
+
     def __init__(self, args: list[str]):
         """
         Creates a new transcriber.
@@ -136,7 +163,7 @@ class Mrmt3_wrapper(BaseModel):
         The resulted midis shall be stored there.
         Return True if the setup succeeded, False if the directory is invalid.
 
-        audio_dir_path - The audio directory. should contain .wav files."""
+        audio_dir_path - The audio directory. should contain audio files (see consts["valid_audio_extensions"])."""
 
         # Check input validity:
         if not super().set_audio_dir(audio_dir_path):
@@ -150,44 +177,48 @@ class Mrmt3_wrapper(BaseModel):
 
     def run(self) -> TranscribedMidiData:
         """
-        Generate midi files for each of the .wav audio files located inside "audio_dir_path" directory.
+        Generate midi files for each of the audio files located inside "audio_dir_path" directory.
         The midi files are saved in the same directory with appropriate names and a TranscribedMidiData object 
-        is then returned.
-        The process of converting .wav into midi ("transcription") involves an AI model whose configurations 
+        is then returned, with the midi bytes if they're returned too (see consts["midi_output"]).
+        The process of converting audio into midi ("transcription") involves an AI model whose configurations 
         are given in "cfg".
-        Raise exception upon failure.
+        The task's cancellation (see utils_py/cancellation.py) is checked before every file and every chunk. 
+        A short file is transcribed in one inference call, which can't be interrupted, so it's checked before 
+        and after that call.
+        Raise exception upon failure, or TaskCancelled if the task was cancelled or timed-out.
         """
 
         # Verify that the audio dir is set:
         if not self.audio_dir_path:
             return
 
-        # Create a handler object with an AI model to later transcribe the audio:
-        try:
-            model = self._load_model()
-            log(ENVS.DEVELOPMENT, f'{script_name}: The model loaded for the InferenceHandler is: {type(model).__name__}')
-            mel_norm = False if "mt3.pth" in self.cfg.path else True  # This is MT3 official checkpoint.
-            handler = InferenceHandler(model, mel_norm=mel_norm, contiguous_inference=self.cfg.eval.contiguous_inference, use_tf_spectral_ops=False)
-        except Exception as exp:
-            error_log(ENVS.ALL, f'{script_name}: Couldn\'t load the model under "{self.cfg.model._target_}" ' +\
-                'and generate an "InferenceHandler" object.' + \
-                f'\n\tAdditional information: cfg.path = {self.cfg.path}')
-            raise exp
+        # Get the (cached) handler object with an AI model to later transcribe the audio:
+        handler = self._get_handler()
 
         # Audio files to transcribe:
         audio_file_paths = self._get_audio_paths_list()
-        # Prefix for each of the transcription result files:
-        out_name_postfix = ('_' + self.cfg.eval.exp_tag_name) if self.cfg.eval.exp_tag_name != '' else ''
-        # The transcription result file names:
+        # The transcription result file names (and bytes):
         midi_names = []
+        midi_data = []
 
-        # Scan the audio files one by one and generate a midi file for each wav file:
+        # Scan the audio files one by one and generate a midi file for each audio file:
         for audio_fname in tqdm(audio_file_paths):
+            check_cancelled(os.path.dirname(audio_fname))
             try:
-                path_to_save_midi = (os.path.splitext(audio_fname)[0] + out_name_postfix + '.mid').replace('\\','/')
-                audio = self._load_audio(audio_fname)
-                handler.inference(audio, audio_path=audio_fname.replace('\\','/'), outpath=path_to_save_midi, batch_size=batch_size, verbose=True)
+                path_to_save_midi = os.path.join(os.path.dirname(audio_fname), self.midi_fname(os.path.basename(audio_fname))).replace('\\','/')
+                if self._should_stream(audio_fname):
+                    midi_bytes = self._transcribe_streaming(handler, audio_fname, path_to_save_midi)
+                else:
+                    audio = self._load_audio(audio_fname)
+                    check_cancelled(os.path.dirname(audio_fname))
+                    with span("inference"):  # Includes the midi write.
+                        handler.inference(audio, audio_path=audio_fname.replace('\\','/'), outpath=path_to_save_midi, batch_size=batch_size, verbose=True)
+                    check_cancelled(os.path.dirname(audio_fname))
+                    midi_bytes = self._take_midi_file(path_to_save_midi)
                 midi_names.append(os.path.basename(path_to_save_midi))
+                midi_data.append(midi_bytes)
+            except TaskCancelled:
+                raise
             except Exception as exp:
                 # Error occurred. log it and continue to the next file.
                 error_log(ENVS.ALL, f'{script_name}: Couldn\'t transcribe the file "{audio_fname}". The error:\n{exp}')
@@ -195,7 +226,86 @@ class Mrmt3_wrapper(BaseModel):
     
         # Wrap the results in a data ocject that can be serialized and sent via socket connection:
         code = self._calculate_code_result(audio_file_paths, midi_names)
-        return TranscribedMidiData(code=code, fnames=midi_names)
+        return TranscribedMidiData(code=code, fnames=midi_names, data=midi_data if midi_output["return_bytes"] else None)
+
+
+    def midi_fname(self, audio_fname: str) -> str:
+        """Return the name of the midi file of the audio file "audio_fname": <name>[_<cfg.eval.exp_tag_name>].mid."""
+        out_name_postfix = ('_' + self.cfg.eval.exp_tag_name) if self.cfg.eval.exp_tag_name != '' else ''
+        return os.path.splitext(audio_fname)[0] + out_name_postfix + '.mid'
+
+
+    def warm_up(self) -> None:
+        """
+        Load the network and its InferenceHandler into the cache ahead of the first run().
+        Raise an exception upon failure."""
+        self._get_handler()
+
+
+    def release(self) -> None:
+        """Evict this transcriber's network and InferenceHandler from the cache. The next run() loads them again."""
+        Mrmt3_wrapper.evict_cached_models(self.cfg.path, self.cfg.model._target_)
+
+
+    def reload(self) -> None:
+        """
+        Load this transcriber's checkpoint again (e.g. after the file in cfg.path was replaced), 
+        replacing its cached network and InferenceHandler.
+        Raise an exception upon failure."""
+        self.release()
+        self._get_handler()
+
+
+    @classmethod
+    def evict_cached_models(cls, path: str = None, target: str = None) -> int:
+        """
+        Remove cached networks and their InferenceHandlers, so a long-lived worker can free the memory 
+        or switch checkpoints (e.g. from MT3Net to MT3NetSegMemV2WithPrev) without restarting.
+        Return the number of evicted entries.
+
+        path - Evict only the entries of this checkpoint path (cfg.path). Default: None (any path).
+        target - Evict only the entries of this model class (cfg.model._target_). Default: None (any class)."""
+
+        with cls._handlers_cache_lock:
+            keys = [key for key in cls._handlers_cache if (path is None or key[0] == path) and \
+                    (target is None or key[1] == target)]
+            for key in keys:
+                del cls._handlers_cache[key]
+
+        if keys:
+            log(ENVS.DEVELOPMENT, f'{script_name}: Evicted {len(keys)} cached model(s): {keys}')
+        return len(keys)
+
+
+    def _get_handler(self) -> InferenceHandler:
+        """
+        Return the InferenceHandler of this transcriber's network (keyed by cfg.path and cfg.model._target_). 
+        Load the network and generate the handler only if they aren't cached yet. The handler alone is 
+        regenerated if cfg.eval.contiguous_inference was changed.
+        Raise an exception upon failure."""
+
+        cache_key = (self.cfg.path, self.cfg.model._target_)
+        contiguous_inference = self.cfg.eval.contiguous_inference
+
+        with Mrmt3_wrapper._handlers_cache_lock:
+            cached = Mrmt3_wrapper._handlers_cache.get(cache_key)
+            if cached and cached[2] == contiguous_inference:
+                return cached[1]
+
+            # Create a handler object with an AI model to later transcribe the audio:
+            try:
+                model = cached[0] if cached else self._load_model()
+                log(ENVS.DEVELOPMENT, f'{script_name}: The model loaded for the InferenceHandler is: {type(model).__name__}')
+                mel_norm = False if "mt3.pth" in self.cfg.path else True  # This is MT3 official checkpoint.
+                handler = InferenceHandler(model, mel_norm=mel_norm, contiguous_inference=contiguous_inference, use_tf_spectral_ops=False)
+            except Exception as exp:
+                error_log(ENVS.ALL, f'{script_name}: Couldn\'t load the model under "{self.cfg.model._target_}" ' +\
+                    'and generate an "InferenceHandler" object.' + \
+                    f'\n\tAdditional information: cfg.path = {self.cfg.path}')
+                raise exp
+
+            Mrmt3_wrapper._handlers_cache[cache_key] = [model, handler, contiguous_inference]
+            return handler
 
 
     def _parse_arguments(self, args: list[str]) -> tuple:
@@ -258,33 +368,217 @@ class Mrmt3_wrapper(BaseModel):
 
     def _load_audio(self, fname: str) -> np.ndarray:
         """
-        Use librosa library to load an audio file from the given in "fname" path, 
-        resample it to the relevant resampling rate (16000) and return it audio 
-        content as a numpy array (librosa's format).
+        Decode an audio file from the given in "fname" path in memory (any format in 
+        consts["valid_audio_extensions"], see utils_py/audio_decoding.py), resample it to 
+        the relevant resampling rate (16000) and return its mono content as a float32 numpy array.
         Raise an exception upon failure.
     
         fname - The path of the audio file.
         """
 
         try:
-            audio, sr = librosa.load(fname, sr=None)
-            if sr != sampling_rate:
-                log(ENVS.DEVELOPMENT, f'{script_name}: Resampling {fname}. file\'s sampling rate = {sr} instead of {sampling_rate}')
-                audio = librosa.resample(audio, orig_sr=sr, target_sr=sampling_rate)
+            audio = decode_audio(fname, sampling_rate)
             # For NSynth dataset (single instrument audios) (I use Slakh):
             #audio = np.pad(audio, (int(0.05 * 16000), 0), "constant", constant_values=0)
         except Exception as exc:
-            error_log(ENVS.ALL, f'{script_name}: Librosa couldn\'t load or resample the audio file in "{fname}".')
+            error_log(ENVS.ALL, f'{script_name}: Couldn\'t decode or resample the audio file in "{fname}".')
             raise exc
     
         return audio
 
+    def _should_stream(self, fname: str) -> bool:
+        """
+        Return True if the audio file should be transcribed in chunks (see _transcribe_streaming()): streaming 
+        is enabled, the file's format can be decoded block by block and it's longer than a single chunk."""
+
+        if not streaming_consts["enabled"]:
+            return False
+        try:
+            info = soundfile.info(fname)
+        except Exception:
+            return False  # A format that soundfile can't stream (e.g. .m4a files). Decoded whole (see _load_audio()).
+        return info.frames / info.samplerate > chunk_samples / sampling_rate
+
+
+    def _stream_audio_chunks(self, fname: str):
+        """
+        Decode the audio file block by block, down-mix it to mono and resample it (with a stateful resampler, 
+        so the blocks' edges are seamless), and yield it in chunks of "chunk_samples" samples (the last chunk 
+        may be shorter). Only one chunk and one block are held in memory at a time.
+        Raise an exception upon failure.
+    
+        fname - The path of the audio file.
+        """
+
+        orig_sr = soundfile.info(fname).samplerate
+        resampler = Resampler(orig_sr, sampling_rate).stream()
+        if resampler:
+            log(ENVS.DEVELOPMENT, f'{script_name}: Resampling {fname} while streaming. file\'s sampling rate = {orig_sr} instead of {sampling_rate}')
+
+        buffer = np.empty(0, dtype=np.float32)
+        blocks = soundfile.blocks(fname, blocksize=streaming_consts["block_samples"], dtype='float32', always_2d=True)
+        while True:
+            with span("audio_decode"):
+                block = next(blocks, None)
+                if block is None:
+                    break
+                mono = block.mean(axis=1)
+            if resampler:
+                with span("resample"):
+                    mono = resampler.resample_chunk(mono)
+            buffer = np.concatenate([buffer, mono])
+            while len(buffer) >= chunk_samples:
+                yield buffer[:chunk_samples]
+                buffer = buffer[chunk_samples:]
+        if resampler:
+            buffer = np.concatenate([buffer, resampler.resample_chunk(np.empty(0, dtype=np.float32), last=True)])
+        if len(buffer) > 0:
+            yield buffer
+
+
+    def _take_midi_file(self, midi_path: str) -> bytes | None:
+        """
+        Read the midi file that the inference handler wrote (only if consts["midi_output"]["return_bytes"]), and 
+        remove it unless consts["midi_output"]["save_files"]. Return its bytes, or None if they aren't returned."""
+        midi_bytes = None
+        if midi_output["return_bytes"]:
+            with open(midi_path, 'rb') as midi_file:
+                midi_bytes = midi_file.read()
+        if not midi_output["save_files"]:
+            os.remove(midi_path)
+        return midi_bytes
+
+
+    def _transcribe_streaming(self, handler: InferenceHandler, fname: str, path_to_save_midi: str) -> bytes:
+        """
+        Transcribe a long audio file chunk by chunk, so the peak memory doesn't depend on the recording's 
+        length: every chunk (see _stream_audio_chunks()) is transcribed and its notes are added to the resulted 
+        midi, shifted by the chunk's start time. The chunks are aligned to whole input segments, so the model 
+        sees the same segments as with the whole audio.
+        Every chunk is preceded by the last "context_segments" segments of the previous chunk, so a contiguous 
+        (SegMem) model enters the chunk with the segment memory it had at that point of the recording, instead 
+        of an empty one, and a note that sounds across the boundary is seen with its onset. The notes of the 
+        context itself were already transcribed, and are dropped, except for the ones that go on into the chunk: 
+        these continue (are stitched to) the previous chunk's note, which ended at the boundary.
+        The progress and the new notes of every chunk are reported (see utils_py/progress.py), for partial results.
+        The merged midi is written in memory and saved (if consts["midi_output"]["save_files"]). Return its bytes.
+        Raise an exception upon failure.
+
+        handler - The InferenceHandler to transcribe with.
+        fname - The path of the audio file.
+        path_to_save_midi - The path of the resulted midi file."""
+
+        merged_midi = pretty_midi.PrettyMIDI()
+        instruments = {}  # {(program, is_drum, name): the merged midi's instrument}.
+        open_notes = {}  # {(instrument key, pitch): a merged note that sounds at the end of the previous chunk}.
+        context = np.empty(0, dtype=np.float32)  # The tail of the previous chunk.
+        chunk_start_sec = 0.0
+        info = soundfile.info(fname)
+        chunks_count = max(1, math.ceil(info.frames * sampling_rate / info.samplerate / chunk_samples))
+        # The chunks' midi files are temporary, outside the user's directory:
+        chunk_midi_fd, chunk_midi_path = tempfile.mkstemp(suffix='.mid')
+        os.close(chunk_midi_fd)
+
+        try:
+            for i, chunk in enumerate(self._stream_audio_chunks(fname)):
+                if os.path.exists(chunk_midi_path):
+                    os.remove(chunk_midi_path)
+                try:
+                    check_cancelled(os.path.dirname(fname))
+                except TaskCancelled:
+                    log(ENVS.DEVELOPMENT, f'{script_name}: Stopped the transcription of {fname} after {i}/{chunks_count} chunks.')
+                    raise
+                audio = np.concatenate([context, chunk]) if len(context) else chunk
+                with span("inference"):
+                    handler.inference(audio, audio_path=fname.replace('\\','/'), outpath=chunk_midi_path, batch_size=batch_size, verbose=False)
+                if not os.path.exists(chunk_midi_path):
+                    raise RuntimeError(f'The transcription of chunk number {i} failed.')
+
+                chunk_end_sec = chunk_start_sec + len(chunk) / sampling_rate
+                with span("midi_merge"):
+                    chunk_midi = pretty_midi.PrettyMIDI(chunk_midi_path)
+                    open_notes = self._merge_chunk_midi(merged_midi, instruments, open_notes, chunk_midi, 
+                                                        chunk_start_sec - len(context) / sampling_rate, 
+                                                        chunk_start_sec, chunk_end_sec)
+                report_progress(fname, min(i + 1, chunks_count), chunks_count, notes=midi_notes(chunk_midi))  # The new notes.
+                log(ENVS.DEVELOPMENT, f'{script_name}: Transcribed chunk number {i} of {fname} ({len(chunk) / sampling_rate:.1f} sec).')
+                context = audio[-context_samples:] if context_samples else context
+                chunk_start_sec = chunk_end_sec
+        finally:
+            if os.path.exists(chunk_midi_path):
+                os.remove(chunk_midi_path)
+
+        with span("midi_write"):
+            midi_buffer = io.BytesIO()
+            merged_midi.write(midi_buffer)
+            midi_bytes = midi_buffer.getvalue()
+            if midi_output["save_files"]:
+                with open(path_to_save_midi, 'wb') as midi_file:
+                    midi_file.write(midi_bytes)
+        return midi_bytes
+
+
+    @staticmethod
+    def _merge_chunk_midi(merged_midi: pretty_midi.PrettyMIDI, instruments: dict, open_notes: dict, 
+                          chunk_midi: pretty_midi.PrettyMIDI, offset_sec: float, chunk_start_sec: float, 
+                          chunk_end_sec: float) -> dict:
+        """
+        Add the events of a transcribed chunk (preceded by its context, see _transcribe_streaming()) to the 
+        merged midi. A note that starts in the context is dropped, or, if it sounds on into the chunk, it 
+        extends the open note of its pitch and instrument (or starts at the boundary, if there's none). 
+        "chunk_midi" is left with the new notes only (shifted), for the progress report.
+        Return the open notes at the end of the chunk, for the next one.
+
+        merged_midi - The resulted midi.
+        instruments - {(program, is_drum, name): the merged midi's instrument}. Updated.
+        open_notes - {(instrument key, pitch): a merged note that sounds at "chunk_start_sec"}.
+        chunk_midi - The midi of the context and the chunk.
+        offset_sec - The time of the context's start in the recording.
+        chunk_start_sec - The time of the chunk's start (the boundary) in the recording.
+        chunk_end_sec - The time of the chunk's end in the recording."""
+
+        next_open_notes = {}
+        for chunk_instrument in chunk_midi.instruments:
+            key = (chunk_instrument.program, chunk_instrument.is_drum, chunk_instrument.name)
+            instrument = instruments.get(key)
+            if instrument is None:
+                instrument = pretty_midi.Instrument(program=key[0], is_drum=key[1], name=key[2])
+                instruments[key] = instrument
+                merged_midi.instruments.append(instrument)
+
+            new_notes = []
+            for note in sorted(chunk_instrument.notes, key=lambda note: note.start):
+                note.start += offset_sec
+                note.end += offset_sec
+                if note.start < chunk_start_sec - stitch_tolerance_sec:
+                    if note.end <= chunk_start_sec + stitch_tolerance_sec:
+                        continue  # A note of the context, already transcribed.
+                    previous = open_notes.pop((key, note.pitch), None)
+                    if previous is not None:
+                        previous.end = max(previous.end, note.end)  # Stitched across the boundary.
+                        merged_note = previous
+                    else:
+                        note.start = chunk_start_sec
+                        new_notes.append(note)
+                        merged_note = note
+                else:
+                    new_notes.append(note)
+                    merged_note = note
+                if merged_note.end >= chunk_end_sec - stitch_tolerance_sec:
+                    next_open_notes[(key, note.pitch)] = merged_note
+            instrument.notes.extend(new_notes)
+            chunk_instrument.notes = new_notes
+
+            for event in chunk_instrument.control_changes + chunk_instrument.pitch_bends:
+                event.time += offset_sec
+            instrument.control_changes.extend(event for event in chunk_instrument.control_changes if event.time >= chunk_start_sec)
+            instrument.pitch_bends.extend(event for event in chunk_instrument.pitch_bends if event.time >= chunk_start_sec)
+        return next_open_notes
+
+
     def _get_audio_paths_list(self) -> list[str]:
-        """Return a list of all the .wav audio files' paths within "audio_dir" directory."""
-        audio_dir = self.cfg.eval.audio_dir
-        return [os.path.join(audio_dir, audio_fname) for audio_fname in os.listdir(audio_dir) \
-                if (os.path.isfile(os.path.join(audio_dir, audio_fname)) and \
-                os.path.splitext(audio_fname)[1] == '.wav')]
+        """Return a list of all the audio files' paths (see consts["valid_audio_extensions"]) within "audio_dir" directory."""
+        return list_audio_files(self.cfg.eval.audio_dir)
 
     def _load_model(self):
         """
@@ -0,0 +1,189 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+The post-transcription artifact stage of a task directory, in a single pass: render the PDF of the midi
+file (MuseScore, see convert_to_pdf.py), add its title and footer, rasterize the preview images from the
+same in-memory document (see image_notes_generator.py), and update the JSON-data-file once, atomically.
+It replaces the separate PDF and image jobs, each of which read and rewrote the JSON-data-file (and so did
+the app in between).
+
+The stage runs in the fork-server as the "artifacts" job (if consts["fork_server"]["artifact_stage"]), so
+the tasks are queued there, and up to consts["fork_server"]["max_children"] run at once. It can also run
+as a script. The result:
+    {"code": int, "fnames": [pdf name, image names...], "timings": {stage: seconds}}
+The stages are "musescore_render", "add_text_and_previews" and "metadata" (and their "total").
+The directories of a whole upload can run as a single stage (see run_artifact_stages()): their PDFs are
+queued on the render service together, so MuseScore renders them with a single launch.
+The script ends with the result's code as its exit code. consts["convertion_success"] for success.
+Usage: python artifact_stage.py path/to/task_dir midi_file_name
+"""
+
+import os, sys, json
+import time
+import threading
+from contextlib import contextmanager
+from utils_py.loggers import ENVS, log, error_log
+from utils_py.tracing import span, trace_tasks
+import convert_to_pdf
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+
+# PyMuPDF isn't thread-safe. Serializes the titling and rasterization when tasks run on threads (the
+# fork-server's fallback without os.fork()). The MuseScore renderings still run in parallel:
+fitz_lock = threading.Lock()
+
+
+@contextmanager
+def timed_stage(timings: dict, stage: str):
+    """Time the "with" block as "stage" in "timings" (seconds), and trace it as a span."""
+    start_time = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        timings[stage] = round(time.perf_counter() - start_time, 6)
+
+def write_json_data_file(json_file_path: str, j_data: dict) -> None:
+    """Write the JSON-data-file atomically: into a temporary file, which then replaces it."""
+    tmp_file_path = json_file_path + '.tmp'
+    with open(tmp_file_path, 'w') as json_file:
+        json.dump(j_data, json_file)
+    os.replace(tmp_file_path, json_file_path)
+
+def prepare_artifacts(audio_dir: str, midi_fname: str) -> dict:
+    """
+    Read the task's JSON-data-file, and return the paths and the title of its artifacts ("json_file_path",
+    "j_data", "midi_fname", "midi_path", "pdf_name", "pdf_path" and "title"), or a failure result ({"code": int})
+    if the task isn't valid.
+    audio_dir - The task's directory, with the JSON-data-file and the midi file.
+    midi_fname - The name of the midi file in the directory."""
+
+    json_file_path = os.path.join(audio_dir, consts['json_data_file_name'])
+    midi_path = os.path.join(audio_dir, midi_fname)
+    if not os.path.isfile(json_file_path):
+        error_log(ENVS.ALL, f'{script_name}: No "{consts["json_data_file_name"]}" in the directory "{audio_dir}".')
+        return {"code": consts["invalid_audio_dir"]}
+    with open(json_file_path, 'r') as json_file:
+        j_data = json.load(json_file)
+
+    # The PDF is named after the media file, and titled after the downloaded file:
+    pdf_name = os.path.splitext(j_data[consts["media_key_in_jData"]])[0] + consts["pdf_ext"]
+    pdf_path = os.path.join(audio_dir, pdf_name)
+    title = os.path.splitext(j_data.get(consts["download_key_in_jData"], pdf_name))[0]
+    if not convert_to_pdf.is_valid_job(midi_path, pdf_path):
+        return {"code": consts["pdf_generation_failed_bad_input"]}
+    return {"json_file_path": json_file_path, "j_data": j_data, "midi_fname": midi_fname, "midi_path": midi_path,
+            "pdf_name": pdf_name, "pdf_path": pdf_path, "title": title}
+
+def finish_artifacts(task: dict, future, cache_key: str | None, timings: dict) -> dict:
+    """
+    Wait for the task's PDF, which was queued on the render service, then add its title and footer, render its
+    preview images and update its JSON-data-file. Fill "timings" with the stages' durations. Return the result.
+    task - The task (see prepare_artifacts()).
+    future, cache_key - The rendering of its PDF (see convert_to_pdf.submit_pdfs_from_midis())."""
+
+    midi_path, pdf_path, pdf_name, j_data = task["midi_path"], task["pdf_path"], task["pdf_name"], task["j_data"]
+    try:
+        with timed_stage(timings, "musescore_render"):
+            convert_to_pdf.wait_for_pdf(future, cache_key, pdf_path)
+        with timed_stage(timings, "add_text_and_previews"), fitz_lock:
+            image_paths = convert_to_pdf.add_text_to_pdf(pdf_path, task["title"], render_previews=True)
+    except Exception as exp:
+        error_log(ENVS.ALL, f'{script_name}: Failed to create the PDF and images of "{midi_path}". Error:\n{exp}')
+        return {"code": consts["pdf_generation_failed"]}
+
+    image_names = [os.path.basename(image_path) for image_path in image_paths]
+    with timed_stage(timings, "metadata"):
+        j_data[consts["midi_key_in_jData"]] = task["midi_fname"]
+        j_data[consts["pdf_key_in_jData"]] = pdf_name
+        j_data[consts["img_key_in_jData"]] = image_names
+        write_json_data_file(task["json_file_path"], j_data)
+    return {"code": consts["convertion_success"], "fnames": [pdf_name, *image_names]}
+
+def create_artifacts(audio_dir: str, midi_fname: str, timings: dict) -> dict:
+    """
+    Create the PDF and the preview images of the task's midi file, and update its JSON-data-file (see the
+    module description). Fill "timings" with the stages' durations. Return the result (without the timings).
+    audio_dir - The task's directory, with the JSON-data-file and the midi file.
+    midi_fname - The name of the midi file in the directory."""
+    return create_artifacts_batch([(audio_dir, midi_fname)], [timings])[0]
+
+def create_artifacts_batch(tasks: list[tuple[str, str]], timings_list: list[dict]) -> list[dict]:
+    """
+    Create the artifacts of several tasks (see create_artifacts()). All their PDFs are queued on the render
+    service before any is waited for, so they are rendered together. Return the result of every task, in order.
+    tasks - (audio_dir, midi_fname) pairs.
+    timings_list - A "timings" dict per task, filled with its stages' durations."""
+
+    results = [prepare_artifacts(audio_dir, midi_fname) for audio_dir, midi_fname in tasks]
+    valid = [i for i, task in enumerate(results) if "code" not in task]
+    try:
+        renders = convert_to_pdf.submit_pdfs_from_midis([(results[i]["midi_path"], results[i]["pdf_path"]) for i in valid])
+    except Exception as exp:
+        error_log(ENVS.ALL, f'{script_name}: Failed to queue the PDFs of {len(valid)} tasks. Error:\n{exp}')
+        for i in valid:
+            results[i] = {"code": consts["pdf_generation_failed"]}
+        return results
+    for i, (future, cache_key) in zip(valid, renders):
+        results[i] = finish_artifacts(results[i], future, cache_key, timings_list[i])
+    return results
+
+def run_artifact_stage(audio_dir: str, midi_fname: str) -> dict:
+    """Run the artifact stage of a task directory (see the module description). Return its result, with the timings."""
+    if not os.path.isdir(audio_dir):
+        return {"code": consts["invalid_audio_dir"]}
+    timings = {}
+    start_time = time.perf_counter()
+    with trace_tasks([os.path.basename(os.path.abspath(audio_dir))], process=script_name):
+        result = create_artifacts(audio_dir, midi_fname, timings)
+    timings["total"] = round(time.perf_counter() - start_time, 6)
+    log(ENVS.DEVELOPMENT, f'{script_name}: The artifact stage of "{os.path.basename(audio_dir)}" ended with the code ' + \
+        f'{result["code"]}. Timings: {timings}')
+    return {**result, "timings": timings}
+
+def run_artifact_stages(tasks: list[tuple[str, str]]) -> dict:
+    """
+    Run the artifact stage of several task directories at once, e.g. of a whole upload (see the module description).
+    Return the overall result: {"code": int, "codes": [int, ...], "fnames": [...], "timings": [{stage: seconds}, ...]},
+    with the code and the timings of every task, in order. The overall code is consts["convertion_success"] if all
+    the tasks succeeded, consts["convertion_partial_success"] if only some did, or else the code of the first task.
+    tasks - (audio_dir, midi_fname) pairs."""
+
+    results = [{"code": consts["invalid_audio_dir"]} for _ in tasks]
+    valid = [i for i, (audio_dir, _) in enumerate(tasks) if os.path.isdir(audio_dir)]
+    timings_list = [{} for _ in tasks]
+    start_time = time.perf_counter()
+    task_ids = [os.path.basename(os.path.abspath(tasks[i][0])) for i in valid]
+    with trace_tasks(task_ids, process=script_name, meta={"batch_size": len(valid)}):
+        for i, result in zip(valid, create_artifacts_batch([tasks[i] for i in valid], [timings_list[i] for i in valid])):
+            results[i] = result
+    for timings in timings_list:
+        timings["total"] = round(time.perf_counter() - start_time, 6)
+
+    codes = [result["code"] for result in results]
+    success_count = codes.count(consts["convertion_success"])
+    log(ENVS.DEVELOPMENT, f'{script_name}: The artifact stage of {len(tasks)} directories created {success_count} of them. ' + \
+        f'Codes: {codes}')
+    code = consts["convertion_success"] if success_count == len(codes) else \
+        consts["convertion_partial_success"] if success_count else codes[0] if codes else consts["pdf_generation_failed_bad_input"]
+    return {"code": code, "codes": codes, "fnames": [fname for result in results for fname in result.get("fnames", [])],
+            "timings": timings_list}
+
+def main(argv: list[str]) -> int:
+    """
+    The main function. Run the artifact stage of a task directory.
+    argv: [<name>, task_directory, midi_file_name]
+    Return a code that signals success/failure.
+    """
+    if len(argv) < 3:
+        return consts["pdf_generation_failed_bad_input"]
+    return run_artifact_stage(argv[1], argv[2])["code"]
+
+
+if __name__ == "__main__":
+    """Usage: python artifact_stage.py path/to/task_dir midi_file_name"""
+    sys.exit(main(sys.argv))
@@ -0,0 +1,267 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A reproducible, offline benchmark of the transcription pipeline.
+
+The audio is synthetic (see synthetic_audio.py), of a configurable length, sample rate, channels and format.
+For every AI model (whose library and weights are available, others are reported as skipped):
+    * stages - The time of every stage (audio decode, resample, inference, note creation, midi write... see
+      utils_py/tracing.py) and of the whole run, per task, over a few repeats. Measured with the tracing spans.
+    * throughput - The end-to-end throughput (files/sec and audio-sec/sec) at several concurrency levels: the
+      tasks are transcribed by concurrent threads that share a single warm model (with consts["batching"]).
+Then the PDF (MuseScore, add_text_to_pdf) and image (page render) stages over the resulted midi, if MuseScore
+is installed. The peak RSS of the process is recorded after every phase.
+
+The results are printed and written as a JSON report. Given a baseline report, every metric is compared to
+it, and a regression beyond the tolerance (a slower stage, a lower throughput or a higher peak RSS) fails
+the run (exit code 1).
+Usage: python benchmarks/bench_pipeline.py [--models basic-pitch,MT3Net] [--files 4] [--duration 30]
+           [--sample-rate 44100] [--channels 2] [--format wav] [--concurrency 1,2,4] [--repeats 3]
+           [--output report.json] [--baseline baseline.json] [--tolerance 0.2]
+"""
+
+import os, sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Run from the benchmarks directory, with the project's packages importable:
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from synthetic_audio import write_synthetic_audio
+from utils_py import tracing
+from utils_py.tracing import span, trace_tasks
+from Models.model_registry import ModelRegistry
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+script_name = os.path.basename(__file__)
+audio_fname = 'audio'  # The name (without the extension) of the synthetic audio file of every task.
+
+
+def peak_rss_mb() -> float | None:
+    """Return the peak resident set size (MB) of the process so far, or None where it can't be measured (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024, 1)  # Bytes on macOS, KB elsewhere.
+
+def summarize(values: list[float]) -> dict:
+    """Return the p50, mean and max (milliseconds) of a list of durations (seconds)."""
+    return {"p50_ms": round(statistics.median(values) * 1000, 3), "mean_ms": round(statistics.mean(values) * 1000, 3),
+            "max_ms": round(max(values) * 1000, 3), "count": len(values)}
+
+def missing_weights(ai_model: str) -> str:
+    """Return the path of the model's missing checkpoint ("path=" argument, relative to MR-MT3), or '' if none is missing."""
+    for arg in consts["models_arguments"][ai_model]["args"]:
+        if arg.startswith('path='):
+            weights_path = os.path.join(solutionBasePath, consts["mrmt3DirPath"], arg[len('path='):].replace('\\=', '='))
+            if not os.path.isfile(weights_path):
+                return weights_path
+    return ''
+
+def make_task_dirs(root_dir: str, args) -> list[str]:
+    """Create a directory per task with its synthetic audio file (a different seed each) and return them."""
+    task_dirs = []
+    for i in range(args.files):
+        task_dir = os.path.join(root_dir, f'task_{i}')
+        os.makedirs(task_dir)
+        write_synthetic_audio(os.path.join(task_dir, audio_fname + '.' + args.format), duration_sec=args.duration,
+                              sample_rate=args.sample_rate, channels=args.channels, seed=i)
+        task_dirs.append(task_dir)
+    return task_dirs
+
+def remove_midi_files(task_dirs: list[str]) -> None:
+    """Remove the resulted midi files, so every run writes them anew."""
+    for task_dir in task_dirs:
+        for fname in os.listdir(task_dir):
+            if fname.endswith(consts["midi_ext"]):
+                os.remove(os.path.join(task_dir, fname))
+
+def bench_stages(registry: ModelRegistry, ai_model: str, task_dirs: list[str], repeats: int) -> dict:
+    """Transcribe every task "repeats" times, one at a time, and return the summary of every stage and of the run."""
+    samples = {}  # {stage: [seconds]}.
+    for _ in range(repeats):
+        remove_midi_files(task_dirs)
+        for task_dir in task_dirs:
+            with trace_tasks([os.path.basename(task_dir)], process=script_name) as traces:
+                with span("run"):
+                    registry.transcribe(ai_model, task_dir)
+            for stage, seconds in traces[os.path.basename(task_dir)].stages.items():
+                samples.setdefault(stage, []).append(seconds)
+    return {stage: summarize(values) for stage, values in samples.items()}
+
+def bench_throughput(registry: ModelRegistry, ai_model: str, task_dirs: list[str], concurrency_levels: list[int],
+                     audio_duration_sec: float) -> dict:
+    """Transcribe all the tasks by concurrent threads, per concurrency level. Return the throughput per level."""
+    throughput = {}
+    for concurrency in concurrency_levels:
+        remove_midi_files(task_dirs)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda task_dir: registry.transcribe(ai_model, task_dir), task_dirs))
+        elapsed = time.perf_counter() - start_time
+        throughput[str(concurrency)] = {"elapsed_sec": round(elapsed, 3), "files_per_sec": round(len(task_dirs) / elapsed, 3),
+                                        "audio_sec_per_sec": round(len(task_dirs) * audio_duration_sec / elapsed, 3)}
+    return throughput
+
+def bench_model(ai_model: str, task_dirs: list[str], args) -> dict:
+    """Benchmark a single AI model (see the module description). Return its results, or the reason it was skipped."""
+    weights_path = missing_weights(ai_model)
+    if weights_path:
+        return {"status": "skipped", "reason": f'No weights at "{weights_path}".'}
+    registry = ModelRegistry(consts["models_arguments"])  # No result cache: every run is a real inference.
+    try:
+        registry.preload([ai_model])
+    except Exception as exp:
+        return {"status": "skipped", "reason": f'Failed to load the model: {exp}'}
+
+    results = {"status": "ok", "model_load_sec": round(registry.load_times_sec[ai_model], 3)}
+    results["stages"] = bench_stages(registry, ai_model, task_dirs, args.repeats)
+    registry.batching = consts["batching"]  # Concurrent tasks share the model calls.
+    results["throughput"] = bench_throughput(registry, ai_model, task_dirs, args.concurrency, args.duration)
+    registry.close()
+    registry.evict(ai_model)
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+def bench_pdf_and_images(task_dirs: list[str], audio_format: str, repeats: int) -> dict:
+    """
+    Render the PDF and the images of every task that has a midi file, "repeats" times. Return the summary of
+    every stage, or the reason it was skipped."""
+    try:
+        import convert_to_pdf
+        import image_notes_generator
+    except ImportError as exp:
+        return {"status": "skipped", "reason": f'Missing a library: {exp}'}
+    if not os.path.isfile(convert_to_pdf.musescore_path):
+        return {"status": "skipped", "reason": f'No MuseScore at "{convert_to_pdf.musescore_path}".'}
+    convert_to_pdf.pdf_cache = None  # Every run is a real rendering.
+
+    samples = {}  # {stage: [seconds]}.
+    for _ in range(repeats):
+        for task_dir in task_dirs:
+            midi_names = [fname for fname in os.listdir(task_dir) if fname.endswith(consts["midi_ext"])]
+            if not midi_names:
+                continue
+            pdf_name = audio_fname + consts["pdf_ext"]
+            with open(os.path.join(task_dir, consts["json_data_file_name"]), 'w') as jData_file:
+                json.dump({consts["media_key_in_jData"]: audio_fname + '.' + audio_format,
+                           consts["midi_key_in_jData"]: midi_names[0], consts["pdf_key_in_jData"]: pdf_name}, jData_file)
+            with trace_tasks([os.path.basename(task_dir)], process=script_name) as traces:
+                convert_to_pdf.main([convert_to_pdf.script_name, os.path.join(task_dir, midi_names[0]),
+                                     os.path.join(task_dir, pdf_name), 'Benchmark'])
+                image_notes_generator.run_generator([image_notes_generator.script_name, task_dir])
+            for stage, seconds in traces[os.path.basename(task_dir)].stages.items():
+                samples.setdefault(stage, []).append(seconds)
+    if not samples:
+        return {"status": "skipped", "reason": 'No midi files to render (no model was benchmarked).'}
+    return {"status": "ok", "stages": {stage: summarize(values) for stage, values in samples.items()},
+            "peak_rss_mb": peak_rss_mb()}
+
+def flatten_metrics(report: dict) -> dict:
+    """Return the comparable metrics of a report: {name: (value, True if higher is better)}."""
+    metrics = {}
+    sections = {f'models.{ai_model}': results for ai_model, results in report["models"].items()}
+    sections["pdf_and_images"] = report["pdf_and_images"]
+    for name, results in sections.items():
+        for stage, summary in results.get("stages", {}).items():
+            metrics[f'{name}.stages.{stage}.p50_ms'] = (summary["p50_ms"], False)
+        for concurrency, throughput in results.get("throughput", {}).items():
+            metrics[f'{name}.throughput.{concurrency}.audio_sec_per_sec'] = (throughput["audio_sec_per_sec"], True)
+    if report.get("peak_rss_mb") is not None:
+        metrics["peak_rss_mb"] = (report["peak_rss_mb"], False)
+    return metrics
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return a description of every metric that regressed beyond "tolerance" (a fraction) relative to the baseline."""
+    regressions = []
+    baseline_metrics = flatten_metrics(baseline)
+    for name, (value, higher_is_better) in flatten_metrics(report).items():
+        if name not in baseline_metrics or not baseline_metrics[name][0]:
+            continue
+        base_value = baseline_metrics[name][0]
+        change = (value - base_value) / base_value
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f'{name}: {base_value} -> {value} ({change:+.1%})')
+    return regressions
+
+def print_report(report: dict) -> None:
+    """Print the results in a readable form."""
+    for name, results in [*report["models"].items(), ("pdf_and_images", report["pdf_and_images"])]:
+        print(f'\n{name}: {results["status"]}' + (f' ({results["reason"]})' if results["status"] != "ok" else ''))
+        for stage, summary in sorted(results.get("stages", {}).items(), key=lambda item: -item[1]["p50_ms"]):
+            print(f'  {stage:<18} p50 {summary["p50_ms"]:10.1f} ms   mean {summary["mean_ms"]:10.1f} ms   ' + \
+                  f'max {summary["max_ms"]:10.1f} ms')
+        for concurrency, throughput in results.get("throughput", {}).items():
+            print(f'  concurrency {concurrency:>3}: {throughput["files_per_sec"]:8.3f} files/sec, ' + \
+                  f'{throughput["audio_sec_per_sec"]:8.2f} audio-sec/sec')
+    print(f'\nPeak RSS: {report["peak_rss_mb"]} MB')
+
+def parse_arguments(argv: list[str]):
+    """Parse the command line (see the module description)."""
+    parser = argparse.ArgumentParser(description='Benchmark the transcription pipeline over synthetic audio.')
+    parser.add_argument('--models', default=consts["ai_model"], help='Comma separated keys of consts["models_arguments"].')
+    parser.add_argument('--files', type=int, default=4, help='The number of tasks (a synthetic audio file each).')
+    parser.add_argument('--duration', type=float, default=30, help='The length (seconds) of every audio file.')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--format', default='wav', help='The audio files format: wav, flac, ogg or mp3.')
+    parser.add_argument('--concurrency', default='1,2,4', help='Comma separated concurrency levels.')
+    parser.add_argument('--repeats', type=int, default=3, help='The repeats of the stages benchmark.')
+    parser.add_argument('--output', default='', help='The path of the JSON report.')
+    parser.add_argument('--baseline', default='', help='The path of a baseline JSON report to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='The allowed regression (a fraction) relative to the baseline.')
+    args = parser.parse_args(argv[1:])
+    args.models = [ai_model for ai_model in args.models.split(',') if ai_model]
+    args.concurrency = [int(level) for level in args.concurrency.split(',') if level]
+    return args
+
+def main(argv: list[str]) -> int:
+    """Run the benchmark (see the module description). Return 0, or 1 upon a regression."""
+    args = parse_arguments(argv)
+    report = {"meta": {"timestamp": datetime.now().isoformat(timespec='seconds'), "python": platform.python_version(),
+                       "platform": platform.platform(), "processor": platform.processor(), "cpu_count": os.cpu_count(),
+                       "config": {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')}},
+              "models": {}}
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    tracing.enabled = True  # The stages are measured by the tracing spans.
+    tracing.trace_file_path = os.path.join(tmp_dir, 'trace.jsonl')  # Keep the benchmark out of the app's trace file.
+    try:
+        task_dirs = make_task_dirs(os.path.join(tmp_dir, 'tasks'), args)
+        for ai_model in args.models:
+            report["models"][ai_model] = bench_model(ai_model, task_dirs, args)
+        report["pdf_and_images"] = bench_pdf_and_images(task_dirs, args.format, args.repeats)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f'The report was written to "{args.output}".')
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare_to_baseline(report, json.load(baseline_file), args.tolerance)
+        print(f'\n{len(regressions)} regressions beyond {args.tolerance:.0%} of the baseline.')
+        for regression in regressions:
+            print(f'  {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    """Usage: python benchmarks/bench_pipeline.py --help"""
+    sys.exit(main(sys.argv))
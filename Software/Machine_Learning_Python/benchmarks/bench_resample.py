@@ -0,0 +1,102 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A micro-benchmark of the audio front-end (see utils_py/audio_decoding.py): the time it takes to decode an
+audio file and resample it to the models' sample rates (16 kHz for MR-MT3, 22.05 kHz for basic-pitch),
+with every resampling quality, compared to the old librosa.load() + librosa.resample() front-end.
+
+The audio files are the bundled samples (consts["samplesAudioDir"]), or the files of the directories given
+as arguments. Without audio files, a synthetic 60 seconds 44.1 kHz stereo WAV file is used (see synthetic_audio.py).
+For every (file, target rate, option), the median of a few repeats is printed, with the speedup over librosa
+and the RMS difference from "soxr_vhq" (the most accurate option), as a rough quality measure.
+Usage: python benchmarks/bench_resample.py [audio_dir ...] [--repeats N]
+"""
+
+import os, sys
+import json
+import time
+import tempfile
+import statistics
+
+# Run from the benchmarks directory, with the project's packages importable:
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import soundfile
+from utils_py.audio_decoding import decode_audio, list_audio_files, resample_qualities
+from synthetic_audio import write_synthetic_audio
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+target_rates = [16000, 22050]  # MR-MT3, basic-pitch.
+reference_quality = "soxr_vhq"
+
+
+def librosa_front_end(audio_path: str, target_sr: int) -> np.ndarray:
+    """The old front-end: load at the native rate (mono, float32), then resample the whole array with librosa."""
+    import librosa
+    audio, sr = librosa.load(audio_path, sr=None)
+    return librosa.resample(audio, orig_sr=sr, target_sr=target_sr)
+
+def time_it(fn, repeats: int) -> tuple[float, np.ndarray]:
+    """Run "fn" "repeats" times. Return the median time (seconds) and the last result."""
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start_time)
+    return statistics.median(times), result
+
+def rms_difference(audio: np.ndarray, reference: np.ndarray) -> float:
+    """Return the RMS of the difference between two signals (over their common length)."""
+    n = min(len(audio), len(reference))
+    return float(np.sqrt(np.mean((audio[:n].astype(np.float64) - reference[:n]) ** 2))) if n else 0.0
+
+def get_audio_paths(audio_dirs: list[str]) -> list[str]:
+    """Return the audio files of the given directories, or of the bundled samples' directories."""
+    if not audio_dirs:
+        samples_dir = os.path.join(solutionBasePath, consts["samplesAudioDir"])
+        audio_dirs = [os.path.join(samples_dir, sub_dir) for sub_dir in consts["samplesAudioSubDirsLst"]]
+    return [audio_path for audio_dir in audio_dirs if os.path.isdir(audio_dir) for audio_path in list_audio_files(audio_dir)]
+
+def bench_file(audio_path: str, repeats: int) -> None:
+    """Benchmark all the options over a single file and print a table per target rate."""
+    info = soundfile.info(audio_path) if not audio_path.endswith(('.m4a', '.aac')) else None
+    details = f'{info.samplerate} Hz, {info.channels} ch, {info.duration:.1f} sec' if info else 'ffmpeg-decoded'
+    print(f'\n{os.path.basename(audio_path)} ({details})')
+
+    for target_sr in target_rates:
+        librosa_time, _ = time_it(lambda: librosa_front_end(audio_path, target_sr), repeats)
+        _, reference = time_it(lambda: decode_audio(audio_path, target_sr, reference_quality), 1)
+        print(f'  -> {target_sr} Hz:')
+        print(f'    {"librosa (old)":<16} {librosa_time * 1000:9.1f} ms')
+        for quality in resample_qualities:
+            try:
+                quality_time, audio = time_it(lambda: decode_audio(audio_path, target_sr, quality), repeats)
+            except ImportError as exp:
+                print(f'    {quality:<16} skipped ({exp})')
+                continue
+            print(f'    {quality:<16} {quality_time * 1000:9.1f} ms  x{librosa_time / quality_time:5.2f}  ' + \
+                  f'rms diff: {rms_difference(audio, reference):.2e}  dtype: {audio.dtype}')
+
+def main(argv: list[str]) -> int:
+    """Run the benchmark (see the module description). Return 0."""
+    args = argv[1:]
+    repeats = 3
+    if '--repeats' in args:
+        i = args.index('--repeats')
+        repeats = int(args[i + 1])
+        args = args[:i] + args[i + 2:]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_paths = get_audio_paths(args) or [write_synthetic_audio(os.path.join(tmp_dir, 'synthetic.wav'))]
+        for audio_path in audio_paths:
+            bench_file(audio_path, repeats)
+    return 0
+
+
+if __name__ == "__main__":
+    """Usage: python benchmarks/bench_resample.py [audio_dir ...] [--repeats N]"""
+    sys.exit(main(sys.argv))
@@ -0,0 +1,58 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+Synthetic audio for the benchmarks, so they run offline and reproducibly: a sequence of random triads
+(sines with their first overtones and a decaying envelope, plus a little noise), of a given length, sample
+rate, channels and format (any format soundfile writes: .wav, .flac, .ogg, and .mp3 with libsndfile >= 1.1).
+The same seed always gives the same audio.
+Usage:
+    audio_path = write_synthetic_audio(os.path.join(dir_path, 'synthetic.wav'), duration_sec=30)
+"""
+
+import numpy as np
+import soundfile
+
+chord_duration_sec = 0.5
+root_notes = np.arange(48, 72)  # Midi notes (C3 to B4).
+
+
+def midi_to_hz(note: np.ndarray) -> np.ndarray:
+    """Return the frequency (Hz) of a midi note number."""
+    return 440.0 * 2 ** ((note - 69) / 12)
+
+def generate_chords(duration_sec: float, sample_rate: int, seed: int = 0) -> np.ndarray:
+    """Return a mono float32 array of random triads, "chord_duration_sec" each (see the module description)."""
+    rng = np.random.default_rng(seed)
+    chord_samples = int(chord_duration_sec * sample_rate)
+    n_chords = max(1, int(np.ceil(duration_sec / chord_duration_sec)))
+    t = np.arange(chord_samples, dtype=np.float32) / sample_rate
+    envelope = np.exp(-3 * t).astype(np.float32)
+
+    chords = []
+    for _ in range(n_chords):
+        root = rng.choice(root_notes)
+        third = 3 if rng.random() < 0.5 else 4  # Minor or major.
+        chord = np.zeros(chord_samples, dtype=np.float32)
+        for note in (root, root + third, root + 7):
+            for harmonic, amplitude in ((1, 0.2), (2, 0.06), (3, 0.03)):
+                chord += amplitude * np.sin(2 * np.pi * midi_to_hz(note) * harmonic * t).astype(np.float32)
+        chords.append(chord * envelope)
+    audio = np.concatenate(chords)[:int(duration_sec * sample_rate)]
+    return audio + 0.005 * rng.standard_normal(len(audio)).astype(np.float32)
+
+def write_synthetic_audio(audio_path: str, duration_sec: float = 60, sample_rate: int = 44100, channels: int = 2,
+                          seed: int = 0) -> str:
+    """
+    Write a synthetic audio file and return its path. The format is determined by the file's extension.
+    audio_path - The path of the file.
+    duration_sec - The length of the audio (seconds).
+    sample_rate - The sample rate of the audio.
+    channels - The number of channels (the others are quieter copies of the first).
+    seed - The random seed of the chords."""
+    mono = generate_chords(duration_sec, sample_rate, seed)
+    audio = np.stack([mono * (1 - 0.2 * ch) for ch in range(channels)], axis=1)
+    soundfile.write(audio_path, audio, sample_rate)
+    return audio_path
+
+
+__all__ = ['generate_chords', 'write_synthetic_audio']
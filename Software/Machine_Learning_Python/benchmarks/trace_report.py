@@ -0,0 +1,76 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+Summarize the stage timings of the trace file (see utils_py/tracing.py): for every process and stage (and
+the tasks' total), print the number of samples, p50, p95 and max (milliseconds), slowest stages first, so
+the real bottleneck of the pipeline stands out.
+Usage: python benchmarks/trace_report.py [trace_file] [--since ISO-timestamp]
+"""
+
+import os, sys
+import json
+import math
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Return the "p" percentile (0-100, nearest rank) of a sorted, non-empty list."""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def read_traces(trace_file_path: str, since: str = '') -> list[dict]:
+    """Read the traces (json lines) of the file, from the timestamp "since" on. Malformed lines are skipped."""
+    traces = []
+    with open(trace_file_path, 'r', encoding='utf-8') as trace_file:
+        for line in trace_file:
+            try:
+                trace = json.loads(line)
+            except ValueError:
+                continue
+            if trace.get("timestamp", '') >= since:
+                traces.append(trace)
+    return traces
+
+def summarize(traces: list[dict]) -> list[dict]:
+    """Return a row per (process, stage): {"process", "stage", "count", "p50_ms", "p95_ms", "max_ms"}, by p95 (descending)."""
+    samples = {}  # {(process, stage): [seconds]}.
+    for trace in traces:
+        process = trace.get("process", '')
+        samples.setdefault((process, "total"), []).append(trace.get("total_sec", 0.0))
+        for stage, seconds in trace.get("stages", {}).items():
+            samples.setdefault((process, stage), []).append(seconds)
+
+    rows = []
+    for (process, stage), values in samples.items():
+        values.sort()
+        rows.append({"process": process, "stage": stage, "count": len(values), "p50_ms": percentile(values, 50) * 1000,
+                     "p95_ms": percentile(values, 95) * 1000, "max_ms": values[-1] * 1000})
+    return sorted(rows, key=lambda row: (row["process"], row["stage"] != "total", -row["p95_ms"]))
+
+def main(argv: list[str]) -> int:
+    """Print the summary of the trace file (see the module description). Return 0, or 1 if there's no trace file."""
+    args = argv[1:]
+    since = ''
+    if '--since' in args:
+        i = args.index('--since')
+        since = args[i + 1]
+        args = args[:i] + args[i + 2:]
+    trace_file_path = args[0] if args else os.path.join(solutionBasePath, consts["tracing"]["trace_file"])
+    if not os.path.isfile(trace_file_path):
+        print(f'No trace file at "{trace_file_path}". Enable consts["tracing"] and run some tasks first.')
+        return 1
+
+    traces = read_traces(trace_file_path, since)
+    print(f'{len(traces)} traces in "{trace_file_path}"' + (f' since {since}' if since else ''))
+    print(f'{"process":<28} {"stage":<18} {"count":>7} {"p50 ms":>10} {"p95 ms":>10} {"max ms":>10}')
+    for row in summarize(traces):
+        print(f'{row["process"]:<28} {row["stage"]:<18} {row["count"]:>7} {row["p50_ms"]:>10.1f} ' + \
+              f'{row["p95_ms"]:>10.1f} {row["max_ms"]:>10.1f}')
+    return 0
+
+
+if __name__ == "__main__":
+    """Usage: python benchmarks/trace_report.py [trace_file] [--since ISO-timestamp]"""
+    sys.exit(main(sys.argv))
@@ -7,13 +7,26 @@ save them.
 The script expects as arguments the source path to the presaved midi file, a target path for 
 the generated PDF file to be saved at, and an optional title for the PDF file's first page.
 The script ends with a proper exit code. consts["convertion_success"] for success.
+
+With "--jobs", it expects a list of (midi, pdf, title) triples instead. All the midi files are queued on the
+render service at once, so MuseScore renders them with a batch job file (a single launch, up to
+consts["musescore_service"]["max_jobs_per_launch"] files), and then the titles and footers are added to the
+PDFs one by one. The code of every job is printed as a json line:
+    consts["STDIO_DATA_MSG_PREFIX"] + {"codes": [int, ...]} + consts["STDIO_MSG_POSTFIX"]
+and the exit code is consts["convertion_success"] if all the jobs succeeded, consts["convertion_partial_success"]
+if only some did, or a failure code if none did.
 """
 
 import sys, os, json
-import subprocess
+import atexit
 import fitz
+from concurrent.futures import Future
 from datetime import datetime
 from utils_py.loggers import ENVS, log, error_log
+from utils_py.result_cache import ResultCache
+from utils_py.musescore_service import MuseScoreRenderService
+from utils_py.tracing import span, trace_tasks
+from image_notes_generator import image_consts, render_page_images, save_images
 
 solutionBasePath =  os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
 with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
@@ -27,6 +40,15 @@ signature = f'© {datetime.now().strftime("%d %b %Y")} Stellar Intelligence. All
 # Path to a program that generates PDF:
 musescore_path = os.path.join(solutionBasePath, consts['musescore_path'])
 
+# A cache of the PDF renderings of midi files (see consts["result_cache"]), keyed by the midi's content:
+cache_consts = consts["result_cache"]
+pdf_cache = ResultCache(os.path.join(solutionBasePath, cache_consts["dir"]), cache_consts["max_size_MB"] * 1024 * 1024) \
+    if cache_consts["enabled"] and cache_consts["cache_pdf"] else None
+cached_pdf_name = 'pdf'  # The name of the PDF file in a cache entry.
+
+# The MuseScore instances that render the PDFs (see consts["musescore_service"]), created on the first render:
+render_service = None
+
 
 class TextObj:
     """
@@ -53,12 +75,83 @@ class TextObj:
             self.widthPxl = fitz.get_text_length(self.text, fontsize=self.fontsize, fontname=self.fontname)
 
 
+def get_render_service() -> MuseScoreRenderService:
+    """Return the render service of this process, creating it on the first call."""
+    global render_service
+    if render_service is None:
+        render_service = MuseScoreRenderService(musescore_path, **consts["musescore_service"])
+    return render_service
+
+def close_render_service() -> None:
+    """Close the render service (killing its running MuseScore instances), if it was created."""
+    global render_service
+    if render_service is not None:
+        render_service.close()
+        render_service = None
+
+def _reset_render_service_in_child() -> None:
+    """A forked child has none of the parent's worker threads, so it starts a service of its own."""
+    global render_service
+    render_service = None
+
+atexit.register(close_render_service)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_render_service_in_child)
+
+def submit_pdf_from_midi(midi_path: str, target_path: str) -> tuple[Future, str | None]:
+    """
+    Queue the rendering of a PDF base file from the midi file on the render service (see "get_render_service()").
+    A midi file that was already rendered is copied from the cache (see "pdf_cache") instead.
+    Return a Future of the PDF's path, and the cache key to store the PDF under once it's rendered (None if it
+    was served from the cache, or caching is disabled). Pass both to wait_for_pdf().
+    midi_path - Path to the saved midi file.
+    target_path - Path for the PDF file to be saved at."""
+    return submit_pdfs_from_midis([(midi_path, target_path)])[0]
+
+def submit_pdfs_from_midis(paths: list[tuple[str, str]]) -> list[tuple[Future, str | None]]:
+    """
+    Queue the rendering of several PDF base files at once, so the render service renders them together (see
+    submit_pdf_from_midi()). A job that fails before it's queued (e.g. an unreadable midi) gets a failed Future.
+    Return a (Future, cache key) pair of every job, in order.
+    paths - (midi_path, target_path) pairs."""
+
+    results = [None] * len(paths)
+    cache_keys = {}  # {job index: cache key} of the jobs to render.
+    for i, (midi_path, target_path) in enumerate(paths):
+        with span("cache_lookup"):
+            try:
+                cache_key = ResultCache.make_key(ResultCache.hash_file(midi_path), 'musescore') if pdf_cache else None
+                if cache_key and pdf_cache.get(cache_key) is not None:
+                    pdf_cache.copy_file(cache_key, cached_pdf_name, target_path)
+                    log(ENVS.DEVELOPMENT, f'{script_name}: The PDF of "{os.path.basename(midi_path)}" was served from the cache.')
+                    results[i] = (Future(), None)
+                    results[i][0].set_result(target_path)
+                    continue
+            except Exception as exp:
+                results[i] = (Future(), None)
+                results[i][0].set_exception(exp)
+                continue
+        cache_keys[i] = cache_key
+    if cache_keys:
+        futures = get_render_service().submit_batch([paths[i] for i in cache_keys])
+        for (i, cache_key), future in zip(cache_keys.items(), futures):
+            results[i] = (future, cache_key)
+    return results
+
+def wait_for_pdf(future: Future, cache_key: str | None, target_path: str) -> None:
+    """Wait for a PDF that was queued by submit_pdf_from_midi() (raise if it failed), and cache it (before it's titled)."""
+    with span("musescore_render"):
+        future.result()
+    if cache_key and os.path.isfile(target_path):
+        pdf_cache.put(cache_key, {cached_pdf_name: target_path})
+
 def create_pdf_from_midi(midi_path, target_path):
     """
-    Call the musescore program to generate a PDF base file from the midi file.
+    Render a PDF base file from the midi file with MuseScore (see submit_pdf_from_midi()).
     midi_path - Path to the saved midi file.
     target_path - Path for the PDF file to be saved at."""
-    subprocess.run([musescore_path, midi_path, "-o", target_path])
+    future, cache_key = submit_pdf_from_midi(midi_path, target_path)
+    wait_for_pdf(future, cache_key, target_path)
 
 def create_title_and_footer(doc: fitz.Document, title: str = None) -> tuple[TextObj]:
     """
@@ -91,16 +184,19 @@ def create_title_and_footer(doc: fitz.Document, title: str = None) -> tuple[Text
 
     return title_obj, footer_obj
 
-def add_text_to_pdf(pdf_path: str, title: str):
+def add_text_to_pdf(pdf_path: str, title: str, render_previews: bool = None) -> list[str]:
     """
     Add a title and a footer for the PDF file in the given "pdf_path" path.
     The title is added to the top of the first page and the footer to the bottom of every page.
     The title is given by the "title" (str) argument. If not provided, the default will be the file's basename.
+    If "render_previews" (default: consts["image_generator"]["render_with_pdf"]), the preview images of the titled
+    pages are rendered from the same in-memory document and saved beside the PDF, for image_notes_generator.py to find.
+    Return the paths of the saved preview images.
     """
     doc = fitz.open(pdf_path)
     if len(doc) == 0:
         doc.close()
-        return
+        return []
     
     # Creating the title and footer:
     title, footer = create_title_and_footer(doc, title)
@@ -111,11 +207,18 @@ def add_text_to_pdf(pdf_path: str, title: str):
             page.insert_text((title.x0, title.y0), title.text, fontsize=title.fontsize, fontname=title.fontname)
         page.insert_text((footer.x0, footer.y0), footer.text, fontsize=footer.fontsize, fontname=footer.fontname)
     
+    # Render the previews before the document is closed:
+    images = []
+    if render_previews or (render_previews is None and image_consts["render_with_pdf"]):
+        with span("page_render"):
+            images = render_page_images(doc)
+
     # Save:
     tmp_pdf_path = os.path.splitext(pdf_path)[0] + '_tmp.pdf'
     doc.save(tmp_pdf_path)
     doc.close()
     os.replace(tmp_pdf_path, pdf_path)
+    return save_images(os.path.splitext(pdf_path)[0], images)  # After the PDF, so they're found newer than it.
 
 def save_midi_as_pdf(midi_path: str, target_path: str, title: str) -> int:
     """
@@ -126,22 +229,97 @@ def save_midi_as_pdf(midi_path: str, target_path: str, title: str) -> int:
     """
     try:
         create_pdf_from_midi(midi_path, target_path)
-        add_text_to_pdf(target_path, title)
+        with span("add_text_to_pdf"):
+            add_text_to_pdf(target_path, title)
         log(ENVS.DEVELOPMENT, f'{script_name}: created and titled a PDF file successfully.')
     except Exception as exp:
         error_log(ENVS.ALL, f'{script_name}: Failed to create and title a PDF file. Error:\n{exp}')
         return consts["pdf_generation_failed"]
     return consts["convertion_success"]
 
+def save_midis_as_pdfs(jobs: list[tuple[str, str, str]]) -> list[int]:
+    """
+    Convert several midi files into PDFs (see the module description): render them all with the render service
+    at once, then add the titles and footers one by one. Adding them takes milliseconds per PDF, so it isn't
+    worth a process per PDF, and PyMuPDF isn't thread-safe.
+    Return the code of every job, in order (like save_midi_as_pdf()).
+    jobs - (midi_path, target_path, title) triples. See save_midi_as_pdf()."""
+
+    codes = [consts['pdf_generation_failed_bad_input'] if not is_valid_job(midi_path, target_path) else None
+             for midi_path, target_path, _ in jobs]
+    # All the jobs are queued together, before any is waited for:
+    valid = [i for i, code in enumerate(codes) if code is None]
+    try:
+        pending = dict(zip(valid, submit_pdfs_from_midis([(jobs[i][0], jobs[i][1]) for i in valid])))
+    except Exception as exp:
+        pending = {}
+        for i in valid:
+            codes[i] = _failure_code(jobs[i][0], exp)
+    rendered = []  # The indices of the jobs whose PDF was rendered.
+    for i, (future, cache_key) in pending.items():
+        try:
+            wait_for_pdf(future, cache_key, jobs[i][1])
+            rendered.append(i)
+        except Exception as exp:
+            codes[i] = _failure_code(jobs[i][0], exp)
+
+    for i in rendered:
+        try:
+            with span("add_text_to_pdf"):
+                add_text_to_pdf(jobs[i][1], jobs[i][2])
+            codes[i] = consts["convertion_success"]
+        except Exception as exp:
+            codes[i] = _failure_code(jobs[i][0], exp)
+    log(ENVS.DEVELOPMENT, f'{script_name}: created and titled {codes.count(consts["convertion_success"])} ' + \
+        f'of {len(jobs)} PDF files successfully.')
+    return codes
+
+def _failure_code(midi_path: str, exp: BaseException) -> int:
+    """Log the failure of a job and return its code."""
+    error_log(ENVS.ALL, f'{script_name}: Failed to create and title a PDF file of "{midi_path}". Error:\n{exp}')
+    return consts["pdf_generation_failed"]
+
+def is_valid_job(midi_path: str, pdf_path: str) -> bool:
+    """Return True if the midi file exists, and the PDF is to be saved beside it, with the right extensions."""
+    return os.path.isfile(midi_path) and os.path.dirname(midi_path) == os.path.dirname(pdf_path) and \
+        os.path.splitext(midi_path)[-1] == consts["midi_ext"] and os.path.splitext(pdf_path)[-1] == consts["pdf_ext"]
+
+def run_jobs(argv: list[str]) -> tuple[int, list[int]]:
+    """
+    Convert several presaved midi files into PDFs (see the module description).
+    argv: [<name>, "--jobs", source_midi_file_path, target_pdf_file_path, title, ...]
+    Return the overall code and the code of every job."""
+
+    args = argv[2:]
+    if not args or len(args) % 3 != 0:
+        return consts['pdf_generation_failed_bad_input'], []
+    jobs = [(args[i], args[i + 1], args[i + 2]) for i in range(0, len(args), 3)]
+
+    # Run the convertions (traced by the tasks' ids, which are their directories' names):
+    task_ids = list(dict.fromkeys(os.path.basename(os.path.dirname(os.path.abspath(midi_path))) for midi_path, _, _ in jobs))
+    with trace_tasks(task_ids, process=script_name, meta={"batch_size": len(jobs)}):
+        codes = save_midis_as_pdfs(jobs)
+
+    success_count = codes.count(consts["convertion_success"])
+    if success_count == len(codes):
+        return consts["convertion_success"], codes
+    if success_count:
+        return consts["convertion_partial_success"], codes
+    is_bad_input = all(code == consts['pdf_generation_failed_bad_input'] for code in codes)
+    return consts['pdf_generation_failed_bad_input'] if is_bad_input else consts["pdf_generation_failed"], codes
+
 def main(argv) -> int:
     """
     The main function. Convert a presaved midi file into a pdf and save it in the given target path.
     argv: [<name>, source_midi_file_path, target_pdf_file_path, (optional) title]
+          or [<name>, "--jobs", ...] (see run_jobs()).
     Return a code that signals success/failure.
     """
+    if len(argv) >= 2 and argv[1] == '--jobs':
+        return run_jobs(argv)[0]
+
     # Check input arguments validity:
-    if len(argv) < 3 or not os.path.isfile(argv[1]) or os.path.dirname(argv[1]) != os.path.dirname(argv[2]) or \
-        os.path.splitext(argv[1])[-1] != consts["midi_ext"] or os.path.splitext(argv[2])[-1] != consts["pdf_ext"]:
+    if len(argv) < 3 or not is_valid_job(argv[1], argv[2]):
         return consts['pdf_generation_failed_bad_input']
 
     # Extract arguments:
@@ -149,12 +327,19 @@ def main(argv) -> int:
     pdf_path = argv[2]
     title = str(argv[3]) if len(argv) >= 4 else None
 
-    # Run the convertion and return the result code:
-    res_code = save_midi_as_pdf(midi_path, pdf_path, title)
+    # Run the convertion and return the result code (traced by the task's id, which is its directory's name):
+    with trace_tasks([os.path.basename(os.path.dirname(os.path.abspath(midi_path)))], process=script_name):
+        res_code = save_midi_as_pdf(midi_path, pdf_path, title)
     return res_code
 
 
 if __name__ == "__main__":
-    """Usage: python convert_to_pdf.py path/to/source_file.mid path/to/target_file.pdf title(optional)"""
-    code = main(sys.argv)
+    """
+    Usage: python convert_to_pdf.py path/to/source_file.mid path/to/target_file.pdf title(optional)
+           python convert_to_pdf.py --jobs path/to/a.mid path/to/a.pdf title_a path/to/b.mid path/to/b.pdf title_b ..."""
+    if len(sys.argv) >= 2 and sys.argv[1] == '--jobs':
+        code, codes = run_jobs(sys.argv)
+        print(consts["STDIO_DATA_MSG_PREFIX"] + json.dumps({"codes": codes}) + consts["STDIO_MSG_POSTFIX"], flush=True)
+    else:
+        code = main(sys.argv)
     sys.exit(code)
\ No newline at end of file
@@ -0,0 +1,336 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A fork-server (zygote) for the Python jobs of the app: PDF generation (convert_to_pdf.py), image
+generation (image_notes_generator.py), both at once (artifact_stage.py) and transcription (transcribe_stdio.py).
+
+Launching a new interpreter per job re-imports fitz, librosa, torch, hydra and basic-pitch,
+which takes seconds. Instead, this process imports them once (and optionally loads the AI model, see
+consts["fork_server"]["preload_ai_model"]: off by default, since the controller routes the transcriptions to
+its transcriber daemon, and a loaded model starts runtime threads before every fork), prints consts["server_is_ready_msg"], and then forks a
+pre-warmed child per job, so a job starts in milliseconds and the children share the parent's memory
+(e.g. the model weights) copy-on-write.
+
+Protocol (STDIN/STDOUT, a message per line, like transcribe_stdio.py):
+    Request:  {"id": str, "job": "pdf" | "image" | "transcribe", "args": [str, ...]}
+        pdf - args: [source_midi_file_path, target_pdf_file_path, (optional) title] (see convert_to_pdf.main()).
+        pdf_batch - args: [source_midi_file_path, target_pdf_file_path, title, ...] (see convert_to_pdf.run_jobs()).
+        artifacts - args: [directory, midi_file_name, ...] (see artifact_stage.run_artifact_stage(), and
+            run_artifact_stages() for several directories).
+        image - args: [directory] (see image_notes_generator.run_generator()).
+        transcribe - args: [audio_dir_path, (optional) instruments_mode].
+    Response: consts["STDIO_DATA_MSG_PREFIX"] + {"id": str, "code": int, "fnames": [str, ...]} + consts["STDIO_MSG_POSTFIX"]
+        A "pdf_batch" response has the code of every job too ("codes": [int, ...]), and the PDFs it created as "fnames".
+        An "artifacts" response has the stages' durations too ("timings": {stage: seconds}). With several
+        directories, it has the code of every directory too ("codes"), and "timings" is a list of them.
+The responses are sent in the order the jobs finish, and other lines on the STDOUT are logs (of the children
+too). An invalid request is answered with consts["status_codes"]["bad_input"], and its id if it can be recovered. Closing the STDIN stops the server once the running jobs are done.
+
+Up to consts["fork_server"]["max_children"] jobs run at once, and a job that runs longer than "job_timeout_sec"
+is killed. On a platform without os.fork() (Windows) the jobs run in-process on a thread pool instead, which
+still saves the imports, but not the isolation.
+Usage: python fork_server.py
+"""
+
+# General system imports:
+import os, sys
+import time
+module_start_time = time.perf_counter()
+import re
+import json
+import signal
+import selectors
+from concurrent.futures import ThreadPoolExecutor
+from utils_py.loggers import ENVS, log, error_log, flush_logs, stdout_lock
+from utils_py.result_cache import flush_cache_stats
+
+# The heavy job modules, imported once and shared by all the children:
+import convert_to_pdf
+import image_notes_generator
+import artifact_stage
+import transcribe_stdio
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+fork_consts = consts["fork_server"]
+read_chunk_size = 65536
+
+
+def run_pdf_job(args: list[str]) -> dict:
+    """Convert a midi file into a PDF (see convert_to_pdf.main()). Return the job's result."""
+    return {"code": convert_to_pdf.main([convert_to_pdf.script_name, *args])}
+
+def run_pdf_batch_job(args: list[str]) -> dict:
+    """Convert several midi files into PDFs with a single MuseScore launch (see convert_to_pdf.run_jobs()). Return the job's result."""
+    code, codes = convert_to_pdf.run_jobs([convert_to_pdf.script_name, '--jobs', *args])
+    fnames = [os.path.basename(args[i * 3 + 1]) for i, job_code in enumerate(codes) if job_code == consts["convertion_success"]]
+    return {"code": code, "codes": codes, "fnames": fnames}
+
+def run_image_job(args: list[str]) -> dict:
+    """Generate the images of a directory's PDF (see image_notes_generator.run_generator()). Return the job's result."""
+    return {"code": image_notes_generator.run_generator([image_notes_generator.script_name, *args])}
+
+def run_artifacts_job(args: list[str]) -> dict:
+    """
+    Create the PDF and images of a directory's midi, and update its metadata (see artifact_stage.py). Several
+    directories are run as one batch, so their PDFs are rendered together. Return the job's result."""
+    if len(args) < 2 or len(args) % 2 != 0:
+        return {"code": consts["pdf_generation_failed_bad_input"]}
+    if len(args) == 2:
+        return artifact_stage.run_artifact_stage(args[0], args[1])
+    return artifact_stage.run_artifact_stages([(args[i], args[i + 1]) for i in range(0, len(args), 2)])
+
+def run_transcribe_job(args: list[str]) -> dict:
+    """Transcribe the audio files of a directory with the warm AI model (see transcribe_stdio.py). Return the job's result."""
+    audio_dir_path = args[0]
+    if not os.path.isdir(audio_dir_path):
+        return {"code": consts["invalid_audio_dir"]}
+    instruments_mode = int(args[1]) if len(args) > 1 else consts["instruments_options"]["many"]["value"]
+    transcribed_data = transcribe_stdio.model_registry.transcribe(transcribe_stdio.ai_model, audio_dir_path, instruments_mode)
+    return {"code": transcribed_data.code, "fnames": transcribed_data.fnames}
+
+# {job name: (job function (args) -> {"code": int, ...}, the failure code of the job)}:
+jobs = {
+    "pdf": (run_pdf_job, consts["pdf_generation_failed"]),
+    "pdf_batch": (run_pdf_batch_job, consts["pdf_generation_failed"]),
+    "image": (run_image_job, consts["image_generation_failed"]),
+    "artifacts": (run_artifacts_job, consts["pdf_generation_failed"]),
+    "transcribe": (run_transcribe_job, consts["midi_generation_failed"]),
+}
+
+
+class JobRequest:
+    """A parsed job request, and (once forked) the state of its child process."""
+
+    def __init__(self, id: str, job: str, args: list[str]):
+        """
+        Create a new job request.
+        id - An identifier for the job (returned with its response).
+        job - A key in "jobs".
+        args - The job's arguments."""
+        self.id = id
+        self.job = job
+        self.args = args
+        self.pid = None  # The child process.
+        self.result_fd = None  # The read end of the pipe the child writes its result to.
+        self.output = b''  # The result read so far.
+        self.start_time = None
+
+    @classmethod
+    def parse(cls, message: str):
+        """Parse a request line. Raise ValueError if it isn't a valid request."""
+        try:
+            request = json.loads(message)
+            job_request = cls(str(request["id"]), request["job"], [str(arg) for arg in request.get("args", [])])
+        except (json.JSONDecodeError, KeyError, TypeError) as exp:
+            raise ValueError(f'Invalid job request: {exp}')
+        if job_request.job not in jobs:
+            raise ValueError(f'Unknown job "{job_request.job}". The supported jobs: {list(jobs.keys())}')
+        return job_request
+
+    @staticmethod
+    def recover_id(message: str) -> str:
+        """Return the id of an invalid request line if it can be found, or else "", so its error reaches its job."""
+        try:
+            return str(json.loads(message)["id"])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            match = re.search(r'"id"\s*:\s*"([^"]*)"', message)
+            return match.group(1) if match else ""
+
+
+def run_job(job_request: JobRequest) -> dict:
+    """Run a job in the current process and return its result. A failure is logged and returned as the job's failure code."""
+    job_fn, failure_code = jobs[job_request.job]
+    try:
+        return job_fn(job_request.args)
+    except Exception as exp:
+        error_log(ENVS.ALL, f'{script_name}: id={job_request.id}: The "{job_request.job}" job failed. The error:\n{exp}')
+        return {"code": failure_code}
+
+def send_response(id: str, result: dict) -> None:
+    """Send the result of a job through STDOUT (see the module description)."""
+    response = json.dumps({"id": id, "code": result.get("code"), "fnames": result.get("fnames", []),
+                           **{key: value for key, value in result.items() if key not in ("code", "fnames")}})
+    with stdout_lock:
+        sys.stdout.write(consts["STDIO_DATA_MSG_PREFIX"] + response + consts["STDIO_MSG_POSTFIX"] + '\n')
+        sys.stdout.flush()
+
+def parse_request_line(line: bytes) -> JobRequest | None:
+    """
+    Parse a request line. Return its JobRequest, or None if it's empty or invalid. An invalid line is logged and
+    answered with a bad input response, tagged with its id if it can be recovered."""
+    try:
+        message = line.decode('utf-8').strip()
+    except UnicodeDecodeError as exp:
+        message = line.decode('utf-8', errors='replace').strip()
+        error_log(ENVS.ALL, f'{script_name}: Invalid job request: It isn\'t utf-8: {exp}')
+        send_response(JobRequest.recover_id(message), {"code": consts["status_codes"]["bad_input"]})
+        return None
+    if not message:
+        return None
+    try:
+        return JobRequest.parse(message)
+    except ValueError as exp:
+        error_log(ENVS.ALL, f'{script_name}: {exp}')
+        send_response(JobRequest.recover_id(message), {"code": consts["status_codes"]["bad_input"]})
+        return None
+
+def send_ready_message() -> None:
+    """Print consts["server_is_ready_msg"] to the STDOUT, signaling that the server is ready for jobs."""
+    with stdout_lock:
+        sys.stdout.write(f'{consts["server_is_ready_msg"]} on STDIN for forked jobs ' + \
+                         f'(warm up: {time.perf_counter() - module_start_time:.3f} sec)' + consts["STDIO_MSG_POSTFIX"] + '\n')
+        sys.stdout.flush()
+
+def preload() -> None:
+    """Load the AI model in the parent, so the children share it (if consts["fork_server"]["preload_ai_model"])."""
+    if fork_consts["preload_ai_model"]:
+        transcribe_stdio.preload_AI_model()
+
+
+class ForkServer:
+    """Read job requests from STDIN and run each one in a forked child (see the module description)."""
+
+    def __init__(self, max_children: int, job_timeout_sec: float):
+        """
+        Create a new server.
+        max_children - The max number of jobs that run at once.
+        job_timeout_sec - A job that runs longer than this is killed."""
+        self.max_children = max(1, max_children)
+        self.job_timeout_sec = job_timeout_sec
+        self.selector = selectors.DefaultSelector()
+        self.waiting = []  # Parsed requests that wait for a free child slot.
+        self.running = {}  # {result_fd: JobRequest}.
+        self.stdin_buffer = b''
+        self.stdin_open = True
+
+    def serve(self) -> None:
+        """Serve until the STDIN is closed and all the jobs are done. Runs on the main thread only."""
+        stdin_fd = sys.stdin.fileno()
+        self.selector.register(stdin_fd, selectors.EVENT_READ, None)
+        while self.stdin_open or self.waiting or self.running:
+            for key, _ in self.selector.select(timeout=1):
+                if key.data is None:
+                    self._read_stdin(stdin_fd)
+                else:
+                    self._read_result(key.data)
+            while self.waiting and len(self.running) < self.max_children:
+                self._fork(self.waiting.pop(0))
+            self._kill_expired()
+        self.selector.close()
+
+    def _read_stdin(self, stdin_fd: int) -> None:
+        """Read the available STDIN bytes and queue the complete request lines."""
+        chunk = os.read(stdin_fd, read_chunk_size)
+        if not chunk:
+            self.stdin_open = False
+            self.selector.unregister(stdin_fd)
+            lines, self.stdin_buffer = [self.stdin_buffer], b''
+        else:
+            lines = (self.stdin_buffer + chunk).split(b'\n')
+            self.stdin_buffer = lines.pop()
+        for line in lines:
+            job_request = parse_request_line(line)
+            if job_request is not None:
+                self.waiting.append(job_request)
+
+    def _fork(self, job_request: JobRequest) -> None:
+        """Fork a child that runs the job and writes its result (json) into a pipe."""
+        read_fd, write_fd = os.pipe()
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            # The child. It must never return into the parent's serve loop, whatever happens:
+            exit_code = 1
+            try:
+                os.close(read_fd)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                result = run_job(job_request)
+                with os.fdopen(write_fd, 'wb') as result_pipe:
+                    result_pipe.write(json.dumps(result, default=str).encode('utf-8'))
+                exit_code = 0
+            except BaseException as exp:
+                error_log(ENVS.ALL, f'{script_name}: id={job_request.id}: The "{job_request.job}" job\'s child failed. ' + \
+                          f'The error:\n{exp!r}')
+            finally:
+                try:
+                    flush_cache_stats()  # os._exit() skips the atexit handlers.
+                    flush_logs()
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                finally:
+                    os._exit(exit_code)
+
+        # The parent:
+        os.close(write_fd)
+        job_request.pid = pid
+        job_request.result_fd = read_fd
+        job_request.start_time = time.monotonic()
+        self.running[read_fd] = job_request
+        self.selector.register(read_fd, selectors.EVENT_READ, job_request)
+
+    def _read_result(self, job_request: JobRequest) -> None:
+        """Read a child's result. Once the child closes its pipe, reap it and send the response."""
+        chunk = os.read(job_request.result_fd, read_chunk_size)
+        if chunk:
+            job_request.output += chunk
+            return
+        self._finish(job_request)
+
+    def _finish(self, job_request: JobRequest, result: dict = None) -> None:
+        """Close the job's pipe, reap its child and send its response (the child's result, unless given)."""
+        self.selector.unregister(job_request.result_fd)
+        os.close(job_request.result_fd)
+        del self.running[job_request.result_fd]
+        os.waitpid(job_request.pid, 0)
+
+        if result is None:
+            try:
+                result = json.loads(job_request.output)
+            except ValueError:
+                error_log(ENVS.ALL, f'{script_name}: id={job_request.id}: The "{job_request.job}" job\'s child ' + \
+                          'exited without a result.')
+                result = {"code": jobs[job_request.job][1]}
+        log(ENVS.DEVELOPMENT, f'{script_name}: id={job_request.id}: The "{job_request.job}" job finished with the code ' + \
+            f'{result.get("code")} in {time.monotonic() - job_request.start_time:.3f} sec.' + consts["STDIO_MSG_POSTFIX"])
+        send_response(job_request.id, result)
+
+    def _kill_expired(self) -> None:
+        """Kill the children of the jobs that run longer than "job_timeout_sec" and fail their jobs."""
+        now = time.monotonic()
+        for job_request in list(self.running.values()):
+            if now - job_request.start_time > self.job_timeout_sec:
+                error_log(ENVS.ALL, f'{script_name}: id={job_request.id}: The "{job_request.job}" job timed out. Killing it.')
+                os.kill(job_request.pid, signal.SIGKILL)
+                self._finish(job_request, {"code": jobs[job_request.job][1]})
+
+
+def serve_in_process(max_workers: int) -> None:
+    """The fallback without os.fork(): run the jobs on a thread pool of this (pre-warmed) process."""
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for line in sys.stdin.buffer:
+            job_request = parse_request_line(line)
+            if job_request is None:
+                continue
+            executor.submit(lambda job_request: send_response(job_request.id, run_job(job_request)), job_request)
+
+def main(argv: list[str]) -> int:
+    """
+    Warm up, send the ready message and serve job requests from the STDIN until it's closed (see the
+    module description). Return consts["convertion_success"]."""
+    preload()
+    send_ready_message()
+    if hasattr(os, 'fork'):
+        ForkServer(fork_consts["max_children"], fork_consts["job_timeout_sec"]).serve()
+    else:
+        serve_in_process(fork_consts["max_children"])
+    return consts["convertion_success"]
+
+
+if __name__ == "__main__":
+    """Usage: python fork_server.py"""
+    code = main(sys.argv)
+    sys.exit(code)
@@ -9,19 +9,30 @@ should also have a PDF file, whose name is specified in the JSON-data-file. The
 generates a list of images of the PDF, saves them in the given directory and adds their names 
 into the JSON-data-file under the key given by Consts.json ('img_key_in_jData'). The script 
 ends with a proper exit code. consts["convertion_success"] for success.
+
+The pages are rasterized in-process by PyMuPDF (fitz) and written as JPEG files, at the resolution and for
+the number of pages in consts["image_generator"]:
+    dpi - The resolution of the images (ignored if "width_px" is set).
+    width_px - The width of the images in pixels, keeping the aspect ratio (0 - by "dpi").
+    max_pages - Render only the first pages (0 - all the pages). The app previews only the first one.
+    jpeg_quality - The JPEG quality (1-100).
+    render_with_pdf - If true, convert_to_pdf.py renders the images from the PDF document it has just titled,
+                      in the same pass. Then this script only finds them (they're newer than the PDF) and
+                      updates the JSON-data-file.
 """
 
 import os, sys, json
+import fitz
 from typing import TextIO
-from PIL import Image
-from pdf2image import convert_from_path
 from utils_py.loggers import ENVS, log, error_log
+from utils_py.tracing import span, trace_tasks
 
 solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
 with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
     consts = json.load(consts_file)
 
 script_name = os.path.basename(__file__)  # Will be usefull for logging.
+image_consts = consts["image_generator"]
 
 
 def is_valid_audio_dir(dir_path: str) -> bool:
@@ -113,13 +124,15 @@ def generate_and_save_notes_image(audio_dir_path: str) -> int:
         pdf_path = os.path.join(audio_dir_path, j_data[consts["pdf_key_in_jData"]])
 
         try:
-            # Generate the images (convert from a PDF):
-            image_file_lst = create_image(pdf_path)
-            log(ENVS.DEVELOPMENT, 
-                f'{script_name}: generated {len(image_file_lst)} images successfully (not saved yet).')
-
-            # Save the images in a directory:
-            image_path_lst = save_images(audio_dir_path, image_file_lst, j_data)
+            # The images are named after the media file:
+            image_path_prefix = os.path.join(audio_dir_path, os.path.splitext(j_data[consts["media_key_in_jData"]])[0])
+
+            # Use the images that were rendered with the PDF, or generate them (convert from a PDF) and save them:
+            image_path_lst = find_page_images(pdf_path, image_path_prefix)
+            if image_path_lst:
+                log(ENVS.DEVELOPMENT, f'{script_name}: found {len(image_path_lst)} images that were rendered with the PDF.')
+            else:
+                image_path_lst = save_images(image_path_prefix, create_image(pdf_path))
             log(ENVS.DEVELOPMENT, 
                 f'{script_name}: saved {len(image_path_lst)} images successfully under {os.path.dirname(image_path_lst[0])}.')
 
@@ -133,41 +146,75 @@ def generate_and_save_notes_image(audio_dir_path: str) -> int:
         return consts["convertion_success"]
 
 
-def create_image(pdf_path: str) -> list[Image.Image]:
-    """Given a PDF file path (pdf_path), generate and return a PIL image files list."""
+def create_image(pdf_path: str) -> list[bytes]:
+    """Given a PDF file path (pdf_path), render its pages and return them as JPEG-encoded images (see render_page_images())."""
     try:
-        images = convert_from_path(pdf_path)
+        with span("page_render"):
+            doc = fitz.open(pdf_path)
+            try:
+                return render_page_images(doc)
+            finally:
+                doc.close()
     except Exception as e:
         raise Exception(f'{script_name}: Error when converting PDF to images: ' + str(e))
+
+
+def render_page_images(doc: fitz.Document) -> list[bytes]:
+    """
+    Rasterize the first pages of an open PDF document (see consts["image_generator"]).
+    Return the JPEG-encoded images, in the pages' order."""
+
+    page_count = min(len(doc), image_consts["max_pages"]) if image_consts["max_pages"] else len(doc)
+    images = []
+    for page in (doc[i] for i in range(page_count)):
+        if image_consts["width_px"]:
+            zoom = image_consts["width_px"] / page.rect.width
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        else:
+            pixmap = page.get_pixmap(dpi=image_consts["dpi"])
+        images.append(pixmap.tobytes(output='jpeg', jpg_quality=image_consts["jpeg_quality"]))
     return images
 
 
-def save_images(audio_dir: str, image_file_lst: list[Image.Image], j_data: dict) -> list[str]:
+def save_images(image_path_prefix: str, images: list[bytes]) -> list[str]:
     """
-    Save the given images in the given destination directory. 
+    Save the given JPEG-encoded images as "<image_path_prefix>_<i>.jpeg" files. 
     Return a list of the paths of the saved image files.
     Raise an error with a proper message if any of the images saving failed.
 
-    audio_dir (str) - The destination directory.
-    image_file_lst - A list of image objects (see pdf2image.convert_from_path).
-    j_data (dict) - A dictionary with relevant data (such as the files' future names).
+    image_path_prefix (str) - The destination directory and the files' base name.
+    images - A list of JPEG-encoded images, in the pages' order (see render_page_images()).
     """
 
-    if len(image_file_lst) == 0:
-        return
-    
     file_path_lst = []  # The image files paths after being saved.
     try:
-        for img_i in range(len(image_file_lst)):
-            file_path = os.path.join(audio_dir, os.path.splitext(j_data[consts["media_key_in_jData"]])[0] + '_' + str(img_i) + consts['img_ext'])
-            image_file_lst[img_i].save(file_path, consts['img_ext'][1:])
-            file_path_lst.append(file_path)
+        with span("image_save"):
+            for img_i, image in enumerate(images):
+                file_path = image_path_prefix + '_' + str(img_i) + consts['img_ext']
+                with open(file_path, 'wb') as image_file:
+                    image_file.write(image)
+                file_path_lst.append(file_path)
     except Exception as e:
         raise Exception(f'{script_name}: Error when saving a file: ' + str(e))
 
     return file_path_lst
 
 
+def find_page_images(pdf_path: str, image_path_prefix: str) -> list[str]:
+    """
+    Return the paths of the images that were rendered with the PDF (see consts["image_generator"]["render_with_pdf"]),
+    or an empty list if there are none, or they're older than the PDF."""
+
+    first_image_path = image_path_prefix + '_0' + consts['img_ext']
+    if not os.path.isfile(first_image_path) or os.path.getmtime(first_image_path) < os.path.getmtime(pdf_path):
+        return []
+    file_path_lst = []
+    while os.path.isfile(image_path_prefix + '_' + str(len(file_path_lst)) + consts['img_ext']) and \
+            (not image_consts["max_pages"] or len(file_path_lst) < image_consts["max_pages"]):
+        file_path_lst.append(image_path_prefix + '_' + str(len(file_path_lst)) + consts['img_ext'])
+    return file_path_lst
+
+
 def update_json_data_file(audio_dir: str, img_path_lst: list[str], json_file: TextIO, j_data: dict):
     """
     Update the given JSON file with the given image files paths.
@@ -217,8 +264,9 @@ def run_generator(argv: list[str]) -> int:
     if not is_valid_audio_dir(audio_dir):
         return consts["invalid_audio_dir"]
 
-    # Generates and saves the images and update the JSON-data-file:
-    gen_result_code = generate_and_save_notes_image(audio_dir)
+    # Generates and saves the images and update the JSON-data-file (traced by the task's id, which is the directory's name):
+    with trace_tasks([os.path.basename(os.path.abspath(audio_dir))], process=script_name):
+        gen_result_code = generate_and_save_notes_image(audio_dir)
     if gen_result_code == consts["convertion_success"]:
         log(ENVS.DEVELOPMENT, f'{script_name}: generated all images successfully.')
 
@@ -10,17 +10,33 @@ is established, it reads a serialized data buffer of an audio file (as a socket
 and uses a Machine Learning algorithm to convert it into notes and sends back the transcription 
 as a response. It can handle a single musical instrument, or multiple instruments. Set by 
 instruments_mode argument.
+Clients may also use a length-prefixed binary framing (see utils_py/socket_framing.py), which 
+carries the raw audio without base64, and many tasks and keep-alive messages on one connection. 
+A framed client also gets partial results while a task runs (see utils_py/progress.py). The legacy 
+protocol (JSON until EOF) can't tell them apart from the response, so it gets keep-alive messages only.
+A task is stopped early (see utils_py/cancellation.py) if it passes its "deadline_ms", if a framed client 
+sends a cancel frame with its id, or if the client is gone (a keep-alive message fails).
 """
 
 
 # General system imports:
-import importlib, os, sys
+import os, sys
 import json
+import queue
 import socket
-from utils_py.serialized_objects import TranscribedMidiData, AudioDataToTranscribe
+from Models.model_registry import ModelRegistry
+from utils_py.result_cache import ResultCache
+from utils_py.serialized_objects import TranscribedMidiData, PartialMidiData, AudioDataToTranscribe
 from utils_py.loggers import ENVS, log, error_log
+from utils_py.progress import track_progress, PartialResultReporter
+from utils_py.cancellation import CancelToken, track_cancellation
+from utils_py.error_objects import TaskCancelled
+from utils_py.socket_framing import FramedConnection, is_framed_connection, \
+    FRAME_TASK, FRAME_RESULT, FRAME_PARTIAL, FRAME_KEEP_ALIVE, FRAME_CANCEL, FRAME_CLOSE
 import threading
-import time
+import signal
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
 with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
@@ -30,38 +46,50 @@ with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
 totalclient = consts['max_files_transfer']  # max backlog of connections
 script_name = os.path.basename(__file__)  # Will be usefull for logging.
 ai_model = consts["ai_model"]  # The AI model that is used to transcribe.
-models_dir = "Models"  # The directory of the models classes.
+# A cache of transcribed midi files (see consts["result_cache"]), shared by all the transcriber processes:
+result_cache = ResultCache(os.path.join(solutionBasePath, consts["result_cache"]["dir"]), 
+                           consts["result_cache"]["max_size_MB"] * 1024 * 1024) if consts["result_cache"]["enabled"] else None
+# The warm AI models of this process. Concurrent tasks of a batching model share its calls (see consts["batching"]):
+model_registry = ModelRegistry(consts["models_arguments"], batching=consts["batching"], result_cache=result_cache)
+server_consts = consts["socket_server"]  # Settings of the long-lived, concurrent server mode ("--serve").
+SERVE_FLAG = "--serve"
 
 
-def import_AI_model(ai_model: str):
-    """Import the AI model and return its wrapper class."""
-
-    module_name = consts["models_arguments"][ai_model]["module"]
-    class_name = consts["models_arguments"][ai_model]["class"]
-    module = importlib.import_module(f"{models_dir}.{module_name}")
-    return getattr(module, class_name)
-
 def transcribe_wav_to_midi(audio_dir_path: str, instruments_mode: int) -> TranscribedMidiData:
     """
     Transcribe the audio files in the given "audio_dir_path" source directory into midi.
     Return a "TranscribedMidiData" object containing the results (the .mid files shall 
-    be saved in the directory). Uses an AI model from the "Models" directory.
+    be saved in the directory). Uses a warm AI model from the "Models" directory, which 
+    is loaded only once per process (see "model_registry").
     Raise an exception upon failure.
 
     audio_dir_path - The path to the directory with the source audio files. It's also 
         the target directory for saving the resulted midi files.
     instruments_mode - Determine how to treat the musical instruments of in the audio file.
     """
-    Model = import_AI_model(ai_model)
-    args = consts["models_arguments"][ai_model]["args"]
     # Run the model from Models/
     try:
-        model = Model(args)
-        model.set_audio_dir(audio_dir_path)
-        return model.run()
+        return model_registry.transcribe(ai_model, audio_dir_path, instruments_mode)
     except Exception as exp:
         raise exp
 
+def preload_AI_model() -> None:
+    """
+    Load the AI model into the model registry, so the first connection won't pay for it, 
+    if consts["preload_ai_model"] is set. A failure is logged and the model will be 
+    loaded again by the first connection."""
+    if not consts["preload_ai_model"]:
+        return
+    try:
+        model_registry.preload([ai_model])
+    except Exception as e:
+        error_log(ENVS.ALL, f'{script_name}: Failed to preload the AI model "{ai_model}". ' + \
+            f'It will be loaded by the first connection.\n\tMore details: {e}')
+
+def init_worker_process() -> None:
+    """Initializer of a transcription worker process (in the "process" workers mode): load its own warm AI model."""
+    preload_AI_model()
+
 def receive_data_from_client(client_socket: socket.SocketType) -> str:
     """
     Read incoming message from the "client_socket" socket connection, decode it and return it.
@@ -127,56 +155,232 @@ def send_response_to_client(client_socket: socket.SocketType, transcribed_data:
     data_message = transcribed_data.get_json_str()  # Get the data as a json string.
     client_socket.sendall(data_message.encode('utf-8'))  # ".encode()" converts the string to a byte string (default encoding is UTF-8).
 
-def handle_client_connection(client_socket: socket.SocketType, instruments_mode: int):
+def transcribe_with_keep_alive(send_keep_alive, transcribe_fn, audio_dir_path: str, instruments_mode: int, 
+                               cancel_token: CancelToken = None) -> TranscribedMidiData:
+    """
+    Run "transcribe_fn(audio_dir_path, instruments_mode)" and return its result, while calling "send_keep_alive()" 
+    every consts["KEEP_ALIVE_INTERVAL_SEC"] seconds on a separate thread, as long as the transcription is running.
+    If a keep-alive message fails (the client is gone), "cancel_token" (optional) is cancelled.
+    Raise the transcription's exception upon failure.
+    """
+
+    # Sending a keep-alive message to the client as long as the process is running. The event 
+    # wakes the thread up as soon as the transcription ends, so a worker isn't held for the interval:
+    keep_alive_done = threading.Event()
+    def keep_alive_loop():
+        while not keep_alive_done.is_set():
+            try:
+                send_keep_alive()
+            except Exception as e:
+                error_log(ENVS.ALL, f'{script_name}: Failed to send Keep-Alive message to the client socket.')
+                if cancel_token is not None:
+                    cancel_token.cancel()  # Nobody will collect the result.
+                break
+            keep_alive_done.wait(consts["KEEP_ALIVE_INTERVAL_SEC"])
+
+    # Start the keep-alive thread
+    keep_alive_thread = threading.Thread(target=keep_alive_loop, daemon=True)
+    keep_alive_thread.start()
+    try:
+        return transcribe_fn(audio_dir_path, instruments_mode)
+    finally:
+        # Stop keep-alive and clean up
+        keep_alive_done.set()
+        keep_alive_thread.join(timeout=consts["KEEP_ALIVE_INTERVAL_SEC"] + 1)
+
+def parse_task_frame(meta: dict, body: memoryview) -> AudioDataToTranscribe:
+    """
+    Parse a task frame (its metadata and raw audio body) into a "AudioDataToTranscribe" object and return it.
+    Raise an exception if the parsed data is invalid (not a legitimate directory)."""
+
+    audio_data_obj = AudioDataToTranscribe(audio_dir_path=meta.get("audio_dir_path", ""), data=body, id=meta.get("id", ""), 
+                                           deadline_ms=meta.get("deadline_ms"))
+    audio_dir_path = audio_data_obj.audio_dir_path
+    if not audio_dir_path or not os.path.isdir(audio_dir_path):
+        raise ValueError(f'id={audio_data_obj.id}: The path sent by the client socket isn\'t a valid directory: "{audio_dir_path}"')
+    return audio_data_obj
+
+def send_result_frame(connection: FramedConnection, transcribed_data: TranscribedMidiData) -> None:
+    """Send "transcribed_data" as a result frame through the framed "connection"."""
+    connection.send_frame({"type": FRAME_RESULT, **transcribed_data.get_dict()})
+
+def send_partial_frame(connection: FramedConnection, partial_data: PartialMidiData) -> None:
+    """Send "partial_data" (a partial result of a running task) as a partial frame through the framed "connection"."""
+    connection.send_frame({"type": FRAME_PARTIAL, **partial_data.get_dict()})
+
+def read_client_frames(connection: FramedConnection, frames: queue.Queue, tokens: dict, tokens_lock: threading.Lock) -> None:
+    """
+    Read the frames of a framed client on a separate thread, so a cancel frame is handled while a task runs. 
+    Every task frame gets a CancelToken in "tokens" ({task id: CancelToken}) and is put in "frames", a cancel 
+    frame cancels the token of its id, and keep-alive frames are ignored. At the end, put None in "frames" (the 
+    client closed the connection or sent a close frame), or the exception that broke the connection (then all 
+    the tokens are cancelled, since nobody will collect their results)."""
+
+    try:
+        while True:
+            frame = connection.recv_frame()
+            if frame is None or frame[0].get("type") == FRAME_CLOSE:
+                break
+            meta, body = frame
+            frame_type = meta.get("type")
+            task_id = meta.get("id", "")
+            if frame_type == FRAME_KEEP_ALIVE:
+                continue
+            if frame_type == FRAME_CANCEL:
+                with tokens_lock:
+                    token = tokens.get(task_id)
+                if token is not None:
+                    token.cancel()
+                log(ENVS.DEVELOPMENT, f'{script_name} | id={task_id}: ' + \
+                    ('Cancelled the task.' if token is not None else 'No unanswered task to cancel.'))
+                continue
+            if frame_type == FRAME_TASK:
+                with tokens_lock:
+                    tokens[task_id] = CancelToken(task_id, meta.get("deadline_ms"))
+            frames.put(frame)
+    except Exception as e:
+        with tokens_lock:
+            for token in tokens.values():
+                token.cancel()
+        frames.put(e)
+        return
+    frames.put(None)
+
+def handle_framed_client_connection(client_socket: socket.SocketType, instruments_mode: int, transcribe_fn) -> None:
+    """
+    Serve a client that uses the length-prefixed framing (see utils_py/socket_framing.py): read task frames 
+    (metadata in the format "AudioDataToTranscribe" and the raw audio as the body), transcribe each one while 
+    sending keep-alive frames and partial frames (in the format "PartialMidiData": progress, ETA and the notes 
+    completed so far, see consts["partial_results"]), and send back a result frame (in the format 
+    "TranscribedMidiData") per task. Partial results aren't sent from "process" workers (another process). 
+    A failed task gets a result frame with an error code, and the connection goes on to the next task. 
+    The frames are read on a separate thread (see read_client_frames()), so a cancel frame stops its task while 
+    it runs, and a task that is cancelled or passes its "deadline_ms" is answered with the code 
+    consts["task_cancelled"] or consts["task_timed_out"]. The cancellation doesn't reach "process" workers, 
+    so there it only skips the tasks that didn't start.
+    Return when the client closes the connection or sends a close frame.
+    Raise an exception upon a broken connection, or at the end, if any of the tasks failed.
+
+    client_socket - A connection object from socket.accept().
+    instruments_mode - Determine how to treat the musical instruments of in the audio file.
+    transcribe_fn - A function with the signature of "transcribe_wav_to_midi" that performs the transcription.
+    """
+
+    connection = FramedConnection(client_socket, consts["max_size_Bytes"])
+    send_keep_alive = lambda: connection.send_frame({"type": FRAME_KEEP_ALIVE})
+    failed_tasks = []  # The IDs of the failed tasks.
+    frames = queue.Queue(maxsize=2)  # The frames to handle (see read_client_frames()). Bounds the audio read ahead.
+    tokens = {}  # {task id: CancelToken} of the tasks that weren't answered yet.
+    tokens_lock = threading.Lock()
+    threading.Thread(target=read_client_frames, args=(connection, frames, tokens, tokens_lock), 
+                     name='frames-reader', daemon=True).start()
+
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break  # The client closed the connection.
+        if isinstance(frame, Exception):
+            raise frame
+        meta, body = frame
+        frame_type = meta.get("type")
+        if frame_type != FRAME_TASK:
+            error_log(ENVS.ALL, f'{script_name}: Ignored an unexpected frame of type "{frame_type}" from the client socket.')
+            continue
+
+        task_id = meta.get("id", "")
+        with tokens_lock:
+            token = tokens.get(task_id) or CancelToken(task_id)
+        try:
+            audio_data_obj = parse_task_frame(meta, body)
+        except Exception as e:
+            error_log(ENVS.ALL, f'{script_name}: Received invalid task frame from client socket. {e}')
+            failed_tasks.append(task_id)
+            send_result_frame(connection, TranscribedMidiData(code=consts["invalid_audio_dir"], id=task_id))
+            with tokens_lock:
+                tokens.pop(task_id, None)
+            continue
+
+        log(ENVS.DEVELOPMENT, f'{script_name} | id={task_id}: Received a task frame from client socket:\n' + \
+            f'\tlen(data) = {audio_data_obj.data_size}, audio_dir_path = {audio_data_obj.audio_dir_path}')
+
+        reporter = PartialResultReporter(task_id, lambda partial_data: send_partial_frame(connection, partial_data))
+        try:
+            token.check()  # It may have been cancelled (or timed-out) while it waited.
+            with track_progress(audio_data_obj.audio_dir_path, reporter), \
+                 track_cancellation(audio_data_obj.audio_dir_path, token):
+                transcribed_data = transcribe_with_keep_alive(send_keep_alive, transcribe_fn, 
+                                                              audio_data_obj.audio_dir_path, instruments_mode, token)
+            transcribed_data.id = task_id
+        except TaskCancelled as e:
+            log(ENVS.DEVELOPMENT, f'{script_name} | id={task_id}: Stopped the task. {e}')
+            transcribed_data = TranscribedMidiData(code=e.code, id=task_id)
+        except Exception as e:
+            error_log(ENVS.ALL, f'{script_name} | id={task_id}: Failed to transcribe the audio file in ' + \
+                f'"{audio_data_obj.audio_dir_path}" into midi. {e}')
+            transcribed_data = TranscribedMidiData(code=consts["midi_generation_failed"], id=task_id)
+        finally:
+            with tokens_lock:
+                tokens.pop(task_id, None)
+
+        if transcribed_data.code == consts["midi_generation_failed"]:
+            failed_tasks.append(task_id)
+        send_result_frame(connection, transcribed_data)
+        log(ENVS.DEVELOPMENT, f'{script_name} | id={task_id}: Transcribed results sent (code = {transcribed_data.code}).')
+
+    if failed_tasks:
+        raise RuntimeError(f'{len(failed_tasks)} task(s) failed on the framed connection: {failed_tasks}')
+
+def handle_client_connection(client_socket: socket.SocketType, instruments_mode: int, transcribe_fn = None):
     """
     Read the socket request message from the client socket "client_socket", which should be a 
     json in the format "AudioDataToTranscribe" ({audio_dir_path: str, data (optional): str}) 
     representing data of an audio file, then transcribe it and generate and save a midi file.
     Then send its data through the socket as a response. The respond format is a json of 
     "TranscribedMidiData".
+    A client whose first bytes are a frame magic is served with the framed protocol instead 
+    (see handle_framed_client_connection).
+    The transcription is stopped if the task passes its "deadline_ms" or the client is gone, and then the 
+    response's code is consts["task_timed_out"] or consts["task_cancelled"].
     Raise an exception upon failure.
 
     client_socket - A connection object from socket.accept().
     instruments_mode - Determine how to treat the musical instruments of in the audio file.
+    transcribe_fn - (Optional) A function with the signature of "transcribe_wav_to_midi" that performs 
+        the transcription (e.g. on a worker process). Default: transcribe_wav_to_midi.
     """
+    transcribe_fn = transcribe_fn or transcribe_wav_to_midi
+
+    # A client that uses the length-prefixed framing may send many tasks on this connection:
+    if is_framed_connection(client_socket):
+        handle_framed_client_connection(client_socket, instruments_mode, transcribe_fn)
+        return
 
     # Read the message from the client socket as an "AudioDataToTranscribe" object:
     try:
         audio_data_obj = receive_and_parse_data_from_client(client_socket)
         audio_dir_path = audio_data_obj.audio_dir_path
-        audio_data_bytes = audio_data_obj.data  # Not really required here.
     except Exception as e:
         error_log(ENVS.ALL, f'{script_name}: Received invalid message from client socket.')
         raise e
 
     # Log that the data was received successfully.
     log(ENVS.DEVELOPMENT, f'{script_name}: Received data from client socket:\n' + \
-        f'\tlen(data) = {len(audio_data_bytes)}, audio_dir_path = {audio_dir_path}')
+        f'\tlen(data) = {audio_data_obj.data_size}, audio_dir_path = {audio_dir_path}')
 
-    # Sending a keep-alive message to the client as long as the process is running:
-    keep_alive_running = True
-    def send_keep_alive():
-        while keep_alive_running:
-            try:
-                client_socket.sendall(consts["KEEP_ALIVE_MSG"].encode('utf-8'))
-            except Exception as e:
-                error_log(ENVS.ALL, f'{script_name}: Failed to send Keep-Alive message to the client socket.')
-                break
-            time.sleep(consts["KEEP_ALIVE_INTERVAL_SEC"])
-
-    # Start the keep-alive thread
-    keep_alive_thread = threading.Thread(target=send_keep_alive, daemon=True)
-    keep_alive_thread.start()
-    # Transcribe the audio data into midi:
+    # Transcribe the audio data into midi, while sending keep-alive messages to the client. It's stopped if 
+    # the task passes its deadline, or if the client is gone (see transcribe_with_keep_alive()):
+    send_keep_alive = lambda: client_socket.sendall(consts["KEEP_ALIVE_MSG"].encode('utf-8'))
+    token = CancelToken(audio_data_obj.id, audio_data_obj.deadline_ms)
     try:
-        transcribed_data = transcribe_wav_to_midi(audio_dir_path, instruments_mode)
+        token.check()
+        with track_cancellation(audio_dir_path, token):
+            transcribed_data = transcribe_with_keep_alive(send_keep_alive, transcribe_fn, audio_dir_path, instruments_mode, token)
+    except TaskCancelled as e:
+        log(ENVS.DEVELOPMENT, f'{script_name}: Stopped the transcription of "{audio_dir_path}". {e}')
+        transcribed_data = TranscribedMidiData(code=e.code, id=audio_data_obj.id)
     except Exception as e:
         error_log(ENVS.ALL, f'{script_name}: Failed to transcribe the audio file in "{audio_dir_path}" into midi.')
         raise e
-    finally:
-        # Stop keep-alive and clean up
-        keep_alive_running = False
-        keep_alive_thread.join(timeout=consts["KEEP_ALIVE_INTERVAL_SEC"] + 1)
 
     # Log that the transcription was successful.
     log(ENVS.DEVELOPMENT, f'{script_name}: Transcribed the audio files into midi.\n' + \
@@ -192,33 +396,196 @@ def handle_client_connection(client_socket: socket.SocketType, instruments_mode:
     # Log that the response is sent successfully:
     log(ENVS.DEVELOPMENT, f'{script_name}: Transcribed results sent.')
 
-def open_socket():
+def send_busy_response(client_socket: socket.SocketType) -> None:
+    """
+    Tell the client right away that the server is at its full capacity (consts["server_busy"] code), and close 
+    the connection. The client's request is drained (for a short while) before closing, so the client reads the 
+    response instead of a connection reset."""
+    try:
+        client_socket.settimeout(server_consts["accept_timeout_sec"])
+        busy_data = TranscribedMidiData(code=consts["server_busy"])
+        try:
+            is_framed = is_framed_connection(client_socket)
+        except socket.timeout:
+            is_framed = False  # The client hasn't sent anything yet. Assume the legacy protocol.
+        if is_framed:
+            send_result_frame(FramedConnection(client_socket, consts["max_size_Bytes"]), busy_data)
+        else:
+            send_response_to_client(client_socket, busy_data)
+        client_socket.shutdown(socket.SHUT_WR)
+        while client_socket.recv(16384):
+            pass
+    except Exception as e:
+        if not isinstance(e, socket.timeout):
+            error_log(ENVS.DEVELOPMENT, f'{script_name}: Failed to send a "busy" response to the client socket: {e}')
+    finally:
+        client_socket.close()
+
+def open_socket(backlog: int = totalclient):
     """
     Create and open a server socket on the host and port provided in "consts". 
     Print an important consts["server_is_ready_msg"] message to the STDOUT, 
-    and return the server socket."""
+    and return the server socket.
+    backlog - The max backlog of connections. Default: consts["max_files_transfer"]."""
     server_soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_soc.bind((consts["py_converter_host"], consts["py_converter_port"]))
-    server_soc.listen(totalclient)  # max backlog of connections
+    server_soc.listen(backlog)  # max backlog of connections
 
     # IMPORTANT! Print server_is_ready_msg message to the STDOUT, signaling to the other side of the socket that the process is running:
     print(f'{consts["server_is_ready_msg"]} on host {consts["py_converter_host"]} and port {consts["py_converter_port"]}', flush=True)
 
     return server_soc
 
+class ConcurrentTranscriptionServer:
+    """
+    A long-lived socket server (the "--serve" mode) that accepts connections continuously and handles them 
+    on a bounded pool of workers, until it is stopped (SIGINT/SIGTERM or stop()).
+    Worker types (consts["socket_server"]["worker_type"]):
+        "thread" - The connections are handled by threads that share the warm model of this process.
+        "process" - The connections' I/O is handled by threads, and the transcriptions run on worker 
+            processes, each holding its own warm model.
+    Admission control: at most "workers" connections are handled and "max_queue_depth" more wait for a 
+    worker. Any connection beyond that gets an immediate consts["server_busy"] response, instead of 
+    piling up in the listen backlog.
+    Stopping the server stops accepting new connections, and waits for the admitted ones to finish.
+    """
+
+    def __init__(self, instruments_mode: int, workers: int = server_consts["workers"], 
+                 worker_type: str = server_consts["worker_type"], max_queue_depth: int = server_consts["max_queue_depth"]):
+        """
+        Create a new (not running yet) server.
+        instruments_mode - Determine how to treat the musical instruments of in the audio files.
+        workers - The number of concurrent workers (threads or processes).
+        worker_type - "thread" or "process" (see the class description).
+        max_queue_depth - The max number of admitted connections that wait for a free worker."""
+        if worker_type not in ("thread", "process"):
+            raise ValueError(f'Invalid worker_type "{worker_type}". Expected "thread" or "process".')
+        self.instruments_mode = instruments_mode
+        self.workers = max(1, workers)
+        self.worker_type = worker_type
+        self.max_queue_depth = max(0, max_queue_depth)
+        self._admission = threading.BoundedSemaphore(self.workers + self.max_queue_depth)
+        self._stop_event = threading.Event()
+        self._results_lock = threading.Lock()
+        self.succeeded_count = 0  # Number of connections that were handled successfully.
+        self.failed_count = 0  # Number of connections that failed.
+        self.rejected_count = 0  # Number of connections that got a "busy" response.
+
+    def stop(self, *_) -> None:
+        """Stop accepting new connections. Usable as a signal handler."""
+        self._stop_event.set()
+
+    def serve_forever(self) -> int:
+        """
+        Open the server socket, print the ready message and handle connections until stop() is called. Then 
+        wait for the admitted connections to finish.
+        Return a code that signals a success/failure of the handled connections."""
+
+        connections_pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="connection")
+        transcription_pool = None
+        transcribe_fn = transcribe_wav_to_midi
+        if self.worker_type == "process":
+            # "spawn" workers don't inherit the client sockets (and the threads) of this process:
+            transcription_pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker_process, 
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            transcribe_fn = lambda audio_dir_path, instruments_mode: \
+                transcription_pool.submit(transcribe_wav_to_midi, audio_dir_path, instruments_mode).result()
+            # Start all the workers (and load their models) before reporting that the server is ready:
+            for future in [transcription_pool.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+        else:
+            preload_AI_model()  # The threads share this process' warm model.
+
+        server_soc = open_socket(server_consts["listen_backlog"])
+        server_soc.settimeout(server_consts["accept_timeout_sec"])  # Lets the loop notice a stop() call.
+        log(ENVS.DEVELOPMENT, f'{script_name}: Serving with {self.workers} {self.worker_type} workers ' + \
+            f'and a queue depth of {self.max_queue_depth}.')
+
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    client_sock, address = server_soc.accept()
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    if self._stop_event.is_set():
+                        break
+                    error_log(ENVS.ALL, f'{script_name}: Failed to accept a connection: {e}')
+                    continue
+
+                client_sock.settimeout(None)  # Don't inherit the accept timeout.
+                if not self._admission.acquire(blocking=False):
+                    # Full capacity: answer right away instead of letting the client wait.
+                    self.rejected_count += 1
+                    log(ENVS.DEVELOPMENT, f'{script_name}: Server is busy. Rejected the connection from {address}.')
+                    threading.Thread(target=send_busy_response, args=(client_sock,), daemon=True).start()
+                    continue
+                connections_pool.submit(self._handle_connection, client_sock, address, transcribe_fn)
+        finally:
+            server_soc.close()
+            log(ENVS.DEVELOPMENT, f'{script_name}: Stopped accepting connections. Waiting for the in-flight transcriptions.')
+            connections_pool.shutdown(wait=True)
+            if transcription_pool:
+                transcription_pool.shutdown(wait=True)
+
+        status_code = consts["convertion_success"] if (self.succeeded_count > 0 and self.failed_count == 0) else \
+            consts["convertion_partial_success"] if self.succeeded_count > 0 else consts["midi_generation_failed"]
+        log(ENVS.DEVELOPMENT, f'{script_name}: Server stopped after {self.succeeded_count + self.failed_count} connections ' + \
+            f'({self.rejected_count} rejected as busy). Returning code {status_code}.')
+        return status_code
+
+    def _handle_connection(self, client_sock: socket.SocketType, address, transcribe_fn) -> None:
+        """Handle a single admitted connection on a worker thread, then close it and free its admission slot."""
+        try:
+            handle_client_connection(client_sock, self.instruments_mode, transcribe_fn)
+            succeeded = True
+        except Exception as e:
+            # An error in 1 connection shouldn't stop the server.
+            succeeded = False
+            error_log(ENVS.ALL, f'{script_name}: Transcription process for the connection from {address} failed.' + \
+                f'\n\tFailure reason: {e}')
+        finally:
+            client_sock.close()
+            self._admission.release()
+        with self._results_lock:
+            if succeeded:
+                self.succeeded_count += 1
+            else:
+                self.failed_count += 1
+
+def parse_arguments(argv: list[str]) -> tuple[int, bool]:
+    """
+    Parse the script's arguments: [<name>, (optional) instruments_mode, (optional) "--serve"].
+    Return the instruments mode and whether to run the long-lived server mode."""
+    serve = SERVE_FLAG in argv
+    args = [arg for arg in argv[1:] if arg != SERVE_FLAG]
+    if len(args) == 1 and args[0].isdigit():
+        instruments_mode = int(args[0])
+    else:
+        instruments_mode = consts["instruments_options"]["many"]["value"]
+    return instruments_mode, serve
+
 def main(argv):
     """
     Open a socket connection and print a ready message to the STDOUT once the connection is ready 
     and listening. for each connection, receive a json with a source audio file in the format of 
     "AudioDataToTranscribe" and use an AI model to transcribe it and generate and save a midi file. 
     Send back a json response in the format of "TranscribedMidiData". At the end, return a code 
-    that signals a success/failure."""
+    that signals a success/failure.
+    By default the script handles consts["max_files_transfer"] connections one by one and exits. 
+    With "--serve" it runs a long-lived, concurrent server instead (see ConcurrentTranscriptionServer)."""
 
     # Get the instruments mode:
-    if len(argv) == 2 and argv[1].isdigit:
-        instruments_mode = int(argv[1])
-    else:
-        instruments_mode = consts["instruments_options"]["many"]["value"]
+    instruments_mode, serve = parse_arguments(argv)
+
+    if serve:
+        server = ConcurrentTranscriptionServer(instruments_mode)
+        signal.signal(signal.SIGINT, server.stop)
+        signal.signal(signal.SIGTERM, server.stop)
+        return server.serve_forever()
+
+    # Warm up the AI model before the socket starts listening (and reports that it's ready):
+    preload_AI_model()
 
     # Open a "server" socket that listens to calls from the "clients" (the controller.js).
     # Note: In application terms, both socket parts (the python and nodejs) are parts of the App's server side.
@@ -255,12 +622,13 @@ def main(argv):
     return status_code
 
 if __name__ == "__main__":
-    """Usage: python transcribe.py [optional: 1|2]
+    """Usage: python transcribe_sockets.py [optional: 1|2] [optional: --serve]
     Then, on another terminal, open a client connection to the printed port and host.
     Send a json in the "AudioDataToTranscribe" format: 
     {audio_dir_path: str, data (optional): str (binary buffer)}
     and receive its transcription response in the "TranscribedMidiData" format: 
     {code: int, fnames: list[str], data (optional): str (binary buffer)}.
+    Or, send task frames (see utils_py/socket_framing.py) and receive partial and result frames, on one connection.
     """
     code = main(sys.argv)
     sys.exit(code)
\ No newline at end of file
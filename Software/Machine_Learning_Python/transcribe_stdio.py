@@ -25,11 +25,24 @@ instruments_mode argument.
 # Or check a more advanced API for a better control: https://github.com/facebookresearch/demucs/blob/main/docs/api.md
 
 # General system imports:
-import importlib, os, sys
+import os, sys
+import time
+module_start_time = time.perf_counter()  # The start of the cold start (see measure_cold_start()).
 import json
-from utils_py.serialized_objects import TranscribedMidiData, AudioDataToTranscribe
-from utils_py.loggers import ENVS, log, error_log
-from utils_py.error_objects import BaseException
+import queue
+import signal
+import threading
+from contextlib import ExitStack
+from concurrent.futures import Future
+from Models.model_registry import ModelRegistry
+from utils_py.serialized_objects import TranscribedMidiData, PartialMidiData, AudioDataToTranscribe
+from utils_py.loggers import ENVS, log, error_log, stdout_lock
+from utils_py.micro_batcher import MicroBatcher
+from utils_py.result_cache import ResultCache
+from utils_py.tracing import trace_tasks
+from utils_py.progress import track_progress, PartialResultReporter
+from utils_py.cancellation import CancelToken, track_cancellation
+from utils_py.error_objects import BaseException, TaskCancelled
 
 solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
 with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
@@ -39,41 +52,164 @@ with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
 totalclient = consts['max_files_transfer']  # max backlog of connections
 script_name = os.path.basename(__file__)  # Will be usefull for logging.
 ai_model = consts["ai_model"]  # The AI model that is used to transcribe.
-models_dir = "Models"  # The directory of the models classes.
 
+# A cache of transcribed midi files (see consts["result_cache"]), shared by all the transcriber processes:
+result_cache = ResultCache(os.path.join(solutionBasePath, consts["result_cache"]["dir"]), 
+                           consts["result_cache"]["max_size_MB"] * 1024 * 1024, 
+                           log_postfix=consts["STDIO_MSG_POSTFIX"]) if consts["result_cache"]["enabled"] else None
+# The warm AI models of this process. The logs share the STDOUT with the responses, so they end with the message postfix:
+model_registry = ModelRegistry(consts["models_arguments"], log_postfix=consts["STDIO_MSG_POSTFIX"], 
+                               result_cache=result_cache)
+scheduler_consts = consts["stdio_scheduler"]  # Batch size, latency budget and queue depth of the task scheduler.
+DAEMON_FLAG = "--daemon"  # A long-lived process that serves many upload batches (see main()).
+CONTROL_KEY = "control"  # A STDIN message with this key is a control message (see handle_control_message()).
+cancel_tokens = {}  # {task id: CancelToken} of the scheduled tasks, for "cancel" control messages.
+cancel_tokens_lock = threading.Lock()
+# Set (by a "drain" control message or SIGTERM in daemon mode) to stop reading new tasks and drain:
+drain_requested = threading.Event()
+DRAIN_POLL_SEC = 0.2  # How often the main loop checks "drain_requested" while no message arrives.
 
-def import_AI_model(ai_model: str):
-    """Import the AI model and return its wrapper class."""
-
-    module_name = consts["models_arguments"][ai_model]["module"]
-    class_name = consts["models_arguments"][ai_model]["class"]
-    module = importlib.import_module(f"{models_dir}.{module_name}")
-    return getattr(module, class_name)
 
 def transcribe_wav_to_midi(audio_dir_path: str, instruments_mode: int) -> TranscribedMidiData:
     """
     Transcribe the audio files in the given "audio_dir_path" source directory into midi.
     Return a "TranscribedMidiData" object containing the results (the .mid files shall 
-    be saved in the directory). Uses an AI model from the "Models" directory.
+    be saved in the directory). Uses a warm AI model from the "Models" directory, which 
+    is loaded only once per process (see "model_registry").
     Raise an exception upon failure.
 
     audio_dir_path - The path to the directory with the source audio files. It's also 
         the target directory for saving the resulted midi files.
     instruments_mode - Determine how to treat the musical instruments of in the audio file.
     """
-    Model = import_AI_model(ai_model)
-    args = consts["models_arguments"][ai_model]["args"]
     # Run the model from Models/
     try:
-        model = Model(args)
-        model.set_audio_dir(audio_dir_path)
-        transcribed_data = model.run()
+        transcribed_data = model_registry.transcribe(ai_model, audio_dir_path, instruments_mode)
         if transcribed_data.code == consts["midi_generation_failed"]:
             raise BaseException(consts["status_codes"]["bad_input"], 'AI model failed to generate midi.')
         return transcribed_data
     except Exception as exp:
         raise exp
 
+def transcribe_batch(batch_key: tuple, audio_data_objs: list[AudioDataToTranscribe]) -> list:
+    """
+    Transcribe a batch of compatible tasks (same AI model and instruments mode) with a single call of 
+    the warm AI model. Return a result per task, in the same order: its "TranscribedMidiData" (with the 
+    task's id and stage timings), or the exception that failed it. Every task is traced (see 
+    utils_py/tracing.py), and the stages shared by the batch are counted in all its tasks. While the batch 
+    runs, the progress of every task is sent as partial results (see utils_py/progress.py).
+    A task that was cancelled or passed its deadline while it waited isn't transcribed, and one that is 
+    cancelled while the batch runs is stopped by the model (see utils_py/cancellation.py). Its result is 
+    the TaskCancelled exception.
+    Raise an exception upon a failure of the whole batch.
+
+    batch_key - The (AI model, instruments mode) pair of the batch.
+    audio_data_objs - The tasks (validated "AudioDataToTranscribe" objects).
+    """
+    batch_ai_model, instruments_mode = batch_key
+    with cancel_tokens_lock:
+        tokens = [cancel_tokens.get(obj.id) or CancelToken(obj.id, obj.deadline_ms) for obj in audio_data_objs]
+    results = [token.get_error() for token in tokens]  # The tasks that were stopped while they waited.
+    running = [i for i, result in enumerate(results) if result is None]
+    with trace_tasks([audio_data_objs[i].id for i in running], process=script_name, 
+                     meta={"ai_model": batch_ai_model, "batch_size": len(running)}) as traces, ExitStack() as stack:
+        for i in running:
+            obj = audio_data_objs[i]
+            stack.enter_context(track_progress(obj.audio_dir_path, PartialResultReporter(obj.id, send_response)))
+            stack.enter_context(track_cancellation(obj.audio_dir_path, tokens[i]))
+        if running:
+            running_results = model_registry.transcribe_batch(batch_ai_model, 
+                                                              [audio_data_objs[i].audio_dir_path for i in running], 
+                                                              instruments_mode)
+            for i, transcribed_data in zip(running, running_results):
+                results[i] = transcribed_data
+    for i, (audio_data_obj, transcribed_data) in enumerate(zip(audio_data_objs, results)):
+        if isinstance(transcribed_data, Exception):
+            continue
+        if transcribed_data.code == consts["midi_generation_failed"]:
+            results[i] = BaseException(consts["status_codes"]["bad_input"], 'AI model failed to generate midi.')
+        else:
+            transcribed_data.id = audio_data_obj.id
+            if audio_data_obj.id in traces:
+                transcribed_data.timings = traces[audio_data_obj.id].stages
+    return results
+
+def preload_AI_model() -> None:
+    """
+    Load the AI model into the model registry, so the first task won't pay for it, 
+    if consts["preload_ai_model"] is set. A failure is logged and the model will be 
+    loaded again by the first task."""
+    if not consts["preload_ai_model"]:
+        return
+    try:
+        model_registry.preload([ai_model])
+    except Exception as e:
+        error_log(ENVS.ALL, f'{script_name}: Failed to preload the AI model "{ai_model}". ' + \
+            f'It will be loaded by the first task.\n\tMore details: {e}')
+
+def measure_cold_start() -> dict:
+    """
+    Return the cold start timings (seconds) of the process, measured from the start of this module (the 
+    interpreter's own startup isn't included): "model_load_sec" (importing the AI model's libraries and 
+    loading it, see ModelRegistry.load_times_sec), "imports_sec" (the rest) and "total_sec"."""
+    total_sec = time.perf_counter() - module_start_time
+    model_load_sec = model_registry.load_times_sec.get(ai_model, 0.0)
+    return {"imports_sec": round(total_sec - model_load_sec, 3), "model_load_sec": round(model_load_sec, 3), 
+            "total_sec": round(total_sec, 3)}
+
+def send_ready_message(cold_start: dict) -> None:
+    """
+    Print consts["server_is_ready_msg"] to the STDOUT, signaling that the process is ready for tasks, 
+    with the cold start time."""
+    with stdout_lock:
+        sys.stdout.write(f'{consts["server_is_ready_msg"]} on STDIN with the AI model "{ai_model}" ' + \
+                         f'(cold start: {cold_start["total_sec"]} sec)' + consts["STDIO_MSG_POSTFIX"] + '\n')
+        sys.stdout.flush()
+
+def send_control_message(control: dict) -> None:
+    """Send a control message (e.g. "pong") through STDOUT, as a json with the control-message prefix."""
+    with stdout_lock:
+        sys.stdout.write(consts["STDIO_CTRL_MSG_PREFIX"] + json.dumps(control) + consts["STDIO_MSG_POSTFIX"] + '\n')
+        sys.stdout.flush()
+
+def parse_control_message(message: str) -> dict | None:
+    """
+    Return the parsed json of a control message ({"control": "ping" | "drain" | "cancel", "id" (optional): str}), 
+    or None if the message is a task. The server app writes the "control" key first, so a task 
+    message (which may carry a large audio payload) isn't parsed twice."""
+    if not message.startswith('{"' + CONTROL_KEY + '"'):
+        return None
+    try:
+        control = json.loads(message)
+    except json.JSONDecodeError:
+        return None
+    return control if isinstance(control, dict) and CONTROL_KEY in control else None
+
+def handle_control_message(control: dict, status: dict) -> None:
+    """
+    Handle a control message:
+        "ping" - Answer with a "pong" control message with the same "id" and the process' status.
+        "drain" - Set drain_requested: stop reading tasks, finish the scheduled ones and exit.
+        "cancel" - Cancel the scheduled task of the same "id": it's stopped (between the model's segments 
+            or batches, if it's already running) and answered with the code consts["task_cancelled"].
+    An unknown control message is logged and ignored.
+
+    control - The parsed control message (see parse_control_message()).
+    status - The process' status to report in a "pong" (see main())."""
+    if control[CONTROL_KEY] == "ping":
+        send_control_message(dict(status, control="pong", id=control.get("id", "")))
+    elif control[CONTROL_KEY] == "drain":
+        drain_requested.set()
+    elif control[CONTROL_KEY] == "cancel":
+        with cancel_tokens_lock:
+            token = cancel_tokens.get(control.get("id", ""))
+        if token is not None:
+            token.cancel()
+        log(ENVS.DEVELOPMENT, f'{script_name} | id={control.get("id", "")}: ' + \
+            ('Cancelled the task.' if token is not None else 'No scheduled task to cancel.') + consts["STDIO_MSG_POSTFIX"])
+    else:
+        error_log(ENVS.ALL, f'{script_name}: Unknown control message: {control}')
+
 def parse_task_message(message: str) -> AudioDataToTranscribe:
     """
     Parse the message into a "AudioDataToTranscribe" object and return it.
@@ -96,46 +232,85 @@ def parse_task_message(message: str) -> AudioDataToTranscribe:
 
     return audio_data_obj
 
-def send_response(transcribed_data: TranscribedMidiData) -> None:
-    """Send a response message through STDOUT. The message is a json string of "transcribed_data"."""
+def send_response(transcribed_data: TranscribedMidiData | PartialMidiData) -> None:
+    """
+    Send a response message through STDOUT. The message is a json string of "transcribed_data", or of a 
+    partial result (which has the "partial" field) that precedes it.
+    Thread-safe: the responses (and the logs) of different tasks never interleave."""
     data_message = transcribed_data.get_json_str()  # Get the data as a json string.
-    sys.stdout.write(consts["STDIO_DATA_MSG_PREFIX"] + data_message + consts["STDIO_MSG_POSTFIX"] + '\n')
-    sys.stdout.flush()
+    with stdout_lock:
+        sys.stdout.write(consts["STDIO_DATA_MSG_PREFIX"] + data_message + consts["STDIO_MSG_POSTFIX"] + '\n')
+        sys.stdout.flush()
 
-def handle_task(task_msg: str, instruments_mode: int) -> bool:
+def handle_task(task_msg: str) -> AudioDataToTranscribe:
     """
     Parse the given task-message (task_msg), which should be a 
     json in the format "AudioDataToTranscribe" ({audio_dir_path: str, data (optional): str}) 
-    representing data of an audio file, then transcribe it and generate and save a midi file.
-    Then send its data through STDIO as a response. The respond format is a json of 
-    "TranscribedMidiData".
-    Return True upon success.
-    Raise an exception upon failure.
+    representing data of an audio file, and register it for cancellation (from now until it's 
+    finished, a "cancel" control message stops it). Schedule it with schedule_task() afterwards.
+    Return the parsed task.
+    Raise an exception upon a failure in parsing.
 
     task_msg - The string representing the audio data to be transcribed.
-    instruments_mode - Determine how to treat the musical instruments of in the audio file.
     """
 
     # Parse the task-message as an "AudioDataToTranscribe" object:
     try:
         audio_data_obj = parse_task_message(task_msg)
         audio_dir_path = audio_data_obj.audio_dir_path
-        audio_data_bytes = audio_data_obj.data  # Not really required here.
     except Exception as e:
         raise BaseException(consts["status_codes"]["bad_input"], 
                             f'Received invalid message task from stdin.\n\tMore details: {e}')
 
     # Log that the data was received successfully.
     log(ENVS.DEVELOPMENT, f'{script_name} | id={audio_data_obj.id}: Received data from the server app:\n' + \
-        f'\tlen(data) = {len(audio_data_bytes)}, audio_dir_path = {audio_dir_path}' + consts["STDIO_MSG_POSTFIX"])
+        f'\tlen(data) = {audio_data_obj.data_size}, audio_dir_path = {audio_dir_path}' + consts["STDIO_MSG_POSTFIX"])
+
+    # The task can be cancelled until it's finished, including while it waits for a queue slot:
+    with cancel_tokens_lock:
+        cancel_tokens[audio_data_obj.id] = CancelToken(audio_data_obj.id, audio_data_obj.deadline_ms)
+    return audio_data_obj
 
-    # Transcribe the audio data into midi:
+def schedule_task(audio_data_obj: AudioDataToTranscribe, instruments_mode: int, scheduler: MicroBatcher) -> Future:
+    """
+    Schedule the transcription of a parsed task (see handle_task()) into midi. The scheduler groups it 
+    with other compatible tasks (same AI model and instruments mode) into a batch.
+    Return a Future of its "TranscribedMidiData" result (see finish_task()).
+
+    audio_data_obj - The parsed task.
+    instruments_mode - The default of how to treat the musical instruments of in the audio file 
+        (unless the task sets its own "instruments_mode").
+    scheduler - The tasks' batcher (see main()).
+    """
+    task_ai_model = audio_data_obj.ai_model or ai_model
+    task_instruments_mode = instruments_mode if audio_data_obj.instruments_mode is None else audio_data_obj.instruments_mode
+    return scheduler.submit(audio_data_obj, key=(task_ai_model, task_instruments_mode))
+
+def finish_task(audio_data_obj: AudioDataToTranscribe, future: Future) -> bool:
+    """
+    Complete a scheduled task (see schedule_task()): send its "TranscribedMidiData" result through STDIO 
+    as a response. Called once its batch is transcribed, so the responses are sent in completion order.
+    A failed transcription is also answered, with the code consts["midi_generation_failed"], or with 
+    consts["task_cancelled"] / consts["task_timed_out"] if it was stopped (see utils_py/cancellation.py).
+    Return True upon success.
+    Raise an exception upon failure.
+
+    audio_data_obj - The task (see handle_task()).
+    future - The Future of its result.
+    """
+    audio_data_obj.release()
+    with cancel_tokens_lock:
+        cancel_tokens.pop(audio_data_obj.id, None)
+
+    # Get the transcription result:
     try:
-        transcribed_data = transcribe_wav_to_midi(audio_dir_path, instruments_mode)
-        transcribed_data.id = audio_data_obj.id
+        transcribed_data = future.result()
     except Exception as e:
+        # Tell the server app (and a supervisor, if any) that the task is over, instead of letting it time-out:
+        code = e.code if isinstance(e, TaskCancelled) else consts["midi_generation_failed"]
+        send_response(TranscribedMidiData(code=code, id=audio_data_obj.id))
         raise BaseException(consts["status_codes"]["unsupported_media_type_code"], 
-                            f'id={audio_data_obj.id}: Failed to transcribe the audio file in "{audio_dir_path}" into midi.\n\tMore details: {e}')
+                            f'id={audio_data_obj.id}: Failed to transcribe the audio file in "{audio_data_obj.audio_dir_path}" into midi.\n\tMore details: {e}')
 
     # Log that the transcription was successful.
     log(ENVS.DEVELOPMENT, f'{script_name} | id={audio_data_obj.id}: Audio to MIDI transcription succeeded!\n' + \
@@ -160,47 +335,154 @@ def main(argv: list[str]) -> int:
     "AudioDataToTranscribe" and use an AI model to transcribe it and generate and save a midi file. 
     Send back a json response in the format of "TranscribedMidiData". At the end, return a code 
     that signals a success/failure.
-    Optionally: Get the type and number of instruments from sys.argv."""
+    The AI model is loaded once (optionally before the ready message) and reused by all the tasks.
+    The STDIN is read by a reader thread, and the messages are parsed on the main thread. A scheduler 
+    (see consts["stdio_scheduler"]) batches compatible tasks together and sends each response, tagged by 
+    the task's id, as soon as its batch is done. While it runs, partial results ("PartialMidiData": 
+    progress, ETA and the notes completed so far) of the task are sent too, tagged by its id (see 
+    consts["partial_results"]). Up to "max_queue_depth" tasks are scheduled at once; the rest wait (as 
+    parsed tasks) on an admission thread until a task is finished. The STDIN is read on regardless, so 
+    control messages ("ping", "drain", "cancel") are answered at once even when the queue is full (see 
+    handle_control_message()). 
+    A task may also carry a deadline ("deadline_ms"), after which it's stopped (see utils_py/cancellation.py).
+    In daemon mode (DAEMON_FLAG) the process serves many upload batches over time: SIGTERM drains it 
+    like a "drain" message, and its exit code is a success once it drained (not a summary of its tasks).
+    Optionally: Get the type and number of instruments, and the daemon flag from sys.argv."""
 
-    # Get the instruments mode:
-    if len(argv) == 2 and argv[1].isdigit:
-        instruments_mode = int(argv[1])
+    # Get the instruments mode and the daemon flag:
+    args = argv[1:]
+    daemon = DAEMON_FLAG in args
+    args = [arg for arg in args if arg != DAEMON_FLAG]
+    if len(args) == 1 and args[0].isdigit():
+        instruments_mode = int(args[0])
     else:
         instruments_mode = consts["instruments_options"]["many"]["value"]
     
-    task_results = []  # Keep tracking over each task's result.
-    # Read incoming task messages from the server app, each one in a separate line:
-    for line in sys.stdin:  # Runs until EOF is read which means the other side closed the stdin stream.
+    # Warm up the AI model before reporting that the process is ready:
+    preload_AI_model()
+    cold_start = measure_cold_start()
+    log(ENVS.ALL, f'{script_name}: Cold start took {cold_start["total_sec"]} sec (imports: {cold_start["imports_sec"]} sec, ' + \
+        f'model load: {cold_start["model_load_sec"]} sec).' + consts["STDIO_MSG_POSTFIX"])
+    send_ready_message(cold_start)
+
+    if daemon:
+        # Only set the flag: the main loop checks it between messages, so no bookkeeping is interrupted.
+        signal.signal(signal.SIGTERM, lambda signum, frame: drain_requested.set())
+
+    status = {"daemon": daemon, "cold_start": cold_start, "succeeded": 0, "failed": 0, "in_flight": 0, "waiting": 0}
+    status_lock = threading.Lock()  # Guards "status".
+    queue_slots = threading.BoundedSemaphore(scheduler_consts["max_queue_depth"])  # The scheduled tasks.
+    stdin_lines = queue.Queue()  # The lines read from the STDIN, and None at its EOF.
+    admission = queue.Queue()  # The parsed tasks that wait for a queue slot, and None to stop admitting.
+    scheduler = MicroBatcher(transcribe_batch, max_batch_size=scheduler_consts["max_batch_tasks"], 
+                             max_wait_sec=scheduler_consts["max_wait_ms"] / 1000)
+
+    def record_result(task_res: bool, failure_reason: Exception = None) -> None:
+        """Count a task's result and log it if it failed."""
+        with status_lock:
+            status["succeeded" if task_res else "failed"] += 1
+            n = status["succeeded"] + status["failed"]
+        if not task_res:
+            # A failure in 1 task shouldn't stop us from continue handling the next tasks.
+            error_log(ENVS.ALL, f'{script_name}: Transcription process for task number {n} failed. ' + \
+                f'Continue to the next task.\n\tFailure reason: {failure_reason}')
+
+    def on_task_done(audio_data_obj: AudioDataToTranscribe, future: Future) -> None:
+        """Send the response of a finished task and free its queue slot."""
+        try:
+            record_result(finish_task(audio_data_obj, future))
+        except Exception as e:
+            record_result(False, e)
+        finally:
+            with status_lock:
+                status["in_flight"] -= 1
+            queue_slots.release()
+
+    def read_stdin() -> None:
+        """Read the STDIN lines into "stdin_lines" until EOF, which means the other side closed the stdin stream."""
+        for line in sys.stdin:
+            stdin_lines.put(line)
+        stdin_lines.put(None)
+
+    def admit_tasks() -> None:
+        """Schedule the parsed tasks, in their order, each once a queue slot is free."""
+        while (audio_data_obj := admission.get()) is not None:
+            queue_slots.acquire()  # Wait for a free slot.
+            try:
+                future = schedule_task(audio_data_obj, instruments_mode, scheduler)
+            except Exception as e:
+                future = Future()  # Answer it as a failed task.
+                future.set_exception(e)
+            with status_lock:
+                status["waiting"] -= 1
+                status["in_flight"] += 1
+            future.add_done_callback(lambda done_future, obj=audio_data_obj: on_task_done(obj, done_future))
+
+    threading.Thread(target=read_stdin, name="stdin-reader", daemon=True).start()
+    admitter = threading.Thread(target=admit_tasks, name="task-admitter")
+    admitter.start()
+
+    # Handle incoming messages from the server app, each one in a separate line:
+    drained = False
+    while True:
+        if drain_requested.is_set():
+            drained = True
+            with status_lock:
+                pending = status["in_flight"] + status["waiting"]
+            log(ENVS.ALL, f'{script_name}: Draining {pending} scheduled tasks before exiting.' + consts["STDIO_MSG_POSTFIX"])
+            break
+        try:
+            line = stdin_lines.get(timeout=DRAIN_POLL_SEC)
+        except queue.Empty:
+            continue
+        if line is None:
+            break
         task = line.strip()
 
         if not task:
             continue
 
+        control = parse_control_message(task)
+        if control is not None:
+            with status_lock:
+                status_snapshot = dict(status, uptime_sec=round(time.perf_counter() - module_start_time, 3))
+            handle_control_message(control, status_snapshot)
+            continue
+
         try:
-            task_res = handle_task(task, instruments_mode)
-            task_results.append(task_res)
+            audio_data_obj = handle_task(task)
         except Exception as e:
-            # A failure in 1 task shouldn't stop us from continue handling the next tasks.
-            task_results.append(False)
-            n = len(task_results)
-            error_log(ENVS.ALL, f'{script_name}: Transcription process for task number {n} failed. ' + \
-                f'Continue to the next task.\n\tFailure reason: {e}')
+            record_result(False, e)
             continue
+        with status_lock:
+            status["waiting"] += 1
+        admission.put(audio_data_obj)
+
+    # Finish the waiting and the scheduled tasks:
+    admission.put(None)
+    admitter.join()
+    scheduler.close()
+    if drained:
+        send_control_message({CONTROL_KEY: "drained", "succeeded": status["succeeded"], "failed": status["failed"]})
+    if daemon:
+        return consts["convertion_success"]
 
     # Return success if ALL the tasks succeeded (at last partialy), return partial-success if 
     # only some succeeded, and return failure if non succeeded:
-    status_code = consts["convertion_success"] if (len(task_results) > 0 and all(task_results)) else \
-        consts["convertion_partial_success"] if any(task_results) else consts["midi_generation_failed"]
+    status_code = consts["convertion_success"] if (status["succeeded"] > 0 and status["failed"] == 0) else \
+        consts["convertion_partial_success"] if status["succeeded"] > 0 else consts["midi_generation_failed"]
     #log(ENVS.DEVELOPMENT, f'{script_name}: Finished all transcribings tasks. Returning code {status_code}.' + consts["STDIO_MSG_POSTFIX"])
     return status_code
 
 if __name__ == "__main__":
-    """Usage: python transcribe.py [optional: 1|2]
+    """Usage: python transcribe.py [optional: 1|2] [optional: --daemon]
     Then, on another terminal, open a client connection to the printed port and host.
     Send a json in the "AudioDataToTranscribe" format: 
     {audio_dir_path: str, data (optional): str (binary buffer)}
     and receive its transcription response in the "TranscribedMidiData" format: 
-    {code: int, fnames: list[str], data (optional): str (binary buffer)}.
+    {code: int, fnames: list[str], data (optional): str (binary buffer)}, 
+    possibly preceded by partial results in the "PartialMidiData" format: 
+    {id: str, fname: str, progress: float, eta_sec: float, notes: list, partial: true}.
     """
     code = main(sys.argv)
     sys.exit(code)
\ No newline at end of file
@@ -0,0 +1,416 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A supervisor of several transcription worker processes (transcribe_stdio.py), with the same STDIO
+protocol as transcribe_stdio.py, so the server app can launch it instead (see "pythonNoteConverterPath"
+in Consts.json).
+
+The supervisor starts consts["supervisor"]["workers"] worker processes, each with its own warm AI model
+(shared-nothing replicas), and prints the "server_is_ready_msg" message once they are all ready. Every
+task message read from the STDIN is sent to the least-loaded worker, where the load of a worker is the
+total audio duration (seconds) of its unfinished tasks. The workers' responses are passed to the STDOUT
+as they are.
+A worker that crashes is restarted, and a worker with a task that runs longer than
+consts["transcription_timeout_ms"] is killed and restarted. The tasks it held are answered with
+the "midi_generation_failed" code, so the server app doesn't wait for them.
+"""
+
+import os, sys
+import json
+import subprocess
+import threading
+import time
+import wave
+
+from utils_py.serialized_objects import TranscribedMidiData, AudioDataToTranscribe
+from utils_py.loggers import ENVS, log, error_log, stdout_lock
+
+# Load the consts.json as a json dict:
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+# Other constants:
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+supervisor_consts = consts["supervisor"]
+worker_script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transcribe_stdio.py')
+task_timeout_sec = consts["transcription_timeout_ms"] / 1000
+postfix = consts["STDIO_MSG_POSTFIX"]
+DAEMON_FLAG = "--daemon"  # See transcribe_stdio.py.
+
+
+def estimate_task_cost(audio_data_obj: AudioDataToTranscribe) -> float:
+    """
+    Estimate the cost of a task as the duration (seconds) of its audio. A .wav file's duration is read
+    from its header. Other formats (and audio sent within the message) are estimated by their size,
+    assuming consts["supervisor"]["compressed_audio_bytes_per_sec"]. Never less than 1 second."""
+
+    bytes_per_sec = supervisor_consts["compressed_audio_bytes_per_sec"]
+    duration = audio_data_obj.data_size / bytes_per_sec
+    audio_dir_path = audio_data_obj.audio_dir_path
+    if audio_dir_path and os.path.isdir(audio_dir_path):
+        for fname in os.listdir(audio_dir_path):
+            fpath = os.path.join(audio_dir_path, fname)
+            ext = os.path.splitext(fname)[1].lower()
+            if not os.path.isfile(fpath) or ext not in consts["valid_audio_extensions"]:
+                continue
+            try:
+                with wave.open(fpath, 'rb') as wav_file:
+                    duration += wav_file.getnframes() / wav_file.getframerate()
+            except (wave.Error, EOFError):
+                duration += os.path.getsize(fpath) / bytes_per_sec  # Not a .wav file.
+    return max(1.0, duration)
+
+
+def send_message(message: str) -> None:
+    """Write a whole protocol message (already ending with the postfix) to the STDOUT."""
+    with stdout_lock:
+        sys.stdout.write(message + '\n')
+        sys.stdout.flush()
+
+
+class TranscriptionWorker:
+    """
+    A transcribe_stdio.py worker process, its unfinished tasks and a thread that reads its STDOUT.
+    The supervisor's "on_response" callback is called with (worker, parsed response, response message) for every
+    response, and the other messages (logs) are passed to the STDOUT.
+    """
+
+    def __init__(self, index: int, instruments_mode: int, on_response):
+        """
+        Start the worker process.
+        index - The worker's number (for logging).
+        instruments_mode - Passed to the worker as its command line argument.
+        on_response - A callback (worker, task id, response message) for the worker's responses."""
+        self.index = index
+        self.on_response = on_response
+        self.pending = {}  # {task id: (cost, dispatch time)} of the unfinished tasks.
+        self.ready = threading.Event()
+        self.stdin_lock = threading.Lock()
+        self.started_at = time.monotonic()
+
+        # Split the cores between the workers, so the replicas don't oversubscribe the CPU:
+        env = os.environ.copy()
+        threads = supervisor_consts["threads_per_worker"] or max(1, (os.cpu_count() or 1) // supervisor_consts["workers"])
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"):
+            env.setdefault(var, str(threads))
+
+        self.process = subprocess.Popen([sys.executable, '-X', 'utf8', worker_script_path, str(instruments_mode)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding='utf-8',
+                                        bufsize=1, env=env)
+        self.reader = threading.Thread(target=self._read_stdout, name=f'worker-{index}-reader', daemon=True)
+        self.reader.start()
+
+    @property
+    def load(self) -> float:
+        """The total cost of the worker's unfinished tasks."""
+        return sum(cost for cost, _ in list(self.pending.values()))
+
+    def is_alive(self) -> bool:
+        """Return True if the worker process is still running."""
+        return self.process.poll() is None
+
+    def send_task(self, task_id: str, task_msg: str, cost: float) -> None:
+        """Send a task message (a json line) to the worker, and track it. Raise an exception upon failure."""
+        self.pending[task_id] = (cost, time.monotonic())
+        try:
+            with self.stdin_lock:
+                self.process.stdin.write(task_msg + '\n')
+                self.process.stdin.flush()
+        except Exception:
+            self.pending.pop(task_id, None)
+            raise
+
+    def send_control(self, control_msg: str) -> None:
+        """Send a control message (a json line, e.g. "cancel") to the worker. A failure is logged."""
+        try:
+            with self.stdin_lock:
+                self.process.stdin.write(control_msg + '\n')
+                self.process.stdin.flush()
+        except Exception as e:
+            error_log(ENVS.ALL, f'{script_name}: Failed to send a control message to worker {self.index}: {e}')
+
+    def oldest_task_age(self) -> float:
+        """Return the time (seconds) since the oldest unfinished task was sent, or 0 if there are none."""
+        dispatch_times = [dispatch_time for _, dispatch_time in list(self.pending.values())]
+        return time.monotonic() - min(dispatch_times) if dispatch_times else 0.0
+
+    def close_stdin(self) -> None:
+        """Tell the worker that no more tasks will be sent. It exits once its tasks are done."""
+        try:
+            with self.stdin_lock:
+                self.process.stdin.close()
+        except Exception:
+            pass
+
+    def kill(self) -> None:
+        """Kill the worker process."""
+        try:
+            self.process.kill()
+        except Exception:
+            pass
+
+    def _read_stdout(self) -> None:
+        """
+        Read the worker's STDOUT messages. A data or control message ends with the postfix and may span
+        several lines, so its lines are joined until the postfix. Any other line is a log: the development
+        logs are printed without the postfix, so such a line is passed on by itself, and never glued to
+        the message that follows it."""
+        message_prefixes = (consts["STDIO_DATA_MSG_PREFIX"], consts["STDIO_CTRL_MSG_PREFIX"])
+        message_lines = []
+        for line in self.process.stdout:
+            line = line.rstrip('\n')
+            if not message_lines and not line.startswith(message_prefixes) and not line.endswith(postfix):
+                send_message(line + postfix)  # A log line.
+                continue
+            message_lines.append(line)
+            if not line.endswith(postfix):
+                continue
+            message = '\n'.join(message_lines)
+            message_lines = []
+
+            if message.startswith(consts["STDIO_DATA_MSG_PREFIX"]):
+                try:
+                    response = json.loads(message[len(consts["STDIO_DATA_MSG_PREFIX"]): -len(postfix)])
+                except json.JSONDecodeError:
+                    response = {}
+                if response.get("partial"):
+                    send_message(message)  # A partial result. The task isn't over.
+                    continue
+                self.on_response(self, response, message)
+            elif not self.ready.is_set() and message.startswith(consts["server_is_ready_msg"]):
+                self.ready.set()
+            elif message.startswith(consts["STDIO_CTRL_MSG_PREFIX"]):
+                continue  # The supervisor answers the control messages itself.
+            else:
+                send_message(message)  # A log.
+
+        if message_lines:
+            send_message('\n'.join(message_lines) + postfix)
+
+
+class TranscriptionSupervisor:
+    """Start, load-balance, watch and restart a pool of TranscriptionWorker objects (see the module description)."""
+
+    def __init__(self, instruments_mode: int, workers: int):
+        """
+        Create a new supervisor. The workers are started by start().
+        instruments_mode - Passed to the workers.
+        workers - The number of worker processes."""
+        self.instruments_mode = instruments_mode
+        self.workers_count = max(1, workers)
+        self.workers = []
+        self.workers_lock = threading.Condition()  # Guards "workers" and notifies when a worker is ready.
+        self.task_results = []  # True/False per finished task.
+        self.closing = threading.Event()
+        self.restarts = 0
+
+    def start(self) -> bool:
+        """Start all the workers and wait until they are ready. Return True if at least one is ready."""
+        with self.workers_lock:
+            self.workers = [self._start_worker(i) for i in range(self.workers_count)]
+        deadline = time.monotonic() + supervisor_consts["ready_timeout_sec"]
+        for worker in self.workers:
+            worker.ready.wait(timeout=max(0, deadline - time.monotonic()))
+        ready_count = sum(worker.ready.is_set() for worker in self.workers)
+        log(ENVS.DEVELOPMENT, f'{script_name}: {ready_count}/{self.workers_count} workers are ready.' + postfix)
+        threading.Thread(target=self._monitor, name='supervisor-monitor', daemon=True).start()
+        return ready_count > 0
+
+    def dispatch(self, task_msg: str, message: dict = None) -> None:
+        """
+        Send a task message to the least-loaded ready worker (wait for one if none is ready).
+        Raise an exception if the message isn't a valid task.
+        task_msg - The task message, as it's sent to the worker.
+        message - (Optional) The already parsed "task_msg", so it isn't parsed again."""
+
+        audio_data_obj = AudioDataToTranscribe.from_json(message if message is not None else json.loads(task_msg))
+        cost = estimate_task_cost(audio_data_obj)
+        while True:
+            with self.workers_lock:
+                ready_workers = [w for w in self.workers if w.ready.is_set() and w.is_alive()]
+                if not ready_workers:
+                    self.workers_lock.wait(timeout=1)
+                    continue
+                worker = min(ready_workers, key=lambda w: w.load)
+            try:
+                worker.send_task(audio_data_obj.id, task_msg, cost)
+            except Exception as e:
+                error_log(ENVS.ALL, f'{script_name}: Failed to send task "{audio_data_obj.id}" to worker ' + \
+                    f'{worker.index}. Trying another worker.\n\tMore details: {e}')
+                worker.kill()  # The monitor restarts it.
+                worker.ready.clear()
+                continue
+            log(ENVS.DEVELOPMENT, f'{script_name} | id={audio_data_obj.id}: Sent to worker {worker.index} ' + \
+                f'(cost {cost:.1f} sec, load {worker.load:.1f} sec).' + postfix)
+            return
+
+    def cancel(self, task_id: str, control_msg: str) -> bool:
+        """
+        Pass a "cancel" control message to the worker that runs the task "task_id" (see transcribe_stdio.py).
+        Return False if no worker has it (it's already finished, or unknown)."""
+        with self.workers_lock:
+            workers = [worker for worker in self.workers if task_id in worker.pending]
+        for worker in workers:
+            worker.send_control(control_msg)
+        return bool(workers)
+
+    def close(self) -> None:
+        """Close the workers' STDIN and wait for them to finish their tasks (up to the tasks' timeout)."""
+        self.closing.set()
+        with self.workers_lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.close_stdin()
+        for worker in workers:
+            try:
+                worker.process.wait(timeout=max(1, task_timeout_sec - worker.oldest_task_age()))
+            except subprocess.TimeoutExpired:
+                worker.kill()
+            worker.reader.join()
+            self._fail_pending_tasks(worker, 'the supervisor is closing')
+
+    def _on_response(self, worker: TranscriptionWorker, response: dict, message: str) -> None:
+        """
+        Pass a worker's response to the STDOUT and mark its task as finished. Only a response with the code
+        consts["convertion_success"] or consts["convertion_partial_success"] counts as a success (not a
+        failed, cancelled or timed-out task)."""
+        worker.pending.pop(response.get("id", ""), None)
+        send_message(message)
+        self.task_results.append(response.get("code") in (consts["convertion_success"], consts["convertion_partial_success"]))
+
+    def _start_worker(self, index: int) -> TranscriptionWorker:
+        """Start a new worker process."""
+        worker = TranscriptionWorker(index, self.instruments_mode, self._on_response)
+        threading.Thread(target=self._notify_when_ready, args=(worker,), daemon=True).start()
+        return worker
+
+    def _notify_when_ready(self, worker: TranscriptionWorker) -> None:
+        """Wake up the dispatcher when the worker becomes ready."""
+        worker.ready.wait(timeout=supervisor_consts["ready_timeout_sec"])
+        with self.workers_lock:
+            self.workers_lock.notify_all()
+
+    def _fail_pending_tasks(self, worker: TranscriptionWorker, reason: str) -> None:
+        """Answer the unfinished tasks of a dead worker with a failure, so the server app doesn't wait for them."""
+        for task_id in list(worker.pending.keys()):
+            worker.pending.pop(task_id, None)
+            error_log(ENVS.ALL, f'{script_name} | id={task_id}: The task failed, because {reason}.')
+            failure = TranscribedMidiData(code=consts["midi_generation_failed"], id=task_id)
+            send_message(consts["STDIO_DATA_MSG_PREFIX"] + failure.get_json_str() + postfix)
+            self.task_results.append(False)
+
+    def _monitor(self) -> None:
+        """Restart crashed workers, and kill (then restart) hung workers or workers that never became ready."""
+        while not self.closing.wait(supervisor_consts["health_check_interval_sec"]):
+            with self.workers_lock:
+                workers = list(self.workers)
+            for worker in workers:
+                if self.closing.is_set():
+                    return
+                if not worker.is_alive():
+                    pass
+                elif worker.oldest_task_age() > task_timeout_sec:
+                    error_log(ENVS.ALL, f'{script_name}: Worker {worker.index} is hung (a task exceeded ' + \
+                        f'{task_timeout_sec} sec). Killing it.')
+                elif not worker.ready.is_set() and \
+                        time.monotonic() - worker.started_at > supervisor_consts["ready_timeout_sec"]:
+                    error_log(ENVS.ALL, f'{script_name}: Worker {worker.index} didn\'t become ready. Killing it.')
+                else:
+                    continue
+                self._restart_worker(worker)
+
+    def _restart_worker(self, worker: TranscriptionWorker) -> None:
+        """Replace a dead (or unusable) worker with a new one."""
+        worker.kill()
+        worker.process.wait()
+        worker.reader.join(timeout=5)
+        self._fail_pending_tasks(worker, f'worker {worker.index} died (exit code {worker.process.returncode})')
+        if self.closing.is_set():
+            return
+        self.restarts += 1
+        error_log(ENVS.ALL, f'{script_name}: Restarting worker {worker.index} (restart number {self.restarts}).')
+        with self.workers_lock:
+            self.workers[self.workers.index(worker)] = self._start_worker(worker.index)
+
+
+def main(argv: list[str]) -> int:
+    """
+    Start the workers, then read task messages from the STDIN (one per line, in the format of
+    "AudioDataToTranscribe") and dispatch each one to a worker. The responses are sent to the STDOUT
+    in the format of "TranscribedMidiData". When the STDIN closes, wait for the workers to finish and
+    return a code that signals a success/failure, like transcribe_stdio.py.
+    The control messages of transcribe_stdio.py are answered by the supervisor itself: "ping" with a
+    "pong" (with the workers' loads) and "drain" by finishing the dispatched tasks and exiting. A "cancel" 
+    is passed to the worker that runs the task. An unknown control message is logged and ignored.
+    Optionally: Get the type and number of instruments, and the daemon flag from sys.argv."""
+
+    # Get the instruments mode and the daemon flag:
+    args = argv[1:]
+    daemon = DAEMON_FLAG in args
+    args = [arg for arg in args if arg != DAEMON_FLAG]
+    if len(args) == 1 and args[0].isdigit():
+        instruments_mode = int(args[0])
+    else:
+        instruments_mode = consts["instruments_options"]["many"]["value"]
+
+    supervisor = TranscriptionSupervisor(instruments_mode, supervisor_consts["workers"])
+    if not supervisor.start():
+        error_log(ENVS.ALL, f'{script_name}: No worker became ready. Exiting.')
+        supervisor.close()
+        return consts["midi_generation_failed"]
+    send_message(f'{consts["server_is_ready_msg"]} on STDIN with {supervisor.workers_count} workers' + postfix)
+
+    # Read incoming task messages from the server app, each one in a separate line:
+    drained = False
+    for line in sys.stdin:  # Runs until EOF is read which means the other side closed the stdin stream.
+        task = line.strip()
+        if not task:
+            continue
+        try:
+            message = json.loads(task)  # Parsed once, for both the control and the task messages.
+        except json.JSONDecodeError as e:
+            # A failure in 1 task shouldn't stop us from continue handling the next tasks.
+            supervisor.task_results.append(False)
+            error_log(ENVS.ALL, f'{script_name}: Received invalid message from stdin ' + \
+                f'(code {consts["status_codes"]["bad_input"]}). Continue to the next task.\n\tMore details: {e}')
+            continue
+        if isinstance(message, dict) and "control" in message:
+            if message["control"] == "ping":
+                loads = [round(worker.load, 1) for worker in supervisor.workers]
+                send_message(consts["STDIO_CTRL_MSG_PREFIX"] + json.dumps({"control": "pong", "id": message.get("id", ""), 
+                    "daemon": daemon, "workers_loads": loads, "restarts": supervisor.restarts}) + postfix)
+            elif message["control"] == "drain":
+                drained = True
+                break
+            elif message["control"] == "cancel":
+                if not supervisor.cancel(message.get("id", ""), task):
+                    log(ENVS.DEVELOPMENT, f'{script_name} | id={message.get("id", "")}: No dispatched task to cancel.' + postfix)
+            else:
+                error_log(ENVS.ALL, f'{script_name}: Unknown control message: {message}. Ignored.')
+            continue
+        try:
+            supervisor.dispatch(task, message)
+        except Exception as e:
+            # A failure in 1 task shouldn't stop us from continue handling the next tasks.
+            supervisor.task_results.append(False)
+            error_log(ENVS.ALL, f'{script_name}: Received invalid message task from stdin. ' + \
+                f'Continue to the next task.\n\tMore details: {e}')
+
+    supervisor.close()
+    if drained:
+        send_message(consts["STDIO_CTRL_MSG_PREFIX"] + json.dumps({"control": "drained"}) + postfix)
+    if daemon:
+        return consts["convertion_success"]
+
+    # Return success if ALL the tasks succeeded, partial-success if only some succeeded, and failure if non succeeded:
+    task_results = supervisor.task_results
+    return consts["convertion_success"] if (len(task_results) > 0 and all(task_results)) else \
+        consts["convertion_partial_success"] if any(task_results) else consts["midi_generation_failed"]
+
+if __name__ == "__main__":
+    """Usage: python transcribe_supervisor.py [optional: 1|2] [optional: --daemon]
+    Then write task messages to its STDIN, exactly as to transcribe_stdio.py.
+    """
+    code = main(sys.argv)
+    sys.exit(code)
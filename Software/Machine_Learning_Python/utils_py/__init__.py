@@ -1,10 +1,13 @@
 from .loggers import *
 from .serialized_objects import *
 from .error_objects import *
+from .socket_framing import *
 
 # A package-level version variable
 VERSION = "1.0.0"
 
-__all__ = ['ENVS', 'log', 'error_log', 
-           'SerializedDataClass', 'TranscribedMidiData', 'AudioDataToTranscribe',
-           'BaseException']
\ No newline at end of file
+__all__ = ['ENVS', 'log', 'error_log', 'flush_logs', 'stdout_lock', 
+           'SerializedDataClass', 'TranscribedMidiData', 'PartialMidiData', 'AudioDataToTranscribe',
+           'BaseException', 'TaskCancelled',
+           'FramedConnection', 'is_framed_connection', 'FRAME_MAGIC', 'FRAME_HEADER', 'FRAME_TYPES',
+           'FRAME_TASK', 'FRAME_RESULT', 'FRAME_PARTIAL', 'FRAME_KEEP_ALIVE', 'FRAME_CANCEL', 'FRAME_CLOSE']
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+In-memory audio decoding for the AI models: decode any of the formats in consts["valid_audio_extensions"]
+(.wav, .flac, .ogg, .mp3, .m4a, .aac, .mpeg) straight into a mono float32 buffer at the model's sample rate
+(16 kHz for MR-MT3, 22.05 kHz for basic-pitch), without writing an intermediate WAV file.
+
+The formats libsndfile reads (wav, flac, ogg and, with libsndfile >= 1.1, mp3) are decoded by soundfile;
+the rest (m4a, aac, ...) by librosa's audioread backend (ffmpeg), still in memory. The audio is down-mixed
+to mono before it's resampled (see Resampler). Everything is float32, without float64 intermediates.
+
+The resampling quality (consts["audio_front_end"]["resample_quality"], or per call) is one of:
+    "soxr_hq" - soxr, high quality (librosa's default). Streamed: the file is decoded and resampled block by
+        block in a single pass, so the full-rate audio is never held in memory.
+    "soxr_vhq" - soxr, very high quality. Streamed.
+    "soxr_qq" - soxr, quick (lowest) quality. Streamed.
+    "polyphase" - scipy's polyphase filter (resample_poly) over the whole audio.
+    "kaiser_fast" / "kaiser_best" - resampy's band-limited sinc (Kaiser window) over the whole audio.
+See benchmarks/bench_resample.py for a comparison of their speed.
+Usage:
+    audio = decode_audio(audio_path, target_sr=16000)  # np.ndarray, float32, mono.
+    audio_paths = list_audio_files(audio_dir)
+"""
+
+import os
+import json
+import math
+import numpy as np
+import soundfile
+import soxr
+
+from .tracing import span
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+default_quality = consts["audio_front_end"]["resample_quality"]
+decode_block_samples = consts["audio_front_end"]["decode_block_samples"]  # The block size of the streamed decoding.
+soxr_qualities = {"soxr_qq": "QQ", "soxr_hq": "HQ", "soxr_vhq": "VHQ"}  # {quality: soxr's quality recipe}.
+resampy_filters = {"kaiser_fast": "kaiser_fast", "kaiser_best": "kaiser_best"}  # {quality: resampy's filter}.
+resample_qualities = [*soxr_qualities, "polyphase", *resampy_filters]
+
+
+class Resampler:
+    """
+    Resample mono float32 audio from "orig_sr" to "target_sr" with the given quality (see the module description).
+    It only holds the parameters: the filters are built by the resampling libraries on every call."""
+
+    def __init__(self, orig_sr: int, target_sr: int, quality: str = default_quality):
+        """
+        Create a new resampler.
+        orig_sr - The sample rate of the source audio.
+        target_sr - The sample rate of the resampled audio.
+        quality - One of "resample_qualities". Default: consts["audio_front_end"]["resample_quality"].
+        Raise ValueError for an unknown quality."""
+        if quality not in resample_qualities:
+            raise ValueError(f'Unknown resampling quality "{quality}". The options: {resample_qualities}')
+        self.orig_sr = orig_sr
+        self.target_sr = target_sr
+        self.quality = quality
+        # The polyphase filter's up/down factors (e.g. 44100 -> 16000: 160/441):
+        gcd = math.gcd(orig_sr, target_sr)
+        self.up, self.down = target_sr // gcd, orig_sr // gcd
+
+    @property
+    def streamable(self) -> bool:
+        """True if the audio can be resampled block by block (see stream())."""
+        return self.quality in soxr_qualities
+
+    def resample(self, audio: np.ndarray) -> np.ndarray:
+        """Return the whole (mono) "audio" resampled to "target_sr", as float32."""
+        audio = np.asarray(audio, dtype=np.float32)
+        if self.orig_sr == self.target_sr:
+            return audio
+        with span("resample"):
+            if self.quality in soxr_qualities:
+                return soxr.resample(audio, self.orig_sr, self.target_sr, quality=soxr_qualities[self.quality])
+            if self.quality == "polyphase":
+                from scipy.signal import resample_poly
+                return resample_poly(audio, self.up, self.down).astype(np.float32, copy=False)
+            import resampy
+            return resampy.resample(audio, self.orig_sr, self.target_sr, filter=resampy_filters[self.quality]).astype(np.float32, copy=False)
+
+    def stream(self) -> soxr.ResampleStream | None:
+        """
+        Return a new stateful stream resampler (mono, float32) for resampling an audio block by block,
+        or None if no resampling is needed. A stream is used by a single audio file.
+        A quality that can't be streamed (see "streamable") streams with soxr's high quality."""
+        if self.orig_sr == self.target_sr:
+            return None
+        return soxr.ResampleStream(self.orig_sr, self.target_sr, 1, dtype='float32', 
+                                   quality=soxr_qualities.get(self.quality, "HQ"))
+
+
+def to_mono(audio: np.ndarray, channels_axis: int = -1) -> np.ndarray:
+    """Down-mix a multi-channel audio array (channels on "channels_axis") to a mono float32 array."""
+    if audio.ndim == 1:
+        return audio.astype(np.float32, copy=False)
+    return audio.mean(axis=channels_axis, dtype=np.float32)
+
+def decode_audio(audio_path: str, target_sr: int, quality: str = default_quality) -> np.ndarray:
+    """
+    Decode an audio file in memory into a mono float32 array at "target_sr" (see the module description).
+    With a streamable quality, a file that libsndfile reads is decoded, down-mixed and resampled block by 
+    block in a single pass. Otherwise the whole file is decoded and down-mixed, then resampled.
+    Raise an exception upon failure.
+
+    audio_path - The path of the audio file.
+    target_sr - The sample rate of the returned audio.
+    quality - The resampling quality (see "resample_qualities"). Default: consts["audio_front_end"]["resample_quality"]."""
+
+    try:
+        info = soundfile.info(audio_path)
+    except (soundfile.LibsndfileError, RuntimeError, TypeError):
+        # A format that libsndfile can't read (e.g. m4a, aac). Decode it with ffmpeg:
+        import librosa
+        with span("audio_decode"):
+            audio, orig_sr = librosa.load(audio_path, sr=None, mono=False, dtype=np.float32)  # Shape: [channels, frames].
+            audio = to_mono(audio, channels_axis=0)
+        return Resampler(int(orig_sr), target_sr, quality).resample(audio)
+
+    resampler = Resampler(info.samplerate, target_sr, quality)
+    if not resampler.streamable:
+        with span("audio_decode"):
+            audio, _ = soundfile.read(audio_path, dtype='float32', always_2d=True)  # Shape: [frames, channels].
+            audio = to_mono(audio, channels_axis=1)
+        return resampler.resample(audio)
+
+    # Decode and resample in one pass (the resampled blocks are written into a single preallocated buffer):
+    stream = resampler.stream()
+    audio = np.empty(math.ceil(info.frames * target_sr / info.samplerate) + decode_block_samples, dtype=np.float32)
+    length = 0
+
+    def append(samples: np.ndarray) -> None:
+        """Copy the samples to the end of the decoded audio."""
+        nonlocal audio, length
+        if length + len(samples) > len(audio):  # The header's frame count was short.
+            audio = np.concatenate([audio[:length], np.empty(len(samples) + len(audio), dtype=np.float32)])
+        audio[length: length + len(samples)] = samples
+        length += len(samples)
+
+    blocks = soundfile.blocks(audio_path, blocksize=decode_block_samples, dtype='float32', always_2d=True)
+    while True:
+        with span("audio_decode"):
+            block = next(blocks, None)
+            if block is None:
+                break
+            mono = to_mono(block, channels_axis=1)
+        with span("resample"):
+            append(stream.resample_chunk(mono) if stream else mono)
+    if stream:
+        with span("resample"):
+            append(stream.resample_chunk(np.empty(0, dtype=np.float32), last=True))
+    return audio[:length]
+
+def is_audio_file(audio_path: str) -> bool:
+    """Return True if "audio_path" is a file of one of the formats in consts["valid_audio_extensions"]."""
+    return os.path.isfile(audio_path) and os.path.splitext(audio_path)[1].lower() in consts["valid_audio_extensions"]
+
+def list_audio_files(audio_dir: str) -> list[str]:
+    """Return the paths of the audio files (see is_audio_file()) within "audio_dir", sorted by name."""
+    return [os.path.join(audio_dir, audio_fname) for audio_fname in sorted(os.listdir(audio_dir)) \
+            if is_audio_file(os.path.join(audio_dir, audio_fname))]
+
+
+__all__ = ['resample_qualities', 'Resampler', 'to_mono', 'decode_audio', 'is_audio_file', 'list_audio_files']
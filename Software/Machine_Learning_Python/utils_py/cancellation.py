@@ -0,0 +1,101 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+Cooperative cancellation of running transcriptions: a task is stopped early if it was cancelled (a "cancel"
+control message with its id), or if it passed its deadline ("deadline_ms" of AudioDataToTranscribe), so the
+worker is free for the next task instead of finishing a result nobody will collect.
+
+A server creates a CancelToken per task, and wraps its transcription with track_cancellation(), which links
+the token to the task's directory. The models check it between their segments, chunks or batches
+(check_cancelled(), or get_cancellation() to drop a single directory out of a batch), and the check raises
+TaskCancelled with the code consts["task_cancelled"] or consts["task_timed_out"]. The tokens are linked by
+the directory (not by the thread), so the checks work on the registry's batching thread too, but not in
+another process.
+Usage:
+    token = CancelToken(task_id, deadline_ms)
+    with track_cancellation(audio_dir_path, token):
+        ...  # Transcribe. Elsewhere: token.cancel()
+    # And in a model:
+    check_cancelled(audio_dir_path)
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from .error_objects import TaskCancelled
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+_tokens = {}  # {normalized audio directory path: CancelToken} of the running tasks.
+_tokens_lock = threading.Lock()
+
+
+class CancelToken:
+    """The cancellation state of a single task: cancelled by a request, or past its deadline."""
+
+    def __init__(self, id: str = "", deadline_ms: float = None):
+        """
+        Create a new (not cancelled) token.
+        id - The task's id.
+        deadline_ms - (Optional) The task's deadline, in milliseconds since the epoch (like JavaScript's
+            Date.now()). None: no deadline."""
+        self.id = id
+        self.deadline_ms = deadline_ms
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """Cancel the task. Its next check raises TaskCancelled."""
+        self._cancelled.set()
+
+    def get_error(self) -> TaskCancelled | None:
+        """Return the TaskCancelled error of a cancelled or a timed-out task, or None if it may go on."""
+        if self._cancelled.is_set():
+            return TaskCancelled(consts["task_cancelled"], f'id={self.id}: The task was cancelled.')
+        if self.deadline_ms is not None and time.time() * 1000 >= self.deadline_ms:
+            return TaskCancelled(consts["task_timed_out"], f'id={self.id}: The task passed its deadline.')
+        return None
+
+    def check(self) -> None:
+        """Raise TaskCancelled if the task was cancelled or passed its deadline."""
+        error = self.get_error()
+        if error is not None:
+            raise error
+
+
+def _dir_key(dir_path: str) -> str:
+    """Return the key of a directory in "_tokens"."""
+    return os.path.normcase(os.path.abspath(dir_path))
+
+@contextmanager
+def track_cancellation(audio_dir_path: str, token: CancelToken):
+    """Link "token" to the task's directory "audio_dir_path" within the "with" block (see the module description)."""
+    key = _dir_key(audio_dir_path)
+    with _tokens_lock:
+        _tokens[key] = token
+    try:
+        yield token
+    finally:
+        with _tokens_lock:
+            if _tokens.get(key) is token:
+                del _tokens[key]
+
+def get_cancellation(audio_dir_path: str) -> TaskCancelled | None:
+    """Return the TaskCancelled error of the task of "audio_dir_path" if it was cancelled or timed-out, or else None."""
+    if not _tokens:
+        return None
+    token = _tokens.get(_dir_key(audio_dir_path))
+    return token.get_error() if token is not None else None
+
+def check_cancelled(audio_dir_path: str) -> None:
+    """Raise TaskCancelled if the task of "audio_dir_path" was cancelled or passed its deadline."""
+    error = get_cancellation(audio_dir_path)
+    if error is not None:
+        raise error
+
+
+__all__ = ['CancelToken', 'track_cancellation', 'get_cancellation', 'check_cancelled']
@@ -22,5 +22,10 @@ class BaseException(Exception):
     def __repr__(self) -> str:
         return f'{self.__class__.__name__} Error code: {self.code}: {self.message}'
 
+class TaskCancelled(BaseException):
+    """
+    A task that was stopped before its end: cancelled (code consts["task_cancelled"]) or past its deadline 
+    (code consts["task_timed_out"]). See utils_py/cancellation.py."""
+
 # Expose
-__all__ = ['BaseException']
+__all__ = ['BaseException', 'TaskCancelled']
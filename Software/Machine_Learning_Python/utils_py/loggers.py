@@ -5,6 +5,13 @@ running nodejs environment, or all environments (see ENVS Enum below for the opt
 either into the console, if the running environment is 'development', or into log files called app.log and 
 errors.log, if the environment is 'production'.
 
+In production, the messages are handed to a background writer thread per log file (through a bounded queue), 
+which keeps the file open, writes every batch of queued messages at once, and rotates the file by size (see 
+consts["file_logging"]), so logging from the hot loops costs the caller only the formatting of the message. 
+When the queue is full, a message is dropped (and the drops are reported in the log), or, with the "block" 
+policy, the caller waits up to a second for room. The queued messages are written at exit, and flush_logs() 
+writes them on demand (e.g. before os._exit()).
+
 Author: Alon Haviv, Stellar Intelligence.
 """
 
@@ -14,6 +21,10 @@ from datetime import datetime
 from pathlib import Path
 from enum import Enum
 import json
+import time
+import queue
+import atexit
+import threading
 
 solutionBasePath =  os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
 with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
@@ -25,41 +36,205 @@ class ENVS(Enum):
     DEVELOPMENT = 'development'
     PRODUCTION = 'production'
 
+# Serializes the writes to the STDOUT, which may be shared with the stdio protocol messages of several threads:
+stdout_lock = threading.RLock()
+
 # The current nodejs environment. If not set, then the default is development:
 try:
     current_env = ENVS(os.environ.get('NODE_ENV', ENVS['DEVELOPMENT']))
 except ValueError:
     current_env = ENVS.DEVELOPMENT
 
-def get_current_timestamp() -> str:
-    """Helper function to get the current timestamp."""
-    return datetime.now().strftime('%m/%d/%Y, %I:%M:%S %p')
+def get_current_timestamp(timestamp: float = None) -> str:
+    """Helper function to get the current timestamp (or the given time.time() value) as a string."""
+    return (datetime.fromtimestamp(timestamp) if timestamp is not None else datetime.now()).strftime('%m/%d/%Y, %I:%M:%S %p')
+
+
+class _LogFileWriter:
+    """
+    Appends messages to a log file from a background thread (see the module description). The file is opened
+    unbuffered, so a batch is a single write, and a forked child never re-writes the parent's messages."""
+
+    def __init__(self, log_file_path: str, settings: dict):
+        """
+        log_file_path - The path of the log file.
+        settings - consts["file_logging"]."""
+        self.log_file_path = log_file_path
+        self.is_async = settings["async"]
+        self.batch_size = settings["batch_size"]
+        self.block_when_full = settings["queue_full_policy"] == "block"
+        self.max_file_size = settings["max_file_size_MB"] * 1024 * 1024
+        self.backup_count = settings["backup_count"]
+        self.queue = queue.Queue(maxsize=settings["queue_size"])
+        self.file = None
+        self.thread = None
+        self.lock = threading.Lock()  # Guards the start of the thread (async), or the writes (sync).
+        self.dropped_count = 0
+
+    def write(self, timestamp: float | None, text: str) -> None:
+        """Write (or queue) a message: the text, prefixed by the timestamp (time.time()) of the log() call, if given."""
+        if not self.is_async:
+            with self.lock:
+                self._write_batch([(timestamp, text)])
+            return
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put((timestamp, text), block=self.block_when_full, timeout=1 if self.block_when_full else None)
+        except queue.Full:
+            self.dropped_count += 1  # Approximate under contention, it's only reported.
+
+    def flush(self, timeout: float = 5) -> None:
+        """Wait (up to "timeout" seconds) until the messages that were queued so far are written."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        flushed = threading.Event()
+        try:
+            self.queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return
+        flushed.wait(timeout)
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self.thread.start()
+
+    def _run(self) -> None:
+        """The writer thread: take all the queued messages (up to a batch), write them at once, and repeat."""
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch([item for item in items if not isinstance(item, threading.Event)])
+            except Exception as err:
+                print(f"log writer failed: {err}", file=sys.stderr, flush=True)
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write_batch(self, messages: list[tuple[float | None, str]]) -> None:
+        """Format and append the messages (and a report of the dropped ones) to the file, rotating it if it's full."""
+        if self.dropped_count:
+            dropped_count, self.dropped_count = self.dropped_count, 0
+            messages.append((time.time(), f'{dropped_count} log messages were dropped (the log queue was full).'))
+        if not messages:
+            return
+        data = ''.join((f'[{get_current_timestamp(timestamp)}] {text}\n' if timestamp is not None else text + '\n')
+                       for timestamp, text in messages).encode('utf-8')
+        if self.file is None:
+            self._open()
+        elif self.max_file_size:
+            file_size = os.fstat(self.file.fileno()).st_size
+            if file_size and file_size + len(data) > self.max_file_size:
+                self._rotate()
+        self.file.write(data)
 
-def write_to_file(message: str) -> None:
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.log_file_path), exist_ok=True)  # Ensure directory exists
+        self.file = open(self.log_file_path, 'ab', buffering=0)
+
+    def _rotate(self) -> None:
+        """
+        Shift the backups (app.log -> app.log.1 -> app.log.2...) and reopen the file. If another process (which
+        writes to the same file) already rotated it, only reopen it."""
+        try:
+            is_rotated = not os.path.samestat(os.fstat(self.file.fileno()), os.stat(self.log_file_path))
+        except OSError:
+            is_rotated = True
+        self.file.close()
+        if not is_rotated:
+            try:
+                for i in range(self.backup_count - 1, 0, -1):
+                    if os.path.exists(f'{self.log_file_path}.{i}'):
+                        os.replace(f'{self.log_file_path}.{i}', f'{self.log_file_path}.{i + 1}')
+                if self.backup_count:
+                    os.replace(self.log_file_path, f'{self.log_file_path}.1')
+                else:
+                    os.remove(self.log_file_path)
+            except OSError as err:  # E.g. the file is open by another process on Windows. Keep appending.
+                print(f"log rotation failed: {err}", file=sys.stderr, flush=True)
+        self._open()
+
+
+_file_writers = {}  # {log file path: _LogFileWriter}, created on the first message.
+_file_writers_lock = threading.Lock()
+# The log files' paths, resolved once instead of on every message: {consts key of the log file: path}.
+_log_file_paths = {log_file_key: str(Path(os.path.join(solutionBasePath, consts[log_file_key])).resolve())
+                   for log_file_key in ('log_file', 'errors_log_file')}
+
+def get_file_writer(log_file_path: str, settings: dict = None) -> _LogFileWriter:
+    """
+    Return the writer of a file, creating it on the first call, e.g. for another json-lines file that should
+    be written in the background and rotated like the logs. Its write(None, line) appends the line as is.
+    log_file_path - The resolved path of the file.
+    settings - (Optional) The writer's settings, in the format of consts["file_logging"] (the default)."""
+    writer = _file_writers.get(log_file_path)
+    if writer is None:
+        with _file_writers_lock:
+            writer = _file_writers.get(log_file_path)
+            if writer is None:
+                writer = _file_writers[log_file_path] = _LogFileWriter(log_file_path, settings or consts["file_logging"])
+    return writer
+
+def _get_file_writer(log_file_key: str) -> _LogFileWriter:
+    """Return the writer of the log file in consts[log_file_key], creating it on the first call."""
+    return get_file_writer(_log_file_paths[log_file_key])
+
+def flush_logs(timeout: float = 5) -> None:
+    """Wait (up to "timeout" seconds per log file) until the messages that were logged so far are written."""
+    for writer in list(_file_writers.values()):
+        writer.flush(timeout)
+
+def _reset_file_writers_in_child() -> None:
+    """
+    After a fork, the child has no writer threads and a copy of the parent's queues (whose messages the parent 
+    writes). Start over with new writers."""
+    global _file_writers_lock
+    for writer in _file_writers.values():
+        if writer.file is not None:
+            writer.file.close()
+    _file_writers.clear()
+    _file_writers_lock = threading.Lock()
+
+atexit.register(flush_logs)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_file_writers_in_child)
+
+def write_to_file(message: str, timestamp: float = None) -> None:
     """
     Perform the actual writing (append), either to the stdout or to the log file in consts.log_file.
-    message - The message to print. New line is added at the end."""
+    message - The message to print. New line is added at the end.
+    timestamp - (Optional) The time.time() of the message. If given, the message is prefixed by it (formatted
+                by the writer thread, in production)."""
 
     if current_env == ENVS['DEVELOPMENT']:
-        print(message, flush=True)
+        if timestamp is not None:
+            message = f"[{get_current_timestamp(timestamp)}] {message}"
+        with stdout_lock:
+            sys.stdout.write(message + '\n')
+            sys.stdout.flush()
     else:
-        log_file_path = Path(os.path.join(solutionBasePath, consts['log_file'])).resolve()
-        log_file_path.parent.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
-        with log_file_path.open('a', encoding='utf-8') as f:
-            f.write(message + '\n')
+        _get_file_writer('log_file').write(timestamp, message)
 
-def write_error_to_file(message: str) -> None:
+def write_error_to_file(message: str, timestamp: float = None) -> None:
     """
     Perform the actual writing (append), either to the stderr or to the log file in consts.errors_log_file.
-    message - The message to print. New line is added at the end."""
+    message - The message to print. New line is added at the end.
+    timestamp - (Optional) The time.time() of the message. If given, the message is prefixed by it (formatted
+                by the writer thread, in production)."""
 
     if current_env == ENVS['DEVELOPMENT']:
+        if timestamp is not None:
+            message = f"[{get_current_timestamp(timestamp)}] {message}"
         print(message, file=sys.stderr, flush=True)
     else:
-        error_log_file_path = Path(os.path.join(solutionBasePath, consts['errors_log_file'])).resolve()
-        error_log_file_path.parent.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
-        with error_log_file_path.open('a', encoding='utf-8') as f:
-            f.write(message + '\n')
+        _get_file_writer('errors_log_file').write(timestamp, message)
 
 def log(env: str, *args) -> None:
     """
@@ -68,10 +243,9 @@ def log(env: str, *args) -> None:
     env - The nodejs environment in which the data can be logged. See options in "ENVS" object.
     args - The arguments to log (same behavior as in print)."""
 
-    if env == ENVS['ALL'] or current_env == env:
+    if env == ENVS['ALL'] or current_env == env:  # Filtered before formatting, so a rejected message costs nothing.
         try:
-            message = f"[{get_current_timestamp()}] {' '.join(map(str, args))}"
-            write_to_file(message)
+            write_to_file(' '.join(map(str, args)), time.time())
         except Exception as err:
             print(f"log() failed: {err}", file=sys.stderr, flush=True)
 
@@ -84,10 +258,9 @@ def error_log(env: str, *args: object) -> None:
 
     if env == ENVS['ALL'] or current_env == env:
         try:
-            message = f"[{get_current_timestamp()}] {' '.join(map(str, args))}"
-            write_error_to_file(message)
+            write_error_to_file(' '.join(map(str, args)), time.time())
         except Exception as err:
             print(f"error_log() failed: {err}", file=sys.stderr, flush=True)
 
 # Expose
-__all__ = ['ENVS', 'log', 'error_log']
\ No newline at end of file
+__all__ = ['ENVS', 'log', 'error_log', 'flush_logs', 'get_file_writer', 'stdout_lock']
\ No newline at end of file
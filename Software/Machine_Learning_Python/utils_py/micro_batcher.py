@@ -0,0 +1,138 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A micro-batcher: collect items submitted concurrently (e.g. by several connection threads) and hand them
+over to a batch function in groups, so a single model call can serve several tasks.
+A batch is dispatched when it reaches "max_batch_size" items, or when its oldest item waited "max_wait_sec"
+seconds, whichever comes first. Only items with the same key are batched together (e.g. the same AI model).
+The batch function runs within the active traces of the threads that submitted its items (see tracing.py).
+Usage:
+    batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait_sec=0.05)
+    future = batcher.submit(item, key)
+    result = future.result()
+    batcher.close()
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from .loggers import ENVS, error_log
+from .tracing import current_traces, use_traces
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+
+
+class MicroBatcher:
+    """
+    Group the submitted items by key and run "batch_fn" over each group on a single worker thread.
+    "batch_fn(key, items)" must return a list of results, one per item and in the same order. A result
+    that is an exception is set as the exception of its item's future. If "batch_fn" raises, all the
+    items of the batch fail with that exception.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int, max_wait_sec: float):
+        """
+        Create a new batcher and start its worker thread.
+        batch_fn - A function (key, list of items) -> list of results.
+        max_batch_size - The max number of items in a batch.
+        max_wait_sec - The max time (seconds) an item waits for more items before its batch is dispatched."""
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_sec = max(0.0, max_wait_sec)
+        self._pending = {}  # {key: [(item, future, submit time, submitter's traces)]}, in submission order.
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='MicroBatcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, item, key=None) -> Future:
+        """
+        Queue "item" for the next batch of "key" and return a Future of its result.
+        Raise RuntimeError if the batcher is closed."""
+
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The batcher is closed.')
+            self._pending.setdefault(key, []).append((item, future, time.monotonic(), current_traces()))
+            self._condition.notify()
+        return future
+
+    def close(self, wait: bool = True) -> None:
+        """Stop accepting items. The pending items are still dispatched. If "wait", wait for the worker to finish."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if wait:
+            self._worker.join()
+
+    def _run(self) -> None:
+        """The worker thread: wait for a ready batch, dispatch it, repeat until closed and empty."""
+        while True:
+            with self._condition:
+                key, batch = self._next_batch()
+                while batch is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait(timeout=self._time_to_next_deadline())
+                    key, batch = self._next_batch()
+            self._dispatch(key, batch)
+
+    def _next_batch(self) -> tuple:
+        """
+        Pop and return (key, batch) of a group that is full, expired or closed (oldest first).
+        Return (None, None) if no group is ready. The caller holds the condition."""
+
+        now = time.monotonic()
+        ready_key = None
+        oldest = None
+        for key, items in self._pending.items():
+            submit_time = items[0][2]
+            if len(items) >= self.max_batch_size or self._closed or now - submit_time >= self.max_wait_sec:
+                if oldest is None or submit_time < oldest:
+                    ready_key, oldest = key, submit_time
+        if oldest is None:
+            return None, None
+
+        items = self._pending[ready_key]
+        batch, rest = items[:self.max_batch_size], items[self.max_batch_size:]
+        if rest:
+            self._pending[ready_key] = rest
+        else:
+            del self._pending[ready_key]
+        return ready_key, batch
+
+    def _time_to_next_deadline(self) -> float | None:
+        """Return the time (seconds) until the oldest pending item expires, or None if nothing is pending."""
+        if not self._pending:
+            return None
+        oldest = min(items[0][2] for items in self._pending.values())
+        return max(0.0, oldest + self.max_wait_sec - time.monotonic())
+
+    def _dispatch(self, key, batch: list) -> None:
+        """Run "batch_fn" over the batch and resolve the items' futures."""
+        futures = [future for _, future, _, _ in batch if future.set_running_or_notify_cancel()]
+        items = [item for item, future, _, _ in batch if future in futures]
+        if not items:
+            return
+        traces = [trace for _, future, _, item_traces in batch if future in futures for trace in item_traces]
+        try:
+            with use_traces(traces):
+                results = self.batch_fn(key, items)
+            if len(results) != len(items):
+                raise RuntimeError(f'The batch function returned {len(results)} results for {len(items)} items.')
+        except Exception as exp:
+            error_log(ENVS.DEVELOPMENT, f'{script_name}: A batch of {len(items)} items (key: {key}) failed: {exp}')
+            for future in futures:
+                future.set_exception(exp)
+            return
+        for future, result in zip(futures, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+__all__ = ['MicroBatcher']
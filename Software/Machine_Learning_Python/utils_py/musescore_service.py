@@ -0,0 +1,193 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A MuseScore render service: queue midi-to-PDF jobs and render them on a pool of MuseScore instances.
+
+MuseScore takes seconds to start, and its command line renders a single file per launch, or a list of files
+with a batch job file ("-j"). So every worker thread of the pool takes the next job, gathers the jobs that
+are already queued (up to "max_jobs_per_launch"), and renders them all with a single launch. There's no
+waiting for more jobs, so a lone job is launched at once; a caller with several files submits them together
+with submit_batch(), and they are gathered whole. Up to "max_instances" launches run at once.
+The service batches the jobs of its own process only. A fork-server child (see fork_server.py) starts a
+service of its own, so the PDFs of an upload are batched when they are sent as a single "pdf_batch" job.
+A launch that runs longer than "launch_timeout_sec" + "job_timeout_sec" per job is considered hung: the
+instance is killed (the next launch is a fresh one), and the jobs it didn't render are retried once each in
+a launch of their own, so a single bad midi file doesn't fail the others.
+Usage:
+    service = MuseScoreRenderService(musescore_path, **consts["musescore_service"])
+    service.render(midi_path, pdf_path)  # Or: future = service.submit(midi_path, pdf_path)
+    futures = service.submit_batch([(midi_path, pdf_path), ...])
+    service.close()
+"""
+
+import os, sys
+import json
+import time
+import queue
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import Future
+
+from .loggers import ENVS, log, error_log
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+
+
+class RenderJob:
+    """A midi file to render into a PDF file, with the Future of its result (the PDF's path)."""
+
+    def __init__(self, midi_path: str, target_path: str):
+        self.midi_path = os.path.abspath(midi_path)
+        self.target_path = os.path.abspath(target_path)
+        self.future = Future()
+
+
+class MuseScoreRenderService:
+    """Render midi files into PDF files on a pool of MuseScore instances (see the module description)."""
+
+    def __init__(self, musescore_path: str, max_instances: int = 2, max_jobs_per_launch: int = 8,
+                 launch_timeout_sec: float = 60, job_timeout_sec: float = 30):
+        """
+        Create a new service. The worker threads start on the first job.
+        musescore_path - The path of the MuseScore executable.
+        max_instances - The max number of MuseScore instances that run at once.
+        max_jobs_per_launch - The max number of jobs a single launch renders (with a batch job file).
+        launch_timeout_sec - The time (seconds) a launch may take, on top of "job_timeout_sec" per job.
+        job_timeout_sec - The time (seconds) a single job may take."""
+        self.musescore_path = musescore_path
+        self.max_instances = max(1, max_instances)
+        self.max_jobs_per_launch = max(1, max_jobs_per_launch)
+        self.launch_timeout_sec = launch_timeout_sec
+        self.job_timeout_sec = job_timeout_sec
+        self._jobs = queue.Queue()
+        self._workers = []
+        self._running = set()  # The running MuseScore processes (killed upon close()).
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()  # Held while a batch is queued, so a worker gathers it whole.
+        self._closed = False
+        self.env = dict(os.environ)
+        if sys.platform.startswith('linux'):
+            self.env.setdefault('QT_QPA_PLATFORM', 'offscreen')  # MuseScore needs no display to render.
+
+    def submit(self, midi_path: str, target_path: str) -> Future:
+        """
+        Queue a job and return a Future of the PDF's path. The Future fails with TimeoutError if MuseScore hung,
+        or with RuntimeError if it didn't render the file. Raise RuntimeError if the service is closed."""
+        return self.submit_batch([(midi_path, target_path)])[0]
+
+    def submit_batch(self, paths: list[tuple[str, str]]) -> list[Future]:
+        """
+        Queue several jobs at once, so they are rendered together (up to "max_jobs_per_launch" per launch).
+        Return a Future of every job, in order (see submit()). Raise RuntimeError if the service is closed.
+        paths - (midi_path, target_path) pairs."""
+        jobs = [RenderJob(midi_path, target_path) for midi_path, target_path in paths]
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The render service is closed.')
+            if len(self._workers) < self.max_instances:
+                worker = threading.Thread(target=self._run, name='MuseScore-worker', daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        with self._submit_lock:
+            for job in jobs:
+                self._jobs.put(job)
+        return [job.future for job in jobs]
+
+    def render(self, midi_path: str, target_path: str) -> str:
+        """Render a midi file into "target_path" and return it. Raise upon a failure (see submit())."""
+        return self.submit(midi_path, target_path).result()
+
+    def close(self) -> None:
+        """Stop the workers and kill the running MuseScore instances. The queued jobs fail with RuntimeError."""
+        with self._lock:
+            self._closed = True
+            running = list(self._running)
+            workers_count = len(self._workers)
+        for process in running:
+            process.kill()
+        while True:
+            try:
+                self._jobs.get_nowait().future.set_exception(RuntimeError('The render service is closed.'))
+            except queue.Empty:
+                break
+        for _ in range(workers_count):
+            self._jobs.put(None)
+
+    def _run(self) -> None:
+        """A worker thread: take a job, gather the jobs that are already queued, render them, repeat."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            jobs = [job]
+            with self._submit_lock:  # Wait until a batch that's being queued is whole.
+                while len(jobs) < self.max_jobs_per_launch:
+                    try:
+                        job = self._jobs.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        self._jobs.put(None)  # Leave it for the next round.
+                        break
+                    jobs.append(job)
+            jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+            try:
+                self._render_jobs(jobs, retry=True)
+            except Exception as exp:
+                error_log(ENVS.ALL, f'{script_name}: Failed to render {len(jobs)} PDF files. Error:\n{exp}')
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.set_exception(exp)
+
+    def _render_jobs(self, jobs: list[RenderJob], retry: bool) -> None:
+        """Render the jobs with a single launch and resolve their futures. Retry the jobs of a hung launch one by one."""
+        if not jobs:
+            return
+        for job in jobs:
+            if os.path.isfile(job.target_path):
+                os.remove(job.target_path)  # So a stale file isn't mistaken for a rendered one.
+
+        with tempfile.TemporaryDirectory(prefix='musescore_jobs_') as tmp_dir:
+            if len(jobs) == 1:
+                command = [self.musescore_path, jobs[0].midi_path, '-o', jobs[0].target_path]
+            else:
+                job_file_path = os.path.join(tmp_dir, 'jobs.json')
+                with open(job_file_path, 'w', encoding='utf-8') as job_file:
+                    json.dump([{"in": job.midi_path, "out": job.target_path} for job in jobs], job_file)
+                command = [self.musescore_path, '-j', job_file_path]
+            is_hung = not self._launch(command, self.launch_timeout_sec + self.job_timeout_sec * len(jobs))
+
+        unrendered = [job for job in jobs if not os.path.isfile(job.target_path)]
+        for job in jobs:
+            if job not in unrendered:
+                job.future.set_result(job.target_path)
+        if is_hung and retry and len(jobs) > 1:
+            for job in unrendered:
+                self._render_jobs([job], retry=False)
+            return
+        for job in unrendered:
+            job.future.set_exception(TimeoutError(f'MuseScore hung while rendering "{job.midi_path}".') if is_hung else
+                                     RuntimeError(f'MuseScore did not render "{job.midi_path}".'))
+
+    def _launch(self, command: list[str], timeout_sec: float) -> bool:
+        """Run a MuseScore instance. Return True if it exited in time, or False if it hung and was killed."""
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=self.env)
+        with self._lock:
+            self._running.add(process)
+        try:
+            process.wait(timeout=timeout_sec)
+            return True
+        except subprocess.TimeoutExpired:
+            error_log(ENVS.ALL, f'{script_name}: MuseScore hung for {timeout_sec:.0f} sec. Killing the instance.')
+            process.kill()
+            process.wait()
+            return False
+        finally:
+            with self._lock:
+                self._running.discard(process)
+            log(ENVS.DEVELOPMENT, f'{script_name}: A MuseScore launch took {time.perf_counter() - start_time:.2f} sec.')
+
+
+__all__ = ['MuseScoreRenderService', 'RenderJob']
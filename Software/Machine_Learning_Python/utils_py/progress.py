@@ -0,0 +1,138 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+Progress reports of running transcriptions, for partial results (see consts["partial_results"]).
+
+While a model transcribes an audio file, it reports its progress with report_progress(): the units done out
+of the total (audio windows, chunks...), and the notes of the newly completed part, if it has them. A server
+that wants the partial results of a task wraps its transcription with track_progress(), which routes the
+reports of the audio files in the task's directory to a listener. The reports are routed by the directory
+(not by the thread), so they arrive even when the model runs on a batching thread (see ModelRegistry), but
+not from another process.
+PartialResultReporter is the listener of the servers: it adds the progress percent and the ETA, throttles the
+reports to one per "min_interval_ms" (the notes are gathered meanwhile, so none are dropped) and sends them
+as "PartialMidiData" messages, tagged with the task's id.
+When partial results are disabled, track_progress() registers nothing and report_progress() returns at once.
+Usage:
+    with track_progress(audio_dir_path, PartialResultReporter(task_id, send_fn)):
+        ...  # Transcribe.
+    # And in a model:
+    report_progress(audio_path, done, total, notes=midi_notes(midi))
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from .loggers import ENVS, error_log
+from .serialized_objects import PartialMidiData
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+enabled = consts["partial_results"]["enabled"]
+_listeners = {}  # {normalized audio directory path: listener} of the tracked tasks.
+_listeners_lock = threading.Lock()
+
+
+def _dir_key(dir_path: str) -> str:
+    """Return the key of a directory in "_listeners"."""
+    return os.path.normcase(os.path.abspath(dir_path))
+
+@contextmanager
+def track_progress(audio_dir_path: str, listener):
+    """
+    Route the progress reports of the audio files in "audio_dir_path" to "listener" within the "with" block
+    (see the module description). Does nothing if partial results are disabled.
+    listener - A callable: listener(audio_path, done, total, notes), e.g. a PartialResultReporter."""
+
+    if not enabled:
+        yield
+        return
+    key = _dir_key(audio_dir_path)
+    with _listeners_lock:
+        previous = _listeners.get(key)
+        _listeners[key] = listener
+    try:
+        yield
+    finally:
+        with _listeners_lock:
+            if previous is None:
+                _listeners.pop(key, None)
+            else:
+                _listeners[key] = previous
+
+def report_progress(audio_path: str, done: int, total: int, notes: list[list] = None) -> None:
+    """
+    Report the progress of the transcription of an audio file to the listener of its directory, if any.
+    A failure of the listener (e.g. a closed connection) is logged, and doesn't stop the transcription.
+    audio_path - The path of the audio file.
+    done - The units (windows, chunks...) that were transcribed so far.
+    total - The units of the whole file.
+    notes - (Optional) The notes of the units that were completed since the previous report (see midi_notes())."""
+
+    if not _listeners:
+        return
+    listener = _listeners.get(_dir_key(os.path.dirname(audio_path)))
+    if listener is None:
+        return
+    try:
+        listener(audio_path, done, total, notes or [])
+    except Exception as exp:
+        error_log(ENVS.ALL, f'{script_name}: Failed to report the progress of "{audio_path}". The error:\n{exp}')
+
+def has_listener(audio_path: str) -> bool:
+    """Return True if the progress of "audio_path" is tracked, so a model can skip preparing notes nobody reads."""
+    return bool(_listeners) and _dir_key(os.path.dirname(audio_path)) in _listeners
+
+def midi_notes(midi) -> list[list]:
+    """
+    Return the notes of a pretty_midi.PrettyMIDI object as [start_sec, end_sec, pitch, velocity, program]
+    lists, sorted by their start. The program of a drum note is 128."""
+    notes = [[round(note.start, 3), round(note.end, 3), note.pitch, note.velocity, 128 if instrument.is_drum else instrument.program]
+             for instrument in midi.instruments for note in instrument.notes]
+    notes.sort(key=lambda note: note[0])
+    return notes
+
+
+class PartialResultReporter:
+    """A progress listener that sends the reports of a task as throttled "PartialMidiData" messages."""
+
+    def __init__(self, task_id: str, send_fn, min_interval_ms: float = consts["partial_results"]["min_interval_ms"]):
+        """
+        Create a new reporter. The ETA of a file is measured from the creation, or from the end of the previous file.
+        task_id - The id of the task, which tags its messages.
+        send_fn - A thread-safe callable that sends a "PartialMidiData" message.
+        min_interval_ms - The min time (milliseconds) between two messages of a file. Its last report is always sent."""
+        self.task_id = task_id
+        self.send_fn = send_fn
+        self.min_interval_sec = min_interval_ms / 1000
+        self._files = {}  # {audio path: {"start": time, "sent": time, "notes": pending notes}}.
+        self._idle_since = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __call__(self, audio_path: str, done: int, total: int, notes: list[list]) -> None:
+        """Gather a progress report, and send it (with the notes gathered so far) unless throttled."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._files.setdefault(audio_path, {"start": self._idle_since, "sent": 0.0, "notes": []})
+            state["notes"].extend(notes)
+            finished = done >= total
+            if finished:
+                self._idle_since = now
+            elif now - state["sent"] < self.min_interval_sec:
+                return
+            elapsed = now - state["start"]
+            eta_sec = round(elapsed / done * (total - done), 1) if done > 0 else None
+            partial = PartialMidiData(id=self.task_id, fname=os.path.basename(audio_path),
+                                      progress=round(100 * min(done, total) / max(total, 1), 1),
+                                      eta_sec=eta_sec, notes=state["notes"])
+            state["notes"], state["sent"] = [], now
+            self.send_fn(partial)
+
+
+__all__ = ['PartialResultReporter', 'track_progress', 'report_progress', 'has_listener', 'midi_notes']
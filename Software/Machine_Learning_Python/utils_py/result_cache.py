@@ -0,0 +1,236 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A content-addressed, size-bounded, on-disk cache of generated files (e.g. the midi transcription of an
+audio file, or the PDF rendering of a midi file).
+
+An entry is a directory named by its key (a sha256 hex digest of the content and the settings that
+produced the files), with the cached files and a "meta.json" file. Entries are written to a temporary
+directory and renamed into place, so several processes can share the same cache directory. Every hit
+touches its entry, and when the cache grows beyond its size limit the least recently used entries are
+removed. Hit/miss counters are counted in memory and added to "stats.json" every "stats_flush_interval_sec",
+upon a put() and at exit (see flush_cache_stats()), so a lookup doesn't write to the disk. The file is best
+effort when several processes share the cache.
+Usage:
+    cache = ResultCache(cache_dir, max_size_bytes)
+    key = cache.make_key(ResultCache.hash_file(audio_path), ai_model, ...)
+    meta = cache.get(key)  # None upon a miss.
+    if meta: cache.copy_file(key, "midi", target_path)
+    else: cache.put(key, {"midi": midi_path}, meta={...})
+"""
+
+import os
+import json
+import hashlib
+import shutil
+import threading
+import time
+import uuid
+import atexit
+import weakref
+
+from .loggers import ENVS, log, error_log
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+meta_fname = 'meta.json'
+stats_fname = 'stats.json'
+hash_chunk_size = 1 << 20  # Read files in chunks of 1 MB while hashing.
+_caches = weakref.WeakSet()  # The open caches, whose counters are flushed at exit.
+
+
+class ResultCache:
+    """A content-addressed cache of files with LRU eviction (see the module description)."""
+
+    def __init__(self, cache_dir: str, max_size_bytes: int, log_postfix: str = '', stats_flush_interval_sec: float = 30):
+        """
+        Open (create if needed) a cache directory.
+        cache_dir - The cache directory.
+        max_size_bytes - The max total size of the cached files. The least recently used entries are removed beyond it.
+        log_postfix - A string to end every log message with (see ModelRegistry). Default: ''.
+        stats_flush_interval_sec - The min time (seconds) between two writes of the counters to the stats file."""
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.log_postfix = log_postfix
+        self.stats_flush_interval_sec = stats_flush_interval_sec
+        self._stats_lock = threading.Lock()
+        self._pending_stats = {"hits": 0, "misses": 0, "bytes_saved": 0}  # Not flushed yet.
+        self._last_flush = time.monotonic()
+        os.makedirs(cache_dir, exist_ok=True)
+        _caches.add(self)
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """Return the sha256 hex digest of a file's content."""
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(hash_chunk_size), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Return a cache key (sha256 hex digest) for the given parts (content hashes, model name, settings...)."""
+        return hashlib.sha256(json.dumps([str(part) for part in parts]).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """
+        Return the metadata of the entry of "key" and mark it as recently used, or None upon a miss.
+        Counts a hit (and its bytes) or a miss in the stats."""
+
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, meta_fname), 'r') as meta_file:
+                meta = json.load(meta_file)
+            os.utime(entry_dir)  # Recently used.
+        except (OSError, ValueError):
+            self._update_stats(misses=1)
+            return None
+        self._update_stats(hits=1, bytes_saved=meta.get("size", 0))
+        return meta
+
+    def copy_file(self, key: str, name: str, target_path: str) -> None:
+        """Copy the cached file "name" of the entry of "key" to "target_path". Raise an exception upon failure."""
+        shutil.copyfile(os.path.join(self._entry_dir(key), name), target_path)
+
+    def read_file(self, key: str, name: str) -> bytes:
+        """Return the content of the cached file "name" of the entry of "key". Raise an exception upon failure."""
+        with open(os.path.join(self._entry_dir(key), name), 'rb') as cached_file:
+            return cached_file.read()
+
+    def put(self, key: str, files: dict[str, str | bytes], meta: dict = None) -> bool:
+        """
+        Store the given files as the entry of "key" (an existing entry is kept as is), then evict the least
+        recently used entries if the cache is too large. Return True upon success. A failure is logged.
+        files - {name in the entry: source file path, or the file's content (bytes)}.
+        meta - (Optional) A json-serializable dictionary to keep with the entry (see get())."""
+
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return True
+        tmp_dir = os.path.join(self.cache_dir, f'tmp-{uuid.uuid4().hex}')
+        try:
+            os.makedirs(tmp_dir)
+            size = 0
+            for name, source in files.items():
+                if isinstance(source, bytes):
+                    with open(os.path.join(tmp_dir, name), 'wb') as cached_file:
+                        cached_file.write(source)
+                    size += len(source)
+                else:
+                    shutil.copyfile(source, os.path.join(tmp_dir, name))
+                    size += os.path.getsize(source)
+            meta = dict(meta or {}, files=list(files.keys()), size=size, created=time.time())
+            with open(os.path.join(tmp_dir, meta_fname), 'w') as meta_file:
+                json.dump(meta, meta_file)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as exp:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if os.path.isdir(entry_dir):
+                return True  # Another process stored it first.
+            error_log(ENVS.ALL, f'{script_name}: Failed to store the cache entry "{key}". The error:\n{exp}')
+            return False
+        self._evict()
+        self.flush_stats()  # Already writing.
+        return True
+
+    def stats(self) -> dict:
+        """Return the cache stats: hits, misses, hit_rate, bytes_saved, entries and size_bytes."""
+        self.flush_stats()
+        stats = self._read_stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        entries = self._list_entries()
+        stats["entries"] = len(entries)
+        stats["size_bytes"] = sum(size for _, _, size in entries)
+        return stats
+
+    def _entry_dir(self, key: str) -> str:
+        """Return the directory of the entry of "key"."""
+        return os.path.join(self.cache_dir, key)
+
+    def _list_entries(self) -> list[tuple[str, float, int]]:
+        """Return a (directory, last use time, size) tuple per entry."""
+        entries = []
+        for dir_entry in os.scandir(self.cache_dir):
+            if not dir_entry.is_dir() or dir_entry.name.startswith('tmp-'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(dir_entry.path) if f.name != meta_fname)
+                entries.append((dir_entry.path, dir_entry.stat().st_mtime, size))
+            except OSError:
+                continue  # Removed meanwhile.
+        return entries
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in "max_size_bytes"."""
+        entries = sorted(self._list_entries(), key=lambda entry: entry[1])
+        total_size = sum(size for _, _, size in entries)
+        for entry_dir, _, size in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+            log(ENVS.DEVELOPMENT, f'{script_name}: Evicted the cache entry "{os.path.basename(entry_dir)}" ' + \
+                f'({size} Bytes).' + self.log_postfix)
+
+    def _read_stats(self) -> dict:
+        """Read the stats file (zeros if it doesn't exist)."""
+        stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+        try:
+            with open(os.path.join(self.cache_dir, stats_fname), 'r') as stats_file:
+                stats.update(json.load(stats_file))
+        except (OSError, ValueError):
+            pass
+        return stats
+
+    def _update_stats(self, hits: int = 0, misses: int = 0, bytes_saved: int = 0) -> None:
+        """Add to the in-memory counters, and flush them if "stats_flush_interval_sec" passed since the last flush."""
+        with self._stats_lock:
+            self._pending_stats["hits"] += hits
+            self._pending_stats["misses"] += misses
+            self._pending_stats["bytes_saved"] += bytes_saved
+            if time.monotonic() - self._last_flush < self.stats_flush_interval_sec:
+                return
+        self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """Add the in-memory counters to the stats file (atomic replace; concurrent processes may lose a count)."""
+        with self._stats_lock:
+            self._last_flush = time.monotonic()
+            if not any(self._pending_stats.values()):
+                return
+            stats = self._read_stats()
+            for counter, value in self._pending_stats.items():
+                stats[counter] += value
+            self._pending_stats = {counter: 0 for counter in self._pending_stats}
+            tmp_path = os.path.join(self.cache_dir, f'tmp-{uuid.uuid4().hex}.json')
+            try:
+                with open(tmp_path, 'w') as stats_file:
+                    json.dump(stats, stats_file)
+                os.replace(tmp_path, os.path.join(self.cache_dir, stats_fname))
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _reset_pending_stats(self) -> None:
+        """Drop the in-memory counters (after a fork, the child's copies are the parent's to flush)."""
+        self._stats_lock = threading.Lock()
+        self._pending_stats = {counter: 0 for counter in self._pending_stats}
+
+
+def flush_cache_stats() -> None:
+    """Flush the counters of all the open caches (see ResultCache.flush_stats()). Called at exit too."""
+    for cache in list(_caches):
+        cache.flush_stats()
+
+def _reset_cache_stats_in_child() -> None:
+    """After a fork, start counting the child's own lookups from zero."""
+    for cache in list(_caches):
+        cache._reset_pending_stats()
+
+atexit.register(flush_cache_stats)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_cache_stats_in_child)
+
+
+__all__ = ['ResultCache', 'flush_cache_stats']
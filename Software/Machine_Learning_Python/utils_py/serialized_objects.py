@@ -4,8 +4,10 @@ Author: Alon Haviv, Stellar Intelligence.
 Classes that can be serialized and sent between processes using sockets.
 """
 
+import os
 import json
 import base64
+import mmap
 
 class SerializedDataClass():
     """Base class for serialized objects that can be sent in a TCP protocol as jsons."""
@@ -41,46 +43,164 @@ class SerializedDataClass():
 
 
 class TranscribedMidiData(SerializedDataClass):
-    """This class represents a transcribed midi data file, that can be serialized and sent as json."""
-    def __init__(self, code: int, fnames: list[str] = [], data: str = "", id: str = ""):
+    """
+    This class represents a transcribed midi data file, that can be serialized and sent as json.
+    The midi files can be carried in memory too ("data", see consts["midi_output"]), so the receiver doesn't 
+    have to read them from the disk."""
+    def __init__(self, code: int, fnames: list[str] = [], data: list[bytes | str] = None, id: str = "", 
+                 cache_hit: bool = False, timings: dict = None):
         """
         Create a new instance of the class.
         code - The code of the transcription process (success/failure/...).
         fnames - List of relevant file names (not whole paths).
-        data - The raw binary midi data.
-        id - An identifier for the data."""
+        data - (Optional) The raw binary midi data of the files in "fnames" (in the same order): bytes, or base64 
+               strings (json). Kept as base64 strings. Empty: the midi files are only on the disk.
+        id - An identifier for the data.
+        cache_hit - True if the midi files were served from the result cache, without inference.
+        timings - (Optional) The task's stage timings, {stage: seconds} (see utils_py/tracing.py)."""
         super().__init__(id)
         self.code = code
         self.fnames = fnames
-        self.data = ""#base64.b64encode(data).decode('ascii') ?
+        self.data = [base64.b64encode(midi).decode('ascii') if isinstance(midi, (bytes, bytearray, memoryview)) else midi 
+                     for midi in (data or [])]
+        self.cache_hit = cache_hit
+        self.timings = timings
+
+    @property
+    def midi_bytes(self) -> list[bytes]:
+        """The raw binary midi data of the files in "fnames" (decoded from "data"). Empty if it wasn't returned."""
+        return [base64.b64decode(midi) for midi in self.data]
 
     def __str__(self) -> str:
-        """Return a string representing the TranscribedMidiData object."""
+        """Return a string representing the TranscribedMidiData object (without the midi data itself)."""
         return '{' + f'"code": {self.code}' +\
             f', "fnames": {self.fnames}' +\
-            f', "data": b"{self.data[:10]}"' + ('...' if len(self.data) > 10 else '') +\
+            f', "data": <{len(self.data)} midi files, {sum(len(midi) for midi in self.data) * 3 // 4} bytes>' +\
             f', "id": {self.id}' +\
+            f', "cache_hit": {self.cache_hit}' +\
+            (f', "timings": {self.timings}' if self.timings else '') +\
            '}'
         
 
+class PartialMidiData(SerializedDataClass):
+    """
+    This class represents a partial result of a running transcription (see utils_py/progress.py), sent before 
+    the task's TranscribedMidiData, and that can be serialized and sent as json. Its "partial" field tells it 
+    apart from the final result."""
+    def __init__(self, id: str = "", fname: str = "", progress: float = 0.0, eta_sec: float = None, 
+                 notes: list[list] = None, partial: bool = True):
+        """
+        Create a new instance of the class.
+        id - The id of the task.
+        fname - The name (not the whole path) of the audio file that is transcribed.
+        progress - The percent of the audio file that was transcribed so far.
+        eta_sec - The estimated seconds to the end of the audio file's transcription. None if unknown yet.
+        notes - The notes completed since the previous partial result: [start_sec, end_sec, pitch, velocity, 
+                program] lists (the program of a drum note is 128).
+        partial - Always True."""
+        super().__init__(id)
+        self.fname = fname
+        self.progress = progress
+        self.eta_sec = eta_sec
+        self.notes = notes or []
+        self.partial = partial
+
+
 class AudioDataToTranscribe(SerializedDataClass):
-    """This class represents an audio data file to be transcribed, and that can be serialized and sent as json."""
-    def __init__(self, audio_dir_path: str, data: str = "", id: str = ""):
+    """
+    This class represents an audio data file to be transcribed, and that can be serialized and sent as json.
+    The audio payload is kept as it was received and decoded lazily, only when "data" is read: a base64 
+    string (json) is decoded once, raw bytes (e.g. a socket frame's body) are used as they are, and a file 
+    reference ("data_path", e.g. a file under /dev/shm) is memory-mapped. A task that only sends 
+    "audio_dir_path" pays nothing."""
+    def __init__(self, audio_dir_path: str, data: str = "", id: str = "", data_path: str = "", 
+                 ai_model: str = "", instruments_mode: int = None, deadline_ms: float = None):
         """
         Create a new instance of the class.
         audio_dir_path - The path for the audio file.
-        data - The raw binary audio data.
-        id - An identifier for the data."""
+        data - The binary audio data: a base64 string (json), or a bytes-like object with the raw bytes.
+        id - An identifier for the data.
+        data_path - (Optional) A path to a file with the raw audio data, instead of "data".
+        ai_model - (Optional) The AI model to transcribe with (a key in consts["models_arguments"]). 
+            Empty: the transcriber's default.
+        instruments_mode - (Optional) How to treat the musical instruments. None: the transcriber's default.
+        deadline_ms - (Optional) The time (milliseconds since the epoch, like JavaScript's Date.now()) after which 
+            the result is of no use, so the transcription stops (see utils_py/cancellation.py). None: no deadline."""
         super().__init__(id)
         self.audio_dir_path = audio_dir_path
-        self.data = base64.b64decode(data)
+        self.data_path = data_path
+        self.ai_model = ai_model
+        self.instruments_mode = instruments_mode
+        self.deadline_ms = deadline_ms
+        self._raw_data = data  # As received. See the "data" property.
+        self._data = None  # The decoded data (cached).
+        self._mmap = None  # The memory map of "data_path" (if it was read).
+
+    @property
+    def data(self) -> bytes | memoryview:
+        """The raw binary audio data (decoded on the first access). Empty if no data was sent."""
+        if self._data is None:
+            if isinstance(self._raw_data, (bytes, bytearray, memoryview)):
+                self._data = self._raw_data
+            elif self._raw_data:
+                self._data = base64.b64decode(self._raw_data)
+            elif self.data_path:
+                self._data = self._map_data_file()
+            else:
+                self._data = b''
+        return self._data
+
+    @property
+    def data_size(self) -> int:
+        """The size (bytes) of the raw binary audio data, without decoding it."""
+        if self._data is not None:
+            return memoryview(self._data).nbytes
+        if isinstance(self._raw_data, (bytes, bytearray, memoryview)):
+            return memoryview(self._raw_data).nbytes
+        if self._raw_data:
+            return len(self._raw_data) * 3 // 4 - self._raw_data[-2:].count('=')  # base64 length.
+        if self.data_path:
+            return os.path.getsize(self.data_path)
+        return 0
+
+    def release(self) -> None:
+        """Drop the decoded data and close the memory map of "data_path" (if any)."""
+        if isinstance(self._data, memoryview) and self._mmap is not None:
+            self._data.release()
+        self._data = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # A view of the data is still in use. The map is closed when it's garbage collected.
+            self._mmap = None
+
+    def get_dict(self) -> dict:
+        """Return a dictionary of the object's serializable fields (the data as base64, only if it was sent)."""
+        data = self._raw_data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = base64.b64encode(data).decode('ascii')
+        return {"id": self.id, "audio_dir_path": self.audio_dir_path, "data": data, "data_path": self.data_path, 
+                "ai_model": self.ai_model, "instruments_mode": self.instruments_mode, "deadline_ms": self.deadline_ms}
+
+    def _map_data_file(self) -> memoryview:
+        """Memory-map "data_path" (read only) and return a view of it. An empty file gives an empty view."""
+        if os.path.getsize(self.data_path) == 0:
+            return memoryview(b'')
+        with open(self.data_path, 'rb') as data_file:
+            self._mmap = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
 
     def __str__(self) -> str:
-        """Return a string representing the AudioDataToTranscribe object."""
+        """Return a string representing the AudioDataToTranscribe object (without decoding the data)."""
         return '{' + f'"audio_dir_path": {self.audio_dir_path}' +\
-            f', "data": b"{self.data[:10]}"' + ('...' if len(self.data) > 10 else '') +\
+            f', "data": <{self.data_size} bytes>' +\
+            (f', "data_path": {self.data_path}' if self.data_path else '') +\
+            (f', "ai_model": {self.ai_model}' if self.ai_model else '') +\
+            (f', "instruments_mode": {self.instruments_mode}' if self.instruments_mode is not None else '') +\
+            (f', "deadline_ms": {self.deadline_ms}' if self.deadline_ms is not None else '') +\
             f', "id": {self.id}' +\
            '}'
 
 
-__all__ = ['SerializedDataClass', 'TranscribedMidiData', 'AudioDataToTranscribe']
+__all__ = ['SerializedDataClass', 'TranscribedMidiData', 'PartialMidiData', 'AudioDataToTranscribe']
@@ -0,0 +1,125 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A length-prefixed, binary framing for the socket protocol.
+
+Each frame is a fixed-size header, followed by a JSON metadata part and a raw binary body:
+    | magic (4 bytes) | metadata length (uint32) | body length (uint64) | metadata (UTF-8 JSON) | body (raw bytes) |
+The header is in network byte order. The metadata is a JSON object with a "type" field (see FRAME_TYPES),
+and the body carries the raw audio/midi bytes, so it never goes through base64 or a UTF-8 decode.
+Since every frame has a known length, the same connection can carry many requests, responses and
+keep-alive messages. The frames are read into pre-sized buffers with recv_into(), so the body is copied
+only once, from the socket into its buffer.
+
+A legacy (JSON until EOF) client is told apart by the magic, which can't start a JSON message.
+"""
+
+import json
+import socket
+import struct
+import threading
+import time
+
+FRAME_MAGIC = b'MTF1'  # "Music Transcription Frame", version 1.
+FRAME_HEADER = struct.Struct('!4sIQ')  # magic, metadata length, body length.
+
+# The frame types (the "type" field of the metadata):
+FRAME_TASK = 'task'  # A request to transcribe. Metadata: AudioDataToTranscribe fields. Body: the audio (optional).
+FRAME_RESULT = 'result'  # A response. Metadata: TranscribedMidiData fields. Body: the midi (optional).
+FRAME_PARTIAL = 'partial'  # A partial result while a task is running. Metadata: PartialMidiData fields. No body.
+FRAME_KEEP_ALIVE = 'keep_alive'  # A heartbeat while a task is running. No body.
+FRAME_CANCEL = 'cancel'  # Cancel a task that wasn't answered yet. Metadata: its "id". No body.
+FRAME_CLOSE = 'close'  # The client has no more requests. No body.
+FRAME_TYPES = (FRAME_TASK, FRAME_RESULT, FRAME_PARTIAL, FRAME_KEEP_ALIVE, FRAME_CANCEL, FRAME_CLOSE)
+
+
+class FramedConnection:
+    """A socket connection that sends and receives frames (see the module description). Sending is thread-safe."""
+
+    def __init__(self, sock: socket.SocketType, max_frame_size: int):
+        """
+        Wrap a connected socket.
+        sock - A connected socket (e.g. from socket.accept()).
+        max_frame_size - The max size (bytes) of an incoming frame's metadata and body together."""
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self._send_lock = threading.Lock()
+
+    def send_frame(self, meta: dict, body=b'') -> None:
+        """
+        Send a single frame.
+        meta - The metadata (a JSON-serializable dictionary with a "type" field).
+        body - The raw binary body (any bytes-like object). Default: empty."""
+
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        body_len = memoryview(body).nbytes
+        header = FRAME_HEADER.pack(FRAME_MAGIC, len(meta_bytes), body_len)
+        with self._send_lock:
+            self.sock.sendall(header + meta_bytes)
+            if body_len > 0:
+                self.sock.sendall(body)  # Not concatenated, to avoid copying a large body.
+
+    def recv_frame(self) -> tuple[dict, memoryview] | None:
+        """
+        Receive a single frame and return its (metadata dictionary, body) pair. The body is a memoryview
+        of the frame's own buffer (no extra copies).
+        Return None if the peer closed the connection between frames.
+        Raise an exception upon a malformed or a too long frame, or if the connection closed mid-frame."""
+
+        header = bytearray(FRAME_HEADER.size)
+        if not self._recv_exactly_into(memoryview(header), allow_eof=True):
+            return None
+
+        magic, meta_len, body_len = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC:
+            raise ValueError(f'Invalid frame magic: {bytes(magic)}')
+        if meta_len + body_len > self.max_frame_size:
+            # Prevent memory abuse, DoS attack or corrupted peer.
+            raise RuntimeError(f'The incoming frame is too long ({meta_len + body_len} > {self.max_frame_size} Bytes).')
+
+        meta_buffer = bytearray(meta_len)
+        self._recv_exactly_into(memoryview(meta_buffer))
+        meta = json.loads(meta_buffer.decode('utf-8'))
+        if not isinstance(meta, dict):
+            raise ValueError('The frame metadata must be a JSON object.')
+
+        body_view = memoryview(bytearray(body_len))
+        self._recv_exactly_into(body_view)
+        return meta, body_view
+
+    def _recv_exactly_into(self, view: memoryview, allow_eof: bool = False) -> bool:
+        """
+        Fill "view" completely from the socket.
+        Return False if the peer closed the connection before the first byte and "allow_eof" is True.
+        Raise ConnectionError if the connection closed in the middle."""
+
+        received = 0
+        while received < len(view):
+            n = self.sock.recv_into(view[received:])
+            if n == 0:
+                if received == 0 and allow_eof:
+                    return False
+                raise ConnectionError(f'The connection closed in the middle of a frame ({received}/{len(view)} Bytes).')
+            received += n
+        return True
+
+
+def is_framed_connection(sock: socket.SocketType) -> bool:
+    """
+    Peek (without consuming) at the first bytes sent over "sock" and return True if they are a frame magic,
+    or False if it's a legacy (JSON until EOF) client. Blocks until enough bytes arrive or the peer closes."""
+
+    peeked = b''
+    while len(peeked) < len(FRAME_MAGIC):
+        peeked = sock.recv(len(FRAME_MAGIC), socket.MSG_PEEK)
+        if not peeked:
+            return False
+        if not FRAME_MAGIC.startswith(peeked):
+            return False
+        if len(peeked) < len(FRAME_MAGIC):
+            time.sleep(0.001)  # Let the rest of the magic arrive instead of spinning on MSG_PEEK.
+    return True
+
+
+__all__ = ['FramedConnection', 'is_framed_connection', 'FRAME_MAGIC', 'FRAME_HEADER', 'FRAME_TYPES',
+           'FRAME_TASK', 'FRAME_RESULT', 'FRAME_PARTIAL', 'FRAME_KEEP_ALIVE', 'FRAME_CANCEL', 'FRAME_CLOSE']
@@ -0,0 +1,168 @@
+"""
+Author: Alon Haviv, Stellar Intelligence.
+
+A lightweight tracing layer: per-task stage timings across the pipeline (audio decode, resample, inference,
+midi write, MuseScore render, add_text_to_pdf, page render...), written as JSON lines so the bottleneck of a
+request can be found, and the p50/p95 of every stage tracked over time (see benchmarks/trace_report.py).
+
+A trace is opened per task id (trace_tasks()), and every span() that runs within it (on the same thread)
+adds its duration to the trace's stage of the same name. A span within several traces (e.g. a model call
+that serves a batch of tasks, or a nested trace_tasks() block) is added to all of them. When the traces are
+closed, each one is appended to consts["tracing"]["trace_file"] as a json line:
+    {"id": str, "process": str, "timestamp": str, "total_sec": float, "stages": {stage: seconds}, ...meta}
+The lines are written by a background writer that rotates the file by size, like the log files (see
+loggers.get_file_writer() and consts["tracing"]: "max_file_size_MB", "backup_count").
+The active traces are a contextvar, so they don't follow the work to another thread: a span on a thread that
+was handed the work (a worker, a connection or a batching thread) records nothing, unless the traces are
+passed along explicitly: current_traces() on the submitting thread, and use_traces() around the work (as
+MicroBatcher does for its batches).
+Tracing is configured by consts["tracing"], and it's off by default. When it's disabled, span() returns a
+shared no-op object and trace_tasks() yields no traces, so the instrumented code pays almost nothing.
+Usage:
+    with trace_tasks([task_id], process=script_name) as traces:
+        with span("inference"):
+            ...
+    timings = traces[task_id].stages if traces else None
+"""
+
+import os
+import json
+import time
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+from .loggers import ENVS, error_log, get_file_writer
+
+solutionBasePath = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+with open(os.path.join(solutionBasePath, 'Consts.json'), 'r') as consts_file:
+    consts = json.load(consts_file)
+
+script_name = os.path.basename(__file__)  # Will be usefull for logging.
+enabled = consts["tracing"]["enabled"]
+trace_file_path = os.path.normpath(os.path.join(solutionBasePath, consts["tracing"]["trace_file"]))
+# The trace file is written like the log files, with its own size limit:
+trace_file_settings = {**consts["file_logging"], "max_file_size_MB": consts["tracing"]["max_file_size_MB"],
+                       "backup_count": consts["tracing"]["backup_count"]}
+_active_traces = contextvars.ContextVar('active_traces', default=())  # The traces the current spans record into.
+
+
+class Trace:
+    """The stage timings of a single task."""
+
+    def __init__(self, id: str, process: str = '', meta: dict = None):
+        """
+        Open a new trace.
+        id - The task's id.
+        process - The name of the process (script) that traced the task.
+        meta - (Optional) Extra json-serializable fields for the trace's line (e.g. the batch size)."""
+        self.id = id
+        self.process = process
+        self.meta = meta or {}
+        self.stages = {}  # {stage name: total seconds}.
+        self.start_time = time.perf_counter()
+
+    def add(self, stage: str, seconds: float) -> None:
+        """Add "seconds" to the stage."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def to_dict(self) -> dict:
+        """Return the trace as a json-serializable dictionary (see the module description)."""
+        return {"id": self.id, "process": self.process, "timestamp": datetime.now().isoformat(timespec='milliseconds'),
+                "total_sec": round(time.perf_counter() - self.start_time, 6),
+                "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()}, **self.meta}
+
+
+class _Span:
+    """A timer of a stage, which adds its duration to the active traces."""
+    __slots__ = ('name', 'traces', 'start_time')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.traces = _active_traces.get()
+        if self.traces:
+            self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.traces:
+            seconds = time.perf_counter() - self.start_time
+            for trace in self.traces:
+                trace.add(self.name, seconds)
+        return False
+
+
+class _NoopSpan:
+    """The span of a disabled tracing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_noop_span = _NoopSpan()
+
+
+def span(name: str):
+    """Return a context manager that times the stage "name" in the active traces (see the module description)."""
+    return _Span(name) if enabled else _noop_span
+
+@contextmanager
+def trace_tasks(ids: list[str], process: str = '', meta: dict = None):
+    """
+    Open a trace per task id, add them to the active traces of the spans within the "with" block (the traces 
+    of an enclosing block stay active too) and yield them as {id: Trace} ({} if tracing is disabled). At the 
+    end of the block, write them to the trace file.
+    ids - The ids of the tasks that the code in the block serves.
+    process - The name of the process (script) that traces the tasks.
+    meta - (Optional) Extra fields for the traces' lines."""
+
+    if not enabled:
+        yield {}
+        return
+    traces = {id: Trace(id, process, meta) for id in ids}
+    token = _active_traces.set(_active_traces.get() + tuple(traces.values()))
+    try:
+        yield traces
+    finally:
+        _active_traces.reset(token)
+        write_traces(list(traces.values()))
+
+def current_traces() -> tuple:
+    """Return the active traces of the current thread, to hand them over to another thread (see use_traces())."""
+    return _active_traces.get()
+
+@contextmanager
+def use_traces(traces):
+    """
+    Add "traces" (e.g. the current_traces() of the threads that submitted the work) to the active traces of the
+    spans within the "with" block. Unlike trace_tasks(), the traces aren't written at the end of the block."""
+
+    active = _active_traces.get()
+    added = tuple(trace for trace in dict.fromkeys(traces) if trace not in active)
+    if not added:
+        yield
+        return
+    token = _active_traces.set(active + added)
+    try:
+        yield
+    finally:
+        _active_traces.reset(token)
+
+def write_traces(traces: list[Trace]) -> None:
+    """Queue the traces to the trace file's writer, a json line each. A failure is logged."""
+    if not traces:
+        return
+    try:
+        writer = get_file_writer(trace_file_path, trace_file_settings)
+        for trace in traces:
+            writer.write(None, json.dumps(trace.to_dict()))
+    except OSError as exp:
+        error_log(ENVS.ALL, f'{script_name}: Failed to write to the trace file "{trace_file_path}". The error:\n{exp}')
+
+
+__all__ = ['Trace', 'span', 'trace_tasks', 'current_traces', 'use_traces', 'write_traces']
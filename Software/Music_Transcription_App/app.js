@@ -91,3 +91,14 @@ var server = app.listen(app.get('port'), app.get('host'), function () {
     debug('Music Transcription server listening on port ' + server.address().port);
     myLoggers.log(ENVS.ALL, 'Music Transcription server listening on port ' + server.address().port);
 });
+
+// Shut down gracefully: stop accepting uploads, let the python transcriber daemons finish their tasks, then exit.
+const fileController = require(path.join(__dirname, 'controllers', 'file_controller_stdio'));
+for (const signal of ['SIGINT', 'SIGTERM']) {
+    process.once(signal, async () => {
+        myLoggers.log(ENVS.ALL, `Received ${signal}. Draining the transcriber daemons and shutting down.`);
+        server.close();
+        await fileController.drainTranscriberDaemons();
+        process.exit(0);
+    });
+}
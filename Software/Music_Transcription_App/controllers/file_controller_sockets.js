@@ -311,10 +311,11 @@ function transcribeToMidi(audioFile, audioDirPath) {
         client.connect(consts.py_converter_port, consts.py_converter_host, () => {
             myLoggers.log(ENVS.DEVELOPMENT, `${currFilename} side: Client socket is connected to the python transcriber side!`);
 
-            // According to the AudioDataToTranscribe class in serialized_objects.py:
+            // According to the AudioDataToTranscribe class in serialized_objects.py. The audio is 
+            // sent only if it isn't saved in audioDirPath (the transcriber reads it from there):
             var dataToSend = {
                 audio_dir_path: audioDirPath,
-                data: audioFile.buffer.toString("base64")
+                data: consts["save_audio_file"] ? "" : audioFile.buffer.toString("base64")
             };
             // Send the data to the server (transcribe.py):
             client.write(JSON.stringify(dataToSend), () => {
@@ -22,6 +22,7 @@ const uploadAudioDirPath = path.join(solutionBasePath, consts.uploadAudioDir);
 const pythonTranscriberPath = path.join(solutionBasePath, consts['pythonNoteConverterPath']);
 const pythonPDFGeneratorPath = path.join(solutionBasePath, consts['pythonPDFGeneratorPath']);
 const pythonImageGeneratorPath = path.join(solutionBasePath, consts['pythonImageGeneratorPath']);
+const pythonForkServerPath = path.join(solutionBasePath, consts['pythonForkServerPath']);
 // Set up multer for file upload handling
 const upload = multer();
 
@@ -31,6 +32,14 @@ const jDataFileName = consts["json_data_file_name"];
 // Multer upload middleware is set to upload any audio input file:
 const upload_middleware = upload.any('audio_input');
 
+let forkServer;  // The python fork-server (see consts.fork_server and ForkServerClient), spawned on the first job.
+// The long-lived transcriber processes (see consts.transcriber_daemon), one per instruments option:
+const transcriberDaemons = new Map();  // {instrumentOptions -> TranscriberDaemon}
+// The progress of the uploads that are being converted, for the client to poll (see get_upload_progress):
+const uploadProgress = new Map();  // {upload id -> {files, file, current: {name, progress, eta_sec, notes}}}
+// The progress objects ("current" above) of the running transcription tasks, updated by their partial results:
+const taskProgress = new Map();  // {task id -> {name, progress, eta_sec, notes}}
+
 /**
  * This class represents a task of transcribing an audio file into midi.
  * The task object tracs the results of the transcription, with its Promise' resolver,
@@ -53,6 +62,242 @@ class TranscribeTask {
 }
 
 
+/**
+ * This class represents a long-lived python transcriber process (transcribe_stdio.py in daemon mode), 
+ * which serves the upload batches over time, so they don't pay for the Python startup, the AI libraries' 
+ * imports and the model load. The daemon is pinged periodically and killed if it stops answering, and 
+ * when it exits its pending tasks are rejected at once. See getTranscriberDaemon().
+ * */
+class TranscriberDaemon {
+    /**
+     * Spawn a new transcriber daemon.
+     * @param {number} instrumentOptions Indicates the type and number of musical instruments in the audio. See consts.instruments_options.
+     */
+    constructor(instrumentOptions) {
+        this.instrumentOptions = instrumentOptions;
+        this.isAlive = { 'isAlive': false };  // Keep tracking on whether or not the process is still running.
+        this.lastPong = Date.now();
+        this.pingTimer = undefined;
+        const spawnTime = Date.now();
+
+        // Resolved when the daemon is ready (its AI model is warm), rejected if it exits before:
+        this.ready = new Promise((resolve, reject) => {
+            this._resolveReady = resolve;
+            this._rejectReady = reject;
+        });
+        this.ready.catch(() => { });  // Handled by the awaiting uploads.
+
+        const { handleTranscriptionResponse, pendingTasks } = handleTranscriptionResponse_wrapper({
+            onReady: () => {
+                myLoggers.log(ENVS.ALL, `${currFilename}: The python transcriber daemon is ready. Cold start (spawn to ready): ${Date.now() - spawnTime} ms.`);
+                this.lastPong = Date.now();
+                this.pingTimer = setInterval(() => this.ping(), consts.transcriber_daemon.ping_interval_ms);
+                this.pingTimer.unref();
+                this._resolveReady(this);
+            },
+            onControl: (controlMsg) => {
+                if (controlMsg.control === "pong")
+                    this.lastPong = Date.now();
+                myLoggers.log(ENVS.DEVELOPMENT, `${currFilename}: The python transcriber daemon sent: ${JSON.stringify(controlMsg)}`);
+            },
+            onPartial: recordPartialResult
+        });
+        this.pendingTasks = pendingTasks;
+        this.process = spawnChildProcess_sync(pythonTranscriberPath, launchCommand = 'python',
+            args = [instrumentOptions, '--daemon'], isAlive = this.isAlive, stdoutCallback = handleTranscriptionResponse);
+
+        this.process.on('close', () => {
+            clearInterval(this.pingTimer);
+            if (transcriberDaemons.get(instrumentOptions) === this)
+                transcriberDaemons.delete(instrumentOptions);
+            this._rejectReady(new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
+                `${currFilename}: The python transcriber daemon exited before it was ready.`));
+            // Reject the tasks it didn't finish now, instead of waiting for their timeouts:
+            for (const [taskId, task] of pendingTasks) {
+                clearTimeout(task.timer);
+                task.rejecter(new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
+                    `${currFilename}: The python transcriber daemon exited before finishing task \"${taskId}\".`));
+            }
+            pendingTasks.clear();
+        });
+    }
+
+    /**
+     * Send a "ping" control message. Kill the daemon if it didn't answer the previous pings for too long 
+     * (the next upload spawns a new one).
+     */
+    ping() {
+        if (Date.now() - this.lastPong > consts.transcriber_daemon.ping_timeout_ms) {
+            myLoggers.errorLog(ENVS.ALL, `${currFilename}: The python transcriber daemon stopped answering pings. Killing it.`);
+            this.process.kill();
+            return;
+        }
+        if (this.isAlive.isAlive)
+            this.process.stdin.write(JSON.stringify({ control: "ping", id: String(Date.now()) }) + "\n");
+    }
+
+    /**
+     * Ask the daemon to finish its pending tasks and exit ("drain" control message). 
+     * Return a Promise that resolves when it exits, or after consts.transcriber_daemon.drain_timeout_ms (then it's killed).
+     */
+    drain() {
+        return new Promise((resolve) => {
+            if (!this.isAlive.isAlive)
+                return resolve();
+            const timer = setTimeout(() => {
+                this.process.kill();
+                resolve();
+            }, consts.transcriber_daemon.drain_timeout_ms);
+            this.process.once('close', () => {
+                clearTimeout(timer);
+                resolve();
+            });
+            this.process.stdin.write(JSON.stringify({ control: "drain" }) + "\n");
+        });
+    }
+}
+
+/**
+ * Return a Promise of a ready TranscriberDaemon for the given instruments option. Spawn it if there's no 
+ * running daemon for this option. Rejects with a "SpawnProcessError" if the daemon exits before it's ready.
+ * @param {number} instrumentOptions Indicates the type and number of musical instruments in the audio. See consts.instruments_options.
+ */
+function getTranscriberDaemon(instrumentOptions) {
+    let daemon = transcriberDaemons.get(instrumentOptions);
+    if (!daemon || !daemon.isAlive.isAlive) {
+        daemon = new TranscriberDaemon(instrumentOptions);
+        transcriberDaemons.set(instrumentOptions, daemon);
+    }
+    return daemon.ready;
+}
+
+/**
+ * This class represents the python fork-server (fork_server.py), which imports the heavy python modules 
+ * once and forks a pre-warmed child per PDF/image job, instead of launching a new interpreter per job.
+ * A job is sent as a json line, and its response is a data message with the job's id and result code.
+ * */
+class ForkServerClient {
+    constructor() {
+        this.isAlive = { 'isAlive': false };  // Keep tracking on whether or not the process is still running.
+        this.pendingJobs = new Map();  // {id -> {resolve, reject, timer}}
+        this.nextJobId = 0;
+        let stdoutData = '';
+        const progName = path.basename(pythonForkServerPath);
+
+        this.ready = new Promise((resolve, reject) => {
+            this._resolveReady = resolve;
+            this._rejectReady = reject;
+        });
+        this.ready.catch(() => { });  // Handled by the awaiting jobs.
+
+        // The children's logs share the STDOUT with the responses, so it's read line by line:
+        this.process = spawnChildProcess_sync(pythonForkServerPath, launchCommand = 'python', args = [],
+            isAlive = this.isAlive, stdoutCallback = (data) => {
+                stdoutData += data.toString('utf8').replace(/\r\n/g, '\n');  // The replace() ensures OS agnostic.
+                const lines = stdoutData.split('\n');
+                stdoutData = lines.pop();
+                for (const line of lines) {
+                    if (line.startsWith(consts["STDIO_DATA_MSG_PREFIX"]) && line.endsWith(consts["STDIO_MSG_POSTFIX"])) {
+                        let response;
+                        try {
+                            response = JSON.parse(line.slice(consts["STDIO_DATA_MSG_PREFIX"].length, -consts["STDIO_MSG_POSTFIX"].length));
+                        } catch (err) {
+                            myLoggers.errorLog(ENVS.ALL, `${progName} process sent an invalid response: ${line}`);
+                            continue;
+                        }
+                        const job = this.pendingJobs.get(response.id);
+                        if (job) {
+                            this.pendingJobs.delete(response.id);
+                            clearTimeout(job.timer);
+                            job.resolve(response);
+                        }
+                    }
+                    else if (line) {
+                        myLoggers.log(ENVS.DEVELOPMENT, `${progName} process stdout: ${line}`);
+                        if (line.startsWith(consts["server_is_ready_msg"]))
+                            this._resolveReady(this);
+                    }
+                }
+            });
+
+        this.process.on('close', () => {
+            if (forkServer === this)
+                forkServer = undefined;
+            const error = new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
+                `${currFilename}: The python fork-server exited.`);
+            this._rejectReady(error);
+            for (const job of this.pendingJobs.values()) {
+                clearTimeout(job.timer);
+                job.reject(error);
+            }
+            this.pendingJobs.clear();
+        });
+    }
+
+    /**
+     * Run a job in a forked child. Return a Promise of its response ({id, code, fnames}). It rejects with a 
+     * "SpawnProcessError" if no response arrives within consts.fork_server.client_timeout_sec (the server kills a 
+     * job after "job_timeout_sec", but a job may wait for a free child first).
+     * @param {string} job The job: "pdf", "pdf_batch", "image", "artifacts" or "transcribe" (see fork_server.py).
+     * @param {string[]} jobArgs The job's arguments.
+     */
+    run(job, jobArgs) {
+        return new Promise((resolve, reject) => {
+            const id = String(this.nextJobId++);
+            const timer = setTimeout(() => {
+                this.pendingJobs.delete(id);
+                reject(new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
+                    `${currFilename}: The forked "${job}" job (id=${id}) got no response in time.`));
+            }, consts["fork_server"]["client_timeout_sec"] * 1000);
+            this.pendingJobs.set(id, { resolve, reject, timer });
+            this.process.stdin.write(JSON.stringify({ id: id, job: job, args: jobArgs }) + "\n");
+        });
+    }
+}
+
+/**
+ * Run a python job in a child of the fork-server (spawn the server if it isn't running).
+ * Return a Promise that resolves on a success with the job's response, or rejects with a "SpawnProcessError".
+ * @param {string} job The job: "pdf", "pdf_batch", "image", "artifacts" or "transcribe" (see fork_server.py).
+ * @param {string[]} jobArgs The job's arguments.
+ * @param {boolean} allowPartial (Optional) Resolve on a partial success too (consts.convertion_partial_success), 
+ * e.g. of a batch job whose response has the code of every file.
+ */
+async function runForkedJob(job, jobArgs, allowPartial = false) {
+    if (!forkServer || !forkServer.isAlive.isAlive)
+        forkServer = new ForkServerClient();
+    const server = await forkServer.ready;
+    const response = await server.run(job, jobArgs);
+    if (allowPartial && response.code === consts['convertion_partial_success'])
+        return response;
+    if (response.code !== consts['convertion_success'])
+        throw new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
+            `The forked "${job}" job failed with the code: ${response.code}`);
+    return response;
+}
+
+/**
+ * Record a partial result of a running transcription task (see consts.partial_results): its progress, ETA and 
+ * the notes transcribed since the previous one, for the client that polls its upload's progress.
+ * @param {object} partialMsg The partial result, in the format of "PartialMidiData" class (see serialized_objects.py).
+ */
+function recordPartialResult(partialMsg) {
+    const progress = taskProgress.get(partialMsg.id);
+    if (!progress)
+        return;  // Not tracked (an upload without an id), or already finished.
+    progress.progress = partialMsg.progress;
+    progress.eta_sec = partialMsg.eta_sec;
+    if (Array.isArray(partialMsg.notes))
+        progress.notes.push(...partialMsg.notes);
+}
+
+/**
+ * Drain all the transcriber daemons (see TranscriberDaemon.drain()), e.g. when the server shuts down.
+ * Return a Promise that resolves when they all exited.
+ */
+function drainTranscriberDaemons() {
+    return Promise.all([...transcriberDaemons.values()].map((daemon) => daemon.drain()));
+}
 
 /**
  * Send an image data file whose ID is specified in the URL as req.params.id.
@@ -131,6 +376,28 @@ function send_data_response(dataPath, res) {
     });
 }
 
+/**
+ * Send the progress of the upload whose ID is specified in the URL as req.params.id (sent by the client with 
+ * its files as "uploadId"), while it's converted: the number of files, the index of the file being transcribed 
+ * and its progress {name, progress (percent), eta_sec, notes}. The notes are [start_sec, end_sec, pitch, velocity, 
+ * program] lists, starting from the query's "notes_since" index when the query's "file" is the current file.
+ * Respond with consts.status_codes.data_removed_code if the upload isn't being converted.
+ * @param {any} req - A web request object.
+ * @param {any} res - A web response object.
+ */
+const get_upload_progress = (req, res) => {
+    const upload = uploadProgress.get(req.params.id);
+    if (!upload)
+        return res.status(consts.status_codes.data_removed_code).send();
+    const current = upload.current;
+    const notesSince = (Number(req.query.file) === upload.file) ? (parseInt(req.query.notes_since) || 0) : 0;
+    res.json({
+        files: upload.files,
+        file: upload.file,
+        current: current && { name: current.name, progress: current.progress, eta_sec: current.eta_sec, notes: current.notes.slice(notesSince) }
+    });
+}
+
 /**
  * Handle posting of audio files and their convertion to PDF notes sheet files.
  * Get an audio file or files (in the request), generate a PDF notes sheet and 
@@ -139,12 +406,14 @@ function send_data_response(dataPath, res) {
  * as a response.
  * Even if not all the files are legal or converted successfuly, still send a 
  * success. Only if all of them failed send a proper failure code.
+ * An optional "uploadId" field lets the client poll the progress meanwhile (see get_upload_progress).
  * @param {any} req - A web request object.
  * @param {any} res - A web response object.
  */
 const post_audio_and_convert = async (req, res) => {
     let files = req.files;  // File. The field "files" comes from the multer.
     let instrumentOptions = req.body.instrumentOptions;
+    const uploadId = /^[\w-]{1,64}$/.test(req.body.uploadId || '') ? req.body.uploadId : undefined;
     var idArr = [];  // The IDs for each file.
     var nameArr = [];  // The original basenames for each file.
     let errorCodesArr = [];  // Tracking the convertion errors.
@@ -168,10 +437,13 @@ const post_audio_and_convert = async (req, res) => {
 
     try {
         // Main loop: Scan each file, convert and save it and all the results to disc:
-        await convert_files_loop(files, idArr, nameArr, errorCodesArr, instrumentOptions);
+        await convert_files_loop(files, idArr, nameArr, errorCodesArr, instrumentOptions, uploadId);
     } catch (err) {
         res.status(consts["status_codes"]["internal_server_error_code"]).send();
         return;
+    } finally {
+        if (uploadId)
+            uploadProgress.delete(uploadId);
     }
 
     const convertionSuccessRateStr = '(' + idArr.length + '/' + files.length + ').';
@@ -198,25 +470,46 @@ const post_audio_and_convert = async (req, res) => {
  * @param {string[]} nameArr Array of file names (strings).
  * @param {number[]} errorCodesArr Array of potential error codes (ints) that may occure in the process (one per file).
  * @param {number} instrumentOptions Indicates the type and number of musical instruments in the audio. See consts.instruments_options.
+ * @param {string} uploadId (Optional) An ID to track the upload's progress with (see get_upload_progress).
  */
-async function convert_files_loop(files, idArr, nameArr, errorCodesArr, instrumentOptions) {
+async function convert_files_loop(files, idArr, nameArr, errorCodesArr, instrumentOptions, uploadId = undefined) {
     // Spawn the AI convertor python process here so we don't have to launch the program a new for every 
     // file, and with a different port. Instead, we do it once for all the files, and handle each file via
     // a different client - socket connection.
+    // With consts.transcriber_daemon.enabled, a long-lived process is reused by all the uploads instead.
+    const useDaemon = consts.transcriber_daemon.enabled;
     let pythonNotesConvertor;  // The process.
     let processIsAlive = { 'isAlive': false };  // Keep tracking on whether or not the process is still running.
-    const { handleTranscriptionResponse, pendingTasks } = handleTranscriptionResponse_wrapper();
-    try {
-        pythonNotesConvertor = spawnChildProcess_sync(pythonTranscriberPath, launchCommand = 'python',
-            args = [instrumentOptions], isAlive = processIsAlive, stdoutCallback = handleTranscriptionResponse);
-    } catch (err) {
-        // It might be possible for the process to report an error, but for some
-        // reason not getting teminated by itself.
-        if (processIsAlive.isAlive)  // In case it's still alive somehow.
-            pythonNotesConvertor.kill();
-        throw err;
+    let pendingTasks;  // A "Map" object (id -> TranscribeTask) to track the transcription tasks.
+    if (useDaemon) {
+        const daemon = await getTranscriberDaemon(instrumentOptions);
+        pythonNotesConvertor = daemon.process;
+        processIsAlive = daemon.isAlive;
+        pendingTasks = daemon.pendingTasks;
+    }
+    else {
+        const responseHandler = handleTranscriptionResponse_wrapper({ onPartial: recordPartialResult });
+        pendingTasks = responseHandler.pendingTasks;
+        try {
+            pythonNotesConvertor = spawnChildProcess_sync(pythonTranscriberPath, launchCommand = 'python',
+                args = [instrumentOptions], isAlive = processIsAlive, stdoutCallback = responseHandler.handleTranscriptionResponse);
+        } catch (err) {
+            // It might be possible for the process to report an error, but for some
+            // reason not getting teminated by itself.
+            if (processIsAlive.isAlive)  // In case it's still alive somehow.
+                pythonNotesConvertor.kill();
+            throw err;
+        }
     }
 
+    // With the fork-server, the PDFs of all the files are created together once they're transcribed, so 
+    // MuseScore renders them with a single launch (see saveUploadArtifacts()):
+    const batchArtifacts = consts.fork_server.enabled;
+    const transcribed = [];  // {file, dirPath, midiData} of the transcribed files.
+    const upload = { files: files.length, file: 0, current: null };  // The upload's progress (see get_upload_progress).
+    if (uploadId)
+        uploadProgress.set(uploadId, upload);
+
     // Main loop: Scan th files and handle each one:
     for (var file of files) {
         // Check the file's format:
@@ -232,6 +525,12 @@ async function convert_files_loop(files, idArr, nameArr, errorCodesArr, instrume
         // Log some information about the uploaded file:
         myLoggers.log(ENVS.ALL, `Server received file ${file.id}; MIME type: ${file.mimetype}; Original name: ${file.originalname}`);
 
+        // Track the file's progress through the partial results of its transcription:
+        upload.file = files.indexOf(file);
+        upload.current = { name: path.parse(file.originalname).name, progress: 0, eta_sec: null, notes: [] };
+        if (uploadId)
+            taskProgress.set(file.id, upload.current);
+
         // Saves the audio file and its data in a proper directory:
         try {
             // Create a directory for the file and its future conversions:
@@ -247,9 +546,15 @@ async function convert_files_loop(files, idArr, nameArr, errorCodesArr, instrume
             }
 
             // Convert and store the results:
-            await convertAudio(file, dirPath, pythonNotesConvertor, pendingTasks); 
-            idArr.push(file.id);
-            nameArr.push(path.parse(file.originalname).name);
+            if (batchArtifacts) {
+                const midiData = await transcribeAudio(file, dirPath, pythonNotesConvertor, pendingTasks);
+                transcribed.push({ file: file, dirPath: dirPath, midiData: midiData });
+            }
+            else {
+                await convertAudio(file, dirPath, pythonNotesConvertor, pendingTasks);
+                idArr.push(file.id);
+                nameArr.push(path.parse(file.originalname).name);
+            }
             // If consts["save_every_file"] is false then every T minutes delete the folder:
             if (!consts["save_every_file"])
                 f_handler.deleteDirectoryWithDelay(dirPath, consts['delete_files_timeout_millisec']);
@@ -263,17 +568,40 @@ async function convert_files_loop(files, idArr, nameArr, errorCodesArr, instrume
 
             continue; // Continue to the next file. 1 error shouldn't end the entire process.
         }
+        finally {
+            taskProgress.delete(file.id);
+        }
     }
+    upload.current = null;
+
+    // A daemon stays alive for the next uploads:
+    if (!useDaemon) {
+        // Tell the child process that no more message will be sent:
+        pythonNotesConvertor.stdin.end();
 
-    // Tell the child process that no more message will be sent:
-    pythonNotesConvertor.stdin.end();
+        // Kill pythonNotesConvertor if it's still running:
+        setTimeout(() => {
+            if (processIsAlive.isAlive) {
+                pythonNotesConvertor.kill();
+            }
+        }, 2000);  // Better to aim to 100 ms, but for some reason sys.exit(code) only executes after ~2000 ms.
+    }
 
-    // Kill pythonNotesConvertor if it's still running:
-    setTimeout(() => {
-        if (processIsAlive.isAlive) {
-            pythonNotesConvertor.kill();
+    // Create the PDFs and preview images of all the transcribed files at once:
+    if (transcribed.length === 0)
+        return;
+    const artifactErrors = await saveUploadArtifacts(transcribed);
+    transcribed.forEach(({ file, dirPath }, i) => {
+        const err = artifactErrors[i];
+        if (err) {
+            myLoggers.errorLog(ENVS.ALL, `id=${file.id}: ` + err.toString());
+            f_handler.deleteDirectorySync(dirPath);
+            errorCodesArr.push(err.hasOwnProperty('code') ? err.code : consts.status_codes.internal_server_error_code);
+            return;
         }
-    }, 2000);  // Better to aim to 100 ms, but for some reason sys.exit(code) only executes after ~2000 ms.
+        idArr.push(file.id);
+        nameArr.push(path.parse(file.originalname).name);
+    });
 }
 
 /**
@@ -330,6 +658,20 @@ function convertAudio(audioFile, audioDirPath, pyTranscriber, pendingTasks) {
     });
 }
 
+/**
+ * Save the given audio file (and its data json file) in the given directory and transcribe it into midi, 
+ * without creating its PDF and preview images (see saveUploadArtifacts()).
+ * Return a Promise with the midi meta-data json object (see transcribeToMidi()), or rejects on an error.
+ * @param {File} audioFile An audio file object to convert.
+ * @param {string} audioDirPath The directory in which to save the results.
+ * @param {object} pyTranscriber A python child process that transcribes the audio file into MIDI.
+ * @param {Map} pendingTasks A "Map" object (id -> TranscribeTask) to track the transcription tasks.
+ */
+async function transcribeAudio(audioFile, audioDirPath, pyTranscriber, pendingTasks) {
+    await save_file(audioFile, audioDirPath);
+    return transcribeToMidi(audioFile, audioDirPath, pyTranscriber, pendingTasks);
+}
+
 /**
  * Convert an audio file into a midi (transcribing) and return a json with its meta-data,
  * in the format of "TranscribedMidiData" class.
@@ -351,19 +693,25 @@ function convertAudio(audioFile, audioDirPath, pyTranscriber, pendingTasks) {
 function transcribeToMidi(audioFile, audioDirPath, pyTranscriber, pendingTasks) {
     return new Promise((resolve, reject) => {
         const taskId = audioFile.id;
-        // According to the AudioDataToTranscribe class in serialized_objects.py:
+        // According to the AudioDataToTranscribe class in serialized_objects.py. The audio is 
+        // sent only if it isn't saved in audioDirPath (the transcriber reads it from there):
+        // The transcriber stops the task by itself once its deadline passes:
         var dataToSend = {
             audio_dir_path: audioDirPath,
-            data: audioFile.buffer.toString("base64"),
-            id: taskId
+            data: consts["save_audio_file"] ? "" : audioFile.buffer.toString("base64"),
+            id: taskId,
+            deadline_ms: Date.now() + consts['transcription_timeout_ms']
         };
 
-        // A timeout event to reject the task after not receiving any response for too long:
+        // A timeout event to reject the task after not receiving any response for too long, and cancel it 
+        // (so the transcriber doesn't keep working on a result nobody will collect):
         const timer = setTimeout(() => {
             if (pendingTasks.has(taskId)) {
                 pendingTasks.get(taskId).rejecter(new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
                     `${currFilename}: Trasncription task \"${taskId}\" is rejected because timeout reached!`));
                 pendingTasks.delete(taskId);
+                if (pyTranscriber.stdin.writable)
+                    pyTranscriber.stdin.write(JSON.stringify({ control: "cancel", id: taskId }) + "\n");
             }
         }, consts['transcription_timeout_ms']);
 
@@ -382,8 +730,11 @@ function transcribeToMidi(audioFile, audioDirPath, pyTranscriber, pendingTasks)
  * A wrapper that initializes and then returns the callback function for the child process' 
  * stdout.on('data') event handler, and also returns a "Map" object (id -> TranscribeTask) to track 
  * the transcription tasks, which are checked and resolved/rejected by the returned callback function.
+ * @param {object} callbacks - (Optional) {onReady: function(), onControl: function(controlMsg), onPartial: function(partialMsg)}. 
+ * Called when the child process sends the consts["server_is_ready_msg"] message, for every control message (json), 
+ * and for every partial result of a running task (a data message with "partial": true, which doesn't end the task).
  * */
-function handleTranscriptionResponse_wrapper() {
+function handleTranscriptionResponse_wrapper(callbacks = {}) {
     const pendingTasks = new Map(); // {id -> TranscribeTask} Map for transcription tasks.
     let inBuffer = '';  // Holds the rechild process' stdout buffer (tasks' responses).
     const progName = path.basename(pythonTranscriberPath);
@@ -412,7 +763,24 @@ function handleTranscriptionResponse_wrapper() {
                 let receivedData = undefined;
                 try {
                     receivedData = JSON.parse(msg);
+                    if (receivedData.partial) {
+                        // A partial result (progress, ETA and notes) of a running task. The task isn't over yet.
+                        if (callbacks.onPartial)
+                            callbacks.onPartial(receivedData);
+                        continue;
+                    }
                     const taskId = receivedData.id;
+                    if (receivedData.code === consts["task_cancelled"] || receivedData.code === consts["task_timed_out"]) {
+                        // The transcriber stopped the task (cancelled, or past its deadline).
+                        const task = pendingTasks.get(taskId);
+                        if (task) {
+                            clearTimeout(task.timer);
+                            task.rejecter(new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
+                                `${currFilename}: Trasncription task \"${taskId}\" was stopped by the transcriber (code ${receivedData.code}).`));
+                            pendingTasks.delete(taskId);
+                        }
+                        continue;
+                    }
                     const audioDirPath = (taskId && pendingTasks.has(taskId)) ? pendingTasks.get(taskId).taskFolder : '';
                     if (!isValidMidiData(receivedData, audioDirPath)) {
                         myLoggers.errorLog(ENVS.DEVELOPMENT, `${currFilename} | id=${taskId}: The data returned from the transcriber is missing data.`);
@@ -452,9 +820,21 @@ function handleTranscriptionResponse_wrapper() {
                     // Else: The promise' task will reject itself after its timer times-out.
                 }
             }
+            else if (msg.startsWith(consts["STDIO_CTRL_MSG_PREFIX"])) {
+                // A control message (e.g. "pong").
+                try {
+                    const controlMsg = JSON.parse(msg.slice(consts["STDIO_CTRL_MSG_PREFIX"].length));
+                    if (callbacks.onControl)
+                        callbacks.onControl(controlMsg);
+                } catch (error) {
+                    myLoggers.errorLog(ENVS.DEVELOPMENT, `${currFilename}: Failed to parse a control message from ${progName}: ${msg}`);
+                }
+            }
             else {
                 // A log message.
                 myLoggers.log(ENVS.DEVELOPMENT, `${progName} process stdout: ${msg}`);
+                if (callbacks.onReady && msg.startsWith(consts["server_is_ready_msg"]))
+                    callbacks.onReady();
             }
         }
     }
@@ -501,13 +881,7 @@ function saveAsPdf(midiData, audioDirPath) {
             }
 
             let jsonData = JSON.parse(data);
-            const midi_path = path.join(audioDirPath, midiData.fnames[0]);
-            // Add the midi path file name to the json data file:
-            jsonData[consts["midi_key_in_jData"]] = midiData.fnames[0];
-
-            const pdfName = path.parse(jsonData[consts["media_key_in_jData"]]).name + consts['pdf_ext'];
-            const pdf_path = path.join(audioDirPath, pdfName);
-            const pdf_title = path.parse(jsonData[consts["download_key_in_jData"]]).name
+            const { midi_path, pdfName, pdf_path, pdf_title } = getPdfJob(jsonData, midiData, audioDirPath);
 
             // Spawn the python process that converts the midi into a PDF file and saves it to disc.
             let pdfGenerator;  // The process.
@@ -544,14 +918,103 @@ function saveAsPdf(midiData, audioDirPath) {
     });  // Promise
 }  // saveAsPdf
 
+/**
+ * Return the paths and the title of the PDF file of the given midi data, by the given data json (parsed) of the 
+ * audio directory, and add the midi file name to it: {midi_path, pdfName, pdf_path, pdf_title}.
+ * @param {object} jsonData The parsed data json file of the directory.
+ * @param {any} midiData The data to be saved as a PDF.
+ * @param {string} audioDirPath The directory in which to save the results.
+ */
+function getPdfJob(jsonData, midiData, audioDirPath) {
+    // Add the midi path file name to the json data file:
+    jsonData[consts["midi_key_in_jData"]] = midiData.fnames[0];
+
+    const pdfName = path.parse(jsonData[consts["media_key_in_jData"]]).name + consts['pdf_ext'];
+    return {
+        midi_path: path.join(audioDirPath, midiData.fnames[0]),
+        pdfName: pdfName,
+        pdf_path: path.join(audioDirPath, pdfName),
+        pdf_title: path.parse(jsonData[consts["download_key_in_jData"]]).name
+    };
+}
+
+/**
+ * Save the PDF files and the preview images of all the transcribed files of an upload, with a single python job 
+ * in the fork-server, so MuseScore renders all the PDFs with a single launch: an "artifacts" job with all the 
+ * directories if consts.fork_server.artifact_stage (see artifact_stage.py), or else a "pdf_batch" job (see 
+ * convert_to_pdf.py) followed by the images of every directory (see saveAsImage()). The data json files are 
+ * updated with the files' names.
+ * Return a Promise of an array with the error of every transcribed file, in order (null upon a success). Never rejects.
+ * @param {object[]} transcribed Array of {dirPath, midiData} of the transcribed files.
+ */
+async function saveUploadArtifacts(transcribed) {
+    const errors = transcribed.map(() => null);
+    const failed = (code) => new errbj.SpawnProcessError(consts["status_codes"]["internal_server_error_code"],
+        `Failed to create the PDF file and images, with the code: ${code}`);
+    try {
+        if (consts.fork_server.artifact_stage) {
+            const response = await runForkedJob("artifacts",
+                transcribed.flatMap(({ dirPath, midiData }) => [dirPath, midiData.fnames[0]]), true);
+            myLoggers.log(ENVS.DEVELOPMENT, `The artifact stage timings (sec):`, JSON.stringify(response.timings));
+            (response.codes || [response.code]).forEach((code, i) => {
+                if (code !== consts['convertion_success'])
+                    errors[i] = failed(code);
+            });
+            return errors;
+        }
+
+        // Read the data json files, then create all the PDFs with a single job:
+        const pdfJobs = await Promise.all(transcribed.map(async ({ dirPath, midiData }, i) => {
+            try {
+                const jDataFile = path.join(dirPath, jDataFileName);
+                const jsonData = JSON.parse(await fs.promises.readFile(jDataFile, 'utf8'));
+                return { index: i, jDataFile: jDataFile, jsonData: jsonData, ...getPdfJob(jsonData, midiData, dirPath) };
+            } catch (err) {
+                errors[i] = new errbj.SystemError(consts["status_codes"]["internal_server_error_code"],
+                    `Failed to open ${jDataFileName} file:\n${err}`);
+                return null;
+            }
+        })).then((jobs) => jobs.filter((job) => job !== null));
+        if (pdfJobs.length === 0)
+            return errors;
+        const response = await runForkedJob("pdf_batch",
+            pdfJobs.flatMap((job) => [job.midi_path, job.pdf_path, job.pdf_title]), true);
+
+        // Update the data json files of the created PDFs, and save their preview images:
+        await Promise.all(pdfJobs.map(async (job, k) => {
+            const code = response.codes ? response.codes[k] : response.code;
+            if (code !== consts['convertion_success']) {
+                errors[job.index] = failed(code);
+                return;
+            }
+            try {
+                job.jsonData[consts["pdf_key_in_jData"]] = job.pdfName;
+                await fs.promises.writeFile(job.jDataFile, JSON.stringify(job.jsonData), 'utf8');
+                await saveAsImage(transcribed[job.index].dirPath);
+            } catch (err) {
+                errors[job.index] = err;
+            }
+        }));
+    } catch (err) {
+        // The whole job failed:
+        for (let i = 0; i < errors.length; i++)
+            errors[i] = errors[i] || err;
+    }
+    return errors;
+}
+
 /**
  * Given a directory with a PDF file and a data json file, generate image files of the PDF 
  * pages, and save them in the directory. The name is based on data within the json data file, 
- * which will be updated with the images names. Spawns a python process to do all it.
+ * which will be updated with the images names. Spawns a python process to do all it (or runs it in a child of
+ * the fork-server, if consts.fork_server.enabled).
  * Return a Promise with the process summary output, or throws a "SpawnProcessError" object.
  * @param {string} audioDirPath  The directory with the PDF and json data file, and where the image is to be saved.
  */
 function saveAsImage(audioDirPath) {
+    if (consts.fork_server.enabled)
+        return runForkedJob("image", [audioDirPath]);
+
     const progName = path.basename(pythonImageGeneratorPath);
     // Spawn a python process that performs the image generation and saving.
     const pythonImgGen = spawn('python', [pythonImageGeneratorPath, audioDirPath]);
@@ -743,6 +1206,8 @@ module.exports = {
     get_pdf_by_id,
     get_midi_by_id,
     get_data_by_id,
+    get_upload_progress,
     upload_middleware,
-    post_audio_and_convert
+    post_audio_and_convert,
+    drainTranscriberDaemons
 }
\ No newline at end of file
@@ -29,6 +29,8 @@ const FilesTooHeavyMsg = `The uploaded files exceed the total size limit of ${Ma
 const FilesRemovedErrorMsg = 'The files are no longer available. Please upload again.';
 const PressConvertMsg = "Press on \"Convert\" to convert the file(s)"
 const UploadingMsg = "File uploaded";
+const ConvertingProgressMsg = (fileNum, filesCount, progress, etaSec) => `Converting file ${fileNum}/${filesCount}: ${Math.round(progress)}%` + 
+    (etaSec !== null && etaSec !== undefined ? ` (about ${Math.ceil(etaSec)} sec left)` : '');
 const UploadSucceededMsg = "Conversion Completed!" + (downloadTimeLimit_min >= 0 ? ` The notes will be available for download for the next ${Math.floor(downloadTimeLimit_min)} minutes.` : "");
 const UploadSucceededPartialMsg = "Conversion Completed! Some of the files could not be converted.";
 const UploadFailedMsg = "Upload Failed!";
@@ -38,6 +40,7 @@ const DownloadFailedMsg = "Download Failed!";
 const DownloadFailed500Msg = "Download Failed! Please try again in a moment.";
 
 const harassmentCooldownMS = 700  // cooldown time in milliseconds for the upload and download buttons.
+const progressPollMS = 1000  // How often (milliseconds) the progress of a converted upload is polled.
 const appearanceCls = "show";  // Class element that marks if buttons are hidden or not.
 
 // First setup:
@@ -49,7 +52,8 @@ let audioFileLst = [];
 const fetch_file_routes = {
     'data': '/file/data',
     'pdf': '/file/pdf',
-    'midi': '/file/midi'
+    'midi': '/file/midi',
+    'progress': '/file/progress'
 };
 
 // Adding events:
@@ -249,6 +253,9 @@ function uploadFiles(fileLst) {
     // Append choice for the number of instruments (1 or many):
     const instrumentsOpVal = document.querySelector('input[name="instruments_op"]:checked')?.value;
     formData.append('instrumentOptions', instrumentsOpVal);
+    // An id to poll the conversion's progress with, and show a preview of the notes meanwhile:
+    const uploadId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    formData.append('uploadId', uploadId);
     for (const file of fileLst) {
         // We get an array of objects: [{ name: 'instruments', value: x }, { name: 'file', value: file_1}, { name: 'file', value: file_2 }, ...]
         formData.append('file', file);
@@ -256,10 +263,12 @@ function uploadFiles(fileLst) {
 
     // Upload the file and fetch a preview image:
     const url = '/file';
+    const stopProgressPolling = pollUploadProgress(uploadId);
     fetch(url, {
         method: 'POST',
         body: formData
     })
+        .finally(() => stopProgressPolling())
         // Get a response and extract a JSON data (that should contain the preview images' IDs):
         .then((responsePost) => extractJsonFromUploadResponse(responsePost))
         // Get a json with the images' IDs, update the download buttons and fetch and show the image files:
@@ -272,6 +281,36 @@ function uploadFiles(fileLst) {
         });
 }
 
+// Poll the server for the progress of the upload "uploadId" while it's converted, and show it: the status 
+// message and a preview of the notes transcribed so far (until the preview image of the notes sheet arrives).
+// Return a function that stops the polling.
+function pollUploadProgress(uploadId) {
+    let fileIndex = -1;  // The file whose notes are in "notes".
+    let notes = [];
+    let stopped = false;
+    const timer = setInterval(() => {
+        fetch(`${fetch_file_routes.progress}/${uploadId}?file=${fileIndex}&notes_since=${notes.length}`, { method: 'GET' })
+            .then(response => response.ok ? response.json() : null)
+            .then(upload => {
+                if (stopped || !upload || !upload.current)
+                    return;
+                if (upload.file !== fileIndex) {
+                    fileIndex = upload.file;
+                    notes = [];
+                }
+                notes.push(...upload.current.notes);
+                updateUploadingStatus(ConvertingProgressMsg(upload.file + 1, upload.files, upload.current.progress, upload.current.eta_sec), 'flex');
+                if (notes.length > 0)
+                    showNotesPreview(notes);
+            })
+            .catch(() => { });  // The progress is optional. The upload's response tells the result.
+    }, progressPollMS);
+    return () => {
+        stopped = true;
+        clearInterval(timer);
+    };
+}
+
 // Get a response from the server, check its status and return the 
 // response's json, or throw an exception with a proper message.
 function extractJsonFromUploadResponse(response) {
@@ -645,6 +684,27 @@ function updateDownloadingStatus(newMsg) {
     downloadStatusMessage.textContent = newMsg;
 }
 
+// Show a preview of partially transcribed notes, given as [start_sec, end_sec, pitch, velocity, program] 
+// lists: a piano-roll of the notes, drawn in the preview image.
+function showNotesPreview(notes) {
+    const canvas = document.createElement('canvas');
+    canvas.width = 800;
+    canvas.height = 300;
+    const ctx = canvas.getContext('2d');
+    const endSec = Math.max(...notes.map(note => note[1]), 1);
+    const lowPitch = Math.min(...notes.map(note => note[2])) - 1, highPitch = Math.max(...notes.map(note => note[2])) + 1;
+    const noteHeight = canvas.height / (highPitch - lowPitch + 1);
+    ctx.fillStyle = '#ffffff';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    ctx.fillStyle = '#333333';
+    for (const [start, end, pitch] of notes) {
+        ctx.fillRect(start / endSec * canvas.width, (highPitch - pitch) * noteHeight,
+            Math.max(2, (end - start) / endSec * canvas.width), Math.max(1, noteHeight - 1));
+    }
+    previewImage.src = canvas.toDataURL();
+    previewImage.classList.remove('hidden');
+}
+
 // Show the preview images to the user, given by image-blobs (files).
 function showPreviewImages(imgBlobArr) {
     const imageUrl = URL.createObjectURL(imgBlobArr[0]);
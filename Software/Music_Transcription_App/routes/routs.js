@@ -32,6 +32,9 @@ router.get('/file/midi/:id', f_controller.get_midi_by_id);
 /* Get a json data object by id. */
 router.get('/file/data/:id', f_controller.get_data_by_id);
 
+/* Get the progress of an upload that is being converted, by its id. */
+router.get('/file/progress/:id', f_controller.get_upload_progress);
+
 /* Post an audio file. */
 router.post('/file', f_controller.upload_middleware, f_controller.post_audio_and_convert);
 
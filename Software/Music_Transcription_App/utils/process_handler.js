@@ -66,7 +66,9 @@ function spawnChildProcess_sync(progPath, launchCommand = 'python', args = [], i
         else {
             try {
                 stdoutCallback(data);
-            } catch (e) { }
+            } catch (e) {
+                myLoggers.errorLog(ENVS.ALL, `${progName} process stdout callback failed: ${e}`);
+            }
         }
     });
 